@@ -1,5 +1,12 @@
 #import flap
-from .flap_apdcam_code import register
+from .flap_apdcam_code import register, iter_apdcam_chunks, apdcam_invalidate_cache, apdcam_metadata_cache_size
+from .flap_apdcam_code import iter_apdcam_shots, apdcam_get_data_multishot, apdcam_raw_channels
+from .apdcam_overview import apdcam_build_overview, apdcam_overview
+from .apdcam_compressed import apdcam_compress_shot
+from .apdcam_container import apdcam_convert_to_container
+from .apdcam_profile import APDCAM_profile, apdcam_global_profile
+from .apdcam_fir import APDCAM_fir_decimator
+from .apdcam_stats import apdcam_build_stats, apdcam_stats
 from .apdcam_control.apdcam_types_versions import *
 from .apdcam_control.apdcam10g_control_gui import gui
 
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Lossless compressed channel files for APDCAM measurements.
+
+Each Channel_XXX.dat (ChannelXX.dat for APDCAM-1G) file can be replaced by a Channel_XXX.apz
+file with the same data. The file is divided into chunks of fixed number of samples.
+In each chunk the first sample is stored, the differences of consecutive samples are
+zigzag coded, bit packed with the smallest sufficient bit width and deflate compressed.
+The chunk index in the file header gives the position of each chunk, so any sample range
+can be read by decompressing only the chunks containing it.
+
+File layout (little endian):
+    header: magic 'APZ1' (4 bytes), version (uint16), chunk samples (uint32),
+            number of samples (uint64), number of chunks (uint32)
+    index: number of chunks + 1 file offsets (uint64), chunk i is between offset i and i+1
+    chunks: zlib compressed [first sample (int16), bit width (uint8), packed differences]
+
+apdcam_compress_shot() converts a measurement, apdcam_read_channel() reads the .apz file
+if the .dat file is not present.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import struct
+import zlib
+import shutil
+import threading
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from .apdcam_profile import profile_io
+
+_magic = b'APZ1'
+_version = 1
+_header = struct.Struct('<4sHIQI')
+_chunk_header = struct.Struct('<hB')
+
+def apdcam_compressed_name(filename):
+    """
+    Returns the compressed file name for a channel file name.
+    """
+    return os.path.splitext(filename)[0] + '.apz'
+
+def _encode_chunk(d, level):
+    """
+    Compresses one chunk of int16 samples.
+    """
+    diff = np.diff(d.astype(np.int32))
+    # Zigzag coding: 0,-1,1,-2,2... -> 0,1,2,3,4...
+    zz = ((diff << 1) ^ (diff >> 31)).astype(np.uint32)
+    if (len(zz) == 0):
+        width = 0
+    else:
+        width = int(np.amax(zz)).bit_length()
+    if (width == 0):
+        packed = b''
+    else:
+        bits = ((zz[:,np.newaxis] >> np.arange(width,dtype=np.uint32)) & 1).astype(np.uint8)
+        packed = np.packbits(bits.ravel(),bitorder='little').tobytes()
+    return zlib.compress(_chunk_header.pack(int(d[0]),width) + packed,level)
+
+def _decode_chunk(buf, n, out):
+    """
+    Decompresses one chunk of n samples into out.
+    """
+    raw = zlib.decompress(buf)
+    first, width = _chunk_header.unpack_from(raw)
+    if (width == 0):
+        out[:n] = first
+        return
+    bits = np.unpackbits(np.frombuffer(raw,dtype=np.uint8,offset=_chunk_header.size),
+                         count=(n - 1) * width,bitorder='little')
+    zz = bits.reshape(n - 1,width).astype(np.uint32) @ (np.uint32(1) << np.arange(width,dtype=np.uint32))
+    diff = (zz >> 1).astype(np.int64) ^ -(zz & 1).astype(np.int64)
+    out[0] = first
+    np.cumsum(diff,out=diff)
+    diff += first
+    out[1:n] = diff
+
+class APDCAM_compressed_channel:
+    """
+    An open compressed channel file. Use apdcam_compressed_channel() to get one.
+
+    Attributes
+    ----------
+    filename : string
+        The file name.
+    chunk_samples : int
+        The number of samples in one chunk.
+    nsample : int
+        The number of samples in the file.
+    offsets : numpy array
+        The file offset of each chunk and the end of the last chunk.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename,'rb') as f:
+                magic, version, self.chunk_samples, self.nsample, nchunk = _header.unpack(f.read(_header.size))
+                if ((magic != _magic) or (version != _version)):
+                    raise IOError("Invalid compressed channel file: " + filename)
+                self.offsets = np.frombuffer(f.read((nchunk + 1) * 8),dtype='<u8').astype(np.int64)
+        except (OSError,struct.error):
+            raise IOError("Error reading compressed channel file: " + filename)
+        if (len(self.offsets) != nchunk + 1):
+            raise IOError("Error reading compressed channel file: " + filename)
+
+    def read(self, start, count, out=None, threads=1):
+        """
+        Reads count samples from start.
+
+        Parameters
+        ----------
+        start : int
+            The first sample.
+        count : int
+            The number of samples.
+        out : numpy array of int16, optional
+            The samples are written into this array.
+        threads : int, optional
+            The number of threads decompressing the chunks. The default is 1.
+
+        Returns
+        -------
+        numpy array of int16
+            The samples. This is out if it was set.
+
+        """
+        if (out is None):
+            out = np.empty(count,dtype=np.int16)
+        if ((start < 0) or (start + count > self.nsample)):
+            raise IOError("Error reading from file: " + self.filename)
+        if (count == 0):
+            return out
+        cs = self.chunk_samples
+        c_first = start // cs
+        c_last = (start + count - 1) // cs
+        try:
+            with open(self.filename,'rb') as f:
+                f.seek(int(self.offsets[c_first]))
+                data = f.read(int(self.offsets[c_last + 1] - self.offsets[c_first]))
+        except OSError:
+            raise IOError("Error reading from file: " + self.filename)
+        profile_io(len(data),opens=1)
+        base = self.offsets[c_first]
+
+        def decode(c):
+            n = min(cs,self.nsample - c * cs)
+            buf = data[self.offsets[c] - base:self.offsets[c + 1] - base]
+            s0 = max(start,c * cs)
+            s1 = min(start + count,c * cs + n)
+            if ((s0 == c * cs) and (s1 == c * cs + n)):
+                # The whole chunk is needed, decoding directly into the output
+                _decode_chunk(buf,n,out[s0 - start:s1 - start])
+            else:
+                d = np.empty(n,dtype=np.int16)
+                _decode_chunk(buf,n,d)
+                out[s0 - start:s1 - start] = d[s0 - c * cs:s1 - c * cs]
+
+        chunks = range(c_first,c_last + 1)
+        if ((threads is None) or (threads <= 1) or (len(chunks) == 1)):
+            for c in chunks:
+                decode(c)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(decode,chunks))
+        return out
+
+_channel_cache = collections.OrderedDict()
+_channel_cache_lock = threading.Lock()
+_channel_cache_size = 1024
+
+def apdcam_compressed_channel(filename):
+    """
+    Returns the APDCAM_compressed_channel for a compressed file. The header and index are
+    read only once while the file is unchanged.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        raise IOError("Error opening file: " + filename)
+    key = os.path.abspath(filename)
+    stamp = (st.st_mtime_ns,st.st_size)
+    with _channel_cache_lock:
+        entry = _channel_cache.get(key)
+        if ((entry is not None) and (entry[0] == stamp)):
+            _channel_cache.move_to_end(key)
+            return entry[1]
+    ch = APDCAM_compressed_channel(filename)
+    with _channel_cache_lock:
+        _channel_cache[key] = (stamp,ch)
+        while (len(_channel_cache) > _channel_cache_size):
+            _channel_cache.popitem(last=False)
+    return ch
+
+def apdcam_compress_channel(filename, outfile=None, chunk_samples=65536, level=6, threads=1):
+    """
+    Compresses a channel file.
+
+    Parameters
+    ----------
+    filename : string
+        The .dat channel file.
+    outfile : string, optional
+        The compressed file. The default is the channel file name with .apz extension.
+    chunk_samples : int, optional
+        The number of samples in a chunk. The default is 65536.
+    level : int, optional
+        The zlib compression level. The default is 6.
+    threads : int, optional
+        The number of threads compressing the chunks. The default is 1.
+
+    Returns
+    -------
+    string
+        The name of the compressed file.
+
+    """
+    if (outfile is None):
+        outfile = apdcam_compressed_name(filename)
+    try:
+        d = np.memmap(filename,dtype=np.int16,mode='r')
+    except (OSError,ValueError):
+        raise IOError("Error mapping file: " + filename)
+    nsample = len(d)
+    nchunk = (nsample + chunk_samples - 1) // chunk_samples
+    def encode(c):
+        return _encode_chunk(np.array(d[c * chunk_samples:(c + 1) * chunk_samples]),level)
+    offsets = np.zeros(nchunk + 1,dtype='<u8')
+    tmpfile = outfile + '.tmp'
+    with open(tmpfile,'wb') as f:
+        f.write(_header.pack(_magic,_version,chunk_samples,nsample,nchunk))
+        f.write(offsets.tobytes())
+        pos = _header.size + offsets.nbytes
+        # The chunks are processed in groups to limit the memory
+        group = max(1,threads) * 16
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+            for g in range(0,nchunk,group):
+                for i,buf in enumerate(executor.map(encode,range(g,min(g + group,nchunk)))):
+                    offsets[g + i] = pos
+                    f.write(buf)
+                    pos += len(buf)
+        offsets[nchunk] = pos
+        f.seek(_header.size)
+        f.write(offsets.tobytes())
+    os.replace(tmpfile,outfile)
+    return outfile
+
+def apdcam_compress_shot(datapath, outpath=None, chunk_samples=65536, level=6, threads=1, verify=True,
+                         remove_original=False):
+    """
+    Converts the channel files of a measurement to compressed files.
+    apdcam_get_data reads the compressed files if the .dat files are not present.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+    outpath : string, optional
+        The directory of the compressed measurement. The xml file is copied here.
+        The default is datapath.
+    chunk_samples : int, optional
+        The number of samples in a chunk. The default is 65536.
+    level : int, optional
+        The zlib compression level. The default is 6.
+    threads : int, optional
+        The number of threads compressing the chunks. The default is 1.
+    verify : bool, optional
+        Read back each compressed file and compare with the original. The default is True.
+    remove_original : bool, optional
+        Delete the .dat files after compression. Only possible if outpath is datapath and verify is True.
+        The default is False.
+
+    Returns
+    -------
+    ratio : float
+        The total compressed size relative to the original.
+
+    """
+    if (outpath is None):
+        outpath = datapath
+    same_dir = os.path.abspath(outpath) == os.path.abspath(datapath)
+    if (remove_original and not (same_dir and verify)):
+        raise ValueError("remove_original is possible only when compressing in place with verify.")
+    fnames = sorted(f for f in os.listdir(datapath) if (f[:7] == 'Channel') and (f[-4:] == '.dat'))
+    if (len(fnames) == 0):
+        raise IOError("No channel files found in {:s}".format(datapath))
+    if (not same_dir):
+        os.makedirs(outpath,exist_ok=True)
+        shutil.copy2(os.path.join(datapath,'APDCAM_config.xml'),outpath)
+    size_orig = 0
+    size_comp = 0
+    for fn in fnames:
+        infile = os.path.join(datapath,fn)
+        outfile = apdcam_compressed_name(os.path.join(outpath,fn))
+        apdcam_compress_channel(infile,outfile,chunk_samples=chunk_samples,level=level,threads=threads)
+        size_orig += os.path.getsize(infile)
+        size_comp += os.path.getsize(outfile)
+        if (verify):
+            d = np.fromfile(infile,dtype=np.int16)
+            ch = apdcam_compressed_channel(outfile)
+            if ((ch.nsample != len(d)) or not np.array_equal(ch.read(0,len(d),threads=threads),d)):
+                raise IOError("Compressed file is different from the original: " + outfile)
+            del d
+    if (remove_original):
+        for fn in fnames:
+            os.remove(os.path.join(datapath,fn))
+    return size_comp / max(size_orig,1)
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Single file container for APDCAM measurements.
+
+The container APDCAM_shot.apc replaces the channel files and the xml file of a measurement.
+The samples are stored sample-major: all channels of a sample after each other, then the
+next sample. This way a time interval of all channels, even a single sample, is one
+contiguous read of count * number of channels * 2 bytes. Reading a few channels reads
+the whole rows of the time interval, in large sequential pieces. The file is written in
+time blocks of block_samples samples, the block index gives their offsets.
+
+File layout (little endian):
+    magic 'APC1' (4 bytes), version (uint16), header length (uint32)
+    header: JSON text with
+        'xml': The APDCAM_config.xml text
+        'files': The channel file names in the order of the channels in the blocks
+        'adc': The ADC channel number for each channel
+        'samplenumber': The number of samples of each channel
+        'block_samples': The number of samples of each channel in a block. The last
+                         block can be shorter.
+    block index: number of blocks + 1 file offsets (uint64), block i is between offset i and i+1
+    blocks: int16 array of shape (samples in the block, number of channels)
+
+apdcam_convert_to_container() converts a measurement, apdcam_get_data reads the container
+only if the data directory does not contain APDCAM_config.xml.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import json
+import struct
+import threading
+import collections
+
+import numpy as np
+
+from .apdcam_profile import profile_io
+
+container_filename = 'APDCAM_shot.apc'
+_magic = b'APC1'
+_version = 2
+_prefix = struct.Struct('<4sHI')
+# The largest block of data read at once [bytes]
+_max_read = 64 * 2 ** 20
+
+def apdcam_convert_to_container(datapath, outpath=None, block_samples=16384, remove_original=False):
+    """
+    Converts a measurement from channel files to the single file container.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+    outpath : string, optional
+        The directory where the container is written. The default is datapath.
+    block_samples : int, optional
+        The number of samples written in one block. The default is 16384.
+    remove_original : bool, optional
+        Delete the channel files and the xml file after conversion. Only possible if outpath
+        is datapath. The default is False.
+        apdcam_get_data reads the container only if there is no APDCAM_config.xml in the
+        directory. If the originals are kept in datapath they are read and the container is
+        not used, write it to another directory (outpath) or remove the originals to read it.
+
+    Returns
+    -------
+    string
+        The name of the container file.
+
+    """
+    if (outpath is None):
+        outpath = datapath
+    same_dir = os.path.abspath(outpath) == os.path.abspath(datapath)
+    if (remove_original and not same_dir):
+        raise ValueError("remove_original is possible only if the container is written to datapath.")
+    xmlfile = os.path.join(datapath,'APDCAM_config.xml')
+    try:
+        with open(xmlfile,'rt') as f:
+            xml_text = f.read()
+    except OSError:
+        raise IOError("Error reading XML file:" + xmlfile)
+    fnames = sorted(f for f in os.listdir(datapath) if (f[:7] == 'Channel') and (f[-4:] == '.dat'))
+    if (len(fnames) == 0):
+        raise IOError("No channel files found in {:s}".format(datapath))
+    nsample = min(os.path.getsize(os.path.join(datapath,fn)) for fn in fnames) // 2
+    nch = len(fnames)
+    adc = [int(fn[7:-4].lstrip('_')) + 1 for fn in fnames]
+    header = json.dumps({'xml':xml_text,
+                         'files':fnames,
+                         'adc':adc,
+                         'samplenumber':nsample,
+                         'block_samples':block_samples
+                         }).encode('utf-8')
+    nblock = (nsample + block_samples - 1) // block_samples
+    offsets = np.zeros(nblock + 1,dtype='<u8')
+    pos = _prefix.size + len(header) + offsets.nbytes
+    for b in range(nblock + 1):
+        offsets[b] = pos + min(b * block_samples,nsample) * nch * 2
+
+    os.makedirs(outpath,exist_ok=True)
+    outfile = os.path.join(outpath,container_filename)
+    tmpfile = outfile + '.tmp'
+    files = [open(os.path.join(datapath,fn),'rb',buffering=0) for fn in fnames]
+    try:
+        with open(tmpfile,'wb') as f:
+            f.write(_prefix.pack(_magic,_version,len(header)))
+            f.write(header)
+            f.write(offsets.tobytes())
+            tile = np.empty((nch,block_samples),dtype=np.int16)
+            for b in range(nblock):
+                n = min(block_samples,nsample - b * block_samples)
+                t = tile[:,:n]
+                for i_ch in range(nch):
+                    buf = memoryview(t[i_ch]).cast('B')
+                    if (files[i_ch].readinto(buf) != len(buf)):
+                        raise IOError("Error reading {:s}".format(fnames[i_ch]))
+                # Written sample-major
+                f.write(np.ascontiguousarray(t.T).astype('<i2',copy=False).tobytes())
+    finally:
+        for fd in files:
+            fd.close()
+    os.replace(tmpfile,outfile)
+    if (remove_original):
+        for fn in fnames:
+            os.remove(os.path.join(datapath,fn))
+        os.remove(xmlfile)
+    _container_invalidate(outpath)
+    return outfile
+
+class APDCAM_container:
+    """
+    An open container file. Use apdcam_container() to get one.
+
+    Attributes
+    ----------
+    filename : string
+        The container file name.
+    xml_text : string
+        The text of APDCAM_config.xml.
+    files : list of strings
+        The channel file names, in the order of the channels in the blocks.
+    column : dict
+        The index of each channel file name in files.
+    adc : list of ints
+        The ADC channel number for each channel.
+    samplenumber : int
+        The number of samples of each channel.
+    block_samples : int
+        The number of samples in one block.
+    offsets : numpy array
+        The file offset of each block and the end of the last block.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename,'rb') as f:
+                magic, version, header_len = _prefix.unpack(f.read(_prefix.size))
+                if ((magic != _magic) or (version != _version)):
+                    raise IOError("Invalid APDCAM container file: " + filename)
+                header = json.loads(f.read(header_len).decode('utf-8'))
+                self.xml_text = header['xml']
+                self.files = header['files']
+                self.adc = header['adc']
+                self.samplenumber = header['samplenumber']
+                self.block_samples = header['block_samples']
+                nblock = (self.samplenumber + self.block_samples - 1) // self.block_samples
+                self.offsets = np.frombuffer(f.read((nblock + 1) * 8),dtype='<u8').astype(np.int64)
+        except (OSError,ValueError,KeyError,struct.error):
+            raise IOError("Error reading APDCAM container file: " + filename)
+        if (len(self.offsets) != nblock + 1):
+            raise IOError("Error reading APDCAM container file: " + filename)
+        self.column = {fn:i for i,fn in enumerate(self.files)}
+
+    def read_channels(self, fnames, start, count, out=None):
+        """
+        Reads samples of multiple channels.
+
+        Parameters
+        ----------
+        fnames : list of strings
+            The channel file names.
+        start : int or array of ints
+            The first sample to read. If an array, count samples are read from each start
+            and returned after each other.
+        count : int
+            The number of samples to read from each start.
+        out : numpy array of int16, optional
+            Array of shape (count times the number of starts, number of channels).
+            The samples are read into this array.
+
+        Returns
+        -------
+        numpy array of int16
+            The samples, the second dimension is the channel. This is out if it was set.
+
+        """
+        starts = np.array(start,dtype=np.int64).flatten()
+        try:
+            cols = [self.column[fn] for fn in fnames]
+        except KeyError as e:
+            raise IOError("Channel {:s} is not in file {:s}".format(str(e),self.filename))
+        if (out is None):
+            out = np.empty((len(starts) * count,len(cols)),dtype=np.int16)
+        nch = len(self.files)
+        row_bytes = nch * 2
+        # The samples are read in pieces of at most this many rows
+        rows_per_read = max(1,_max_read // row_bytes)
+        try:
+            f = open(self.filename,'rb',buffering=0)
+        except OSError:
+            raise IOError("Error opening file: " + self.filename)
+        profile_io(0,opens=1)
+        try:
+            for i_start,s in enumerate(starts):
+                if ((s < 0) or (s + count > self.samplenumber)):
+                    raise IOError("Error reading from file: " + self.filename)
+                o = out[i_start * count:(i_start + 1) * count]
+                for r0 in range(s,s + count,rows_per_read):
+                    r1 = min(r0 + rows_per_read,s + count)
+                    raw = self._read(f,self.offsets[0] + r0 * row_bytes,(r1 - r0) * row_bytes).reshape(r1 - r0,nch)
+                    o[r0 - s:r1 - s] = raw[:,cols]
+        finally:
+            f.close()
+        return out
+
+    def _read(self, f, pos, nbytes):
+        """
+        Reads nbytes from pos as int16.
+        """
+        buf = np.empty(int(nbytes) // 2,dtype='<i2')
+        try:
+            f.seek(int(pos))
+            mv = memoryview(buf).cast('B')
+            nread = 0
+            while (nread < len(mv)):
+                n = f.readinto(mv[nread:])
+                if (not n):
+                    break
+                nread += n
+        except OSError:
+            raise IOError("Error reading from file: " + self.filename)
+        if (nread != len(mv)):
+            raise IOError("Error reading from file: " + self.filename)
+        profile_io(nread)
+        return buf
+
+_container_cache = collections.OrderedDict()
+_container_cache_lock = threading.Lock()
+_container_cache_size = 64
+
+def _container_invalidate(datapath):
+    with _container_cache_lock:
+        _container_cache.pop(os.path.abspath(os.path.join(datapath,container_filename)),None)
+
+def apdcam_container(datapath):
+    """
+    Returns the container in a data directory, or None if there is no container.
+    The header is read only once while the file is unchanged.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+
+    Returns
+    -------
+    APDCAM_container or None
+
+    """
+    filename = os.path.abspath(os.path.join(datapath,container_filename))
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns,st.st_size)
+    with _container_cache_lock:
+        entry = _container_cache.get(filename)
+        if ((entry is not None) and (entry[0] == stamp)):
+            _container_cache.move_to_end(filename)
+            return entry[1]
+    c = APDCAM_container(filename)
+    with _container_cache_lock:
+        _container_cache[filename] = (stamp,c)
+        while (len(_container_cache) > _container_cache_size):
+            _container_cache.popitem(last=False)
+    return c
@@ -19,6 +19,10 @@ import numpy as np
 #import struct
 #import sys
 
+from .apdcam10g_packet_decoder import APDCAM10G_packet_decoder
+from .apdcam10g_capture import APDCAM10G_stream_capture, apdcam10g_parse_headers
+from .apdcam10g_continuity import APDCAM10G_packet_sequencer, apdcam10g_invalid_samples, MAX_PACKET_LOSS
+
 
 def DAC_ADC_channel_mapping():
     """ returns the ADC channel numbers (1...32) for each of the 32 DAC channel numbers     
@@ -2140,7 +2144,9 @@ class APDCAM10G_regCom:
         str
             "" or error message
         str
-            Warning. "" if no warning.
+            Warning. "" if no warning. With the 'Python' data receiver this reports the incomplete streams,
+            lost, reordered, late and duplicate packets and the number of invalid samples.
+            The sample validity is saved in APDCAM_valid.npz.
 
         """
         self.readStatus(dataOnly=True)
@@ -2309,6 +2315,14 @@ class APDCAM10G_regCom:
             err, warn = data_receiver.getData()
             data_receiver.stopStream()
             data_receiver.stopReceive()
+            if (err != ""):
+                return err,warn
+            self.measurePara.numberOfSamples = numberOfSamples
+            self.measurePara.channelMasks = copy.deepcopy(chmask)
+            self.measurePara.externalTriggerPolarity = externalTriggerPolarity
+            self.measurePara.internalTrigger = internalTrigger
+            self.measurePara.triggerDelay = triggerDelay
+            err = data_receiver.writeData(datapath)
             return err,warn
             
         if (waitForResult <=0):
@@ -2481,6 +2495,10 @@ class APDCAM10G_data:
     IPV4_HEADER = 20
     UDP_HEADER = 8
     CC_STREAMHEADER = 22
+    RING_BUFFER_SIZE = 256 * 2 ** 20 # The maximum size of the packet buffer of a stream [bytes]
+    RECEIVE_BATCH = 256 # The number of packets received from one stream at once
+    USE_RECVMMSG = True # Receive multiple packets with one system call on Linux
+    REORDER_WINDOW = 64 # A missing packet is waited for until this many later packets arrive
                 
     def __init__(self,APDCAM):
         """
@@ -2532,18 +2550,22 @@ class APDCAM10G_data:
         for i in range(len(self.APDCAM.status.ADC_address)):
             for ic in range(4):
                 chip_chmask = (channel_masks[i] >> ic * 8) % 256
-                chip_bits_per_sample = bits *  chip_chmask.bit_length()
+                chip_bits_per_sample = bits *  bin(chip_chmask).count("1")
                 if ((chip_bits_per_sample % 8) == 0):
                     chip_bytes_per_sample = chip_bits_per_sample // 8
                 else:
                     chip_bytes_per_sample = chip_bits_per_sample // 8 + 1        
                 self.bytes_per_sample[i] += chip_bytes_per_sample
             if ((self.bytes_per_sample[i] * 8) % 32 != 0):
-               self.bytes_per_sample[i] = ((self.bytes_per_sample[i] * 8) // 32 + 1) * 32 / 8
+               self.bytes_per_sample[i] = ((self.bytes_per_sample[i] * 8) // 32 + 1) * 32 // 8
             if (self.bytes_per_sample[i] * self.sample_number % (self.octet * 8) == 0):
                 self.packets_per_adc[i] = self.bytes_per_sample[i] * self.sample_number // (self.octet * 8) 
             else:
-                self.packets_per_adc[i] = self.bytes_per_sample[i] * self.sample_number // (self.octet * 8)
+                self.packets_per_adc[i] = self.bytes_per_sample[i] * self.sample_number // (self.octet * 8) + 1
+        # The sample decoder for each ADC board
+        self.decoders = [APDCAM10G_packet_decoder(channel_masks[i],bits,self.bytes_per_sample[i],
+                                                  header_size=APDCAM10G_data.CC_STREAMHEADER)
+                         for i in range(len(self.APDCAM.status.ADC_address))]
         self.APDCAM.setSampleNumber(sampleNumber=sample_number)
         
 # 		map_locked = MAP_LOCKED;
@@ -2736,18 +2758,26 @@ class APDCAM10G_data:
         self.packet_counter = [0] * 4
         self.packet_numbers = [None] * 4
         self.packet_times = [None] * 4
+        self.captures = [None] * 4
+        self.sequencers = [None] * 4
+        self.sample_valid = [None] * len(self.APDCAM.status.ADC_address)
+        self.channel_data = [None] * len(self.APDCAM.status.ADC_address)
+        self.sample_counter = [0] * len(self.APDCAM.status.ADC_address)
+        for i in range(len(self.APDCAM.status.ADC_address)):
+            self.decoders[i].reset()
+            self.channel_data[i] = np.zeros((self.sample_number,len(self.decoders[i].channels)),dtype=np.int16)
         if (self.APDCAM.dualSATA):
             for i in range(len(self.APDCAM.status.ADC_address)):
                 self.stream_list[i * 2] =  True
                 self.stream_adc[i * 2] = i
-                self.packet_numbers[i * 2] = np.zeros(self.packets_per_adc[self.stream_adc[i*2]],dtype=np.uint32)
+                self.packet_numbers[i * 2] = np.zeros(self.packets_per_adc[self.stream_adc[i*2]],dtype=np.uint64)
                 self.packet_times[i * 2] = np.zeros(self.packets_per_adc[self.stream_adc[i*2]],dtype=float)
         else:
             for i in range(len(self.APDCAM.status.ADC_address)):
                 self.stream_list[i] =  True  
                 self.stream_adc[i] = i
-                self.packet_numbers[i] = np.zeros(self.packets_per_adc[self.stream_adc[i*2]],dtype=np.uint32)
-                self.packet_times[i] = np.zeros(self.packets_per_adc[self.stream_adc[i*2]],dtype=float)
+                self.packet_numbers[i] = np.zeros(self.packets_per_adc[self.stream_adc[i]],dtype=np.uint64)
+                self.packet_times[i] = np.zeros(self.packets_per_adc[self.stream_adc[i]],dtype=float)
         for i in range(4) :
             if (self.stream_list[i] == True) :
                 try:
@@ -2826,45 +2856,237 @@ class APDCAM10G_data:
 
     def getData(self):
         """
-        Get UDP data from a stream.
-
-        Parameters
-        ----------
-        streamNo : int
-            The stream number (0...3).
+        Receives the UDP data of all active streams and decodes the samples into
+        self.channel_data. Each stream is received by its own thread into its own ring buffer,
+        this method waits for all of them. The statistics of the streams are in self.stream_stats.
 
         Returns
         -------
         str:
             "" or error message.
+        str:
+            "" or warning.
 
         """
-                
         packet_size = APDCAM10G_data.CC_STREAMHEADER + self.octet * 8
-        stream_running = [True] * 4
-        while (stream_running[0] or stream_running[1] or stream_running[2] or stream_running[3]):
-            for i_stream in range(4):
-                if (self.stream_list[i_stream] and stream_running[i_stream] \
-                       and (self.packet_counter[i_stream] < self.packets_per_adc[self.stream_adc[i_stream]]) \
-                    ):
-                    try:
-                        data = self.receiveSockets[i_stream].recv(packet_size)
-                        if (len(data) == 0):
-                            continue
-                        if (len(data) != packet_size):
-                            print("Data size is not equal to packet size.")
-                        self.packet_times[i_stream][self.packet_counter[i_stream]] = time.time()
-                        self.packet_numbers[i_stream][self.packet_counter[i_stream]] = int.from_bytes(data[8:14],'big')
-                        self.packet_counter[i_stream] += 1
-                    except socket.error as se :
-                        stream_running[i_stream] = False
-                else:
-                    stream_running[i_stream] = False
+        # The ring buffer of each stream holds the whole measurement if it is not too large
+        for i_stream in range(4):
+            if (self.stream_list[i_stream]):
+                slots = min(self.packets_per_adc[self.stream_adc[i_stream]] + 1,
+                            max(APDCAM10G_data.RING_BUFFER_SIZE // packet_size,APDCAM10G_data.RECEIVE_BATCH))
+                self.captures[i_stream] = APDCAM10G_stream_capture(self.receiveSockets[i_stream],packet_size,slots,
+                                                                   use_recvmmsg=APDCAM10G_data.USE_RECVMMSG)
+                self.sequencers[i_stream] = APDCAM10G_packet_sequencer(packet_size,
+                                                                       reorder_window=APDCAM10G_data.REORDER_WINDOW,
+                                                                       max_packet_loss=MAX_PACKET_LOSS)
+        # One receiver thread for each stream, recv_into and the decoding release the GIL
+        self.stream_stats = [None] * 4
+        workers = []
+        for i_stream in range(4):
+            if (self.stream_list[i_stream]):
+                self.stream_stats[i_stream] = {'packets':0,
+                                               'expected_packets':self.packets_per_adc[self.stream_adc[i_stream]],
+                                               'short_packets':0,
+                                               'start_time':None,
+                                               'end_time':None,
+                                               'completed':False,
+                                               'error':"",
+                                               'lost_packets':0,
+                                               'gaps':[],
+                                               'invalid_samples':0,
+                                               'reordered_packets':0,
+                                               'late_packets':0,
+                                               'duplicate_packets':0,
+                                               'recvmmsg':self.captures[i_stream].use_recvmmsg
+                                               }
+                w = threading.Thread(target=self.receiveStream,args=(i_stream,),
+                                     name="APDCAM10G stream {:d}".format(i_stream + 1))
+                workers.append(w)
+                w.start()
+        for w in workers:
+            w.join()
+        err = ""
+        warning = ""
+        for i_stream in range(4):
+            stats = self.stream_stats[i_stream]
+            if (stats is None):
+                continue
+            adc = self.stream_adc[i_stream]
+            # Samples which were not received or were in lost packets are invalid
+            valid = np.zeros(self.sample_number,dtype=bool)
+            valid[:self.sample_counter[adc]] = True
+            for first,n in apdcam10g_invalid_samples(stats['gaps'],packet_size - APDCAM10G_data.CC_STREAMHEADER,
+                                                     self.bytes_per_sample[adc]):
+                valid[first:first + n] = False
+            self.sample_valid[adc] = valid
+            stats['invalid_samples'] = int(self.sample_number - np.count_nonzero(valid))
+            if (stats['error'] != ""):
+                err += "Stream {:d}: {:s} ".format(i_stream + 1,stats['error'])
+            if (not stats['completed']):
+                warning += "Stream {:d} (ADC {:d}): received {:d} of {:d} packets. ".format(
+                            i_stream + 1,adc + 1,stats['packets'],stats['expected_packets'])
+            if (stats['lost_packets'] != 0):
+                gap_txt = ", ".join(["{:d}".format(first) if (n == 1) else "{:d}-{:d}".format(first,first + n - 1)
+                                     for first,n in stats['gaps'][:5]])
+                if (len(stats['gaps']) > 5):
+                    gap_txt += ", ..."
+                warning += "Stream {:d} (ADC {:d}): {:d} packets lost in {:d} gaps (packets {:s}), replaced by zeros. ".format(
+                            i_stream + 1,adc + 1,stats['lost_packets'],len(stats['gaps']),gap_txt)
+            if (stats['invalid_samples'] != 0):
+                warning += "Stream {:d} (ADC {:d}): {:d} of {:d} samples invalid. ".format(
+                            i_stream + 1,adc + 1,stats['invalid_samples'],self.sample_number)
+            if (stats['reordered_packets'] != 0):
+                warning += "Stream {:d}: {:d} packets out of order. ".format(i_stream + 1,stats['reordered_packets'])
+            if (stats['late_packets'] != 0):
+                warning += "Stream {:d}: {:d} packets arrived too late, dropped. ".format(i_stream + 1,stats['late_packets'])
+            if (stats['duplicate_packets'] != 0):
+                warning += "Stream {:d}: {:d} duplicate packets dropped. ".format(i_stream + 1,stats['duplicate_packets'])
+            if (stats['short_packets'] != 0):
+                warning += "Stream {:d}: {:d} packets with wrong size. ".format(i_stream + 1,stats['short_packets'])
         for i_stream in range(4):
             if (self.stream_list[i_stream]):
                 with open("UDPtimes_ADC{:d}.dat".format(self.stream_adc[i_stream]),"wt") as f:
                     f.writelines("{:f}-{:f}\n".format(self.stream_start_time_1,self.stream_start_time_2))
                     for i in range(self.packet_counter[i_stream]):
                         f.writelines("{:d}...{:f}...{:d}\n".format(i+1,self.packet_times[i_stream][i],self.packet_numbers[i_stream][i]))
-        return "",""     
+        return err.strip(),warning.strip()
+
+    def receiveStream(self,i_stream):
+        """
+        Receives and decodes the data of one stream until all packets are received or lost, the socket
+        times out or the continuity of the stream is broken. Runs in a separate thread for each stream,
+        the results are in self.stream_stats[i_stream].
+
+        Parameters
+        ----------
+        i_stream : int
+            The stream number (0...3).
+
+        Returns
+        -------
+        None.
+
+        """
+        capture = self.captures[i_stream]
+        sequencer = self.sequencers[i_stream]
+        stats = self.stream_stats[i_stream]
+        n_expected = stats['expected_packets']
+        stats['start_time'] = time.time()
+        try:
+            while ((sequencer.expected <= n_expected) and not capture.stopped and (sequencer.error == "")):
+                capture.receive(max(min(n_expected - self.packet_counter[i_stream],APDCAM10G_data.RECEIVE_BATCH),1))
+                stats['short_packets'] += self.processPackets(i_stream)
+            # Packets waiting for lost ones at the end
+            self.decodePackets(i_stream,sequencer.flush())
+            stats['error'] = sequencer.error
+        except Exception as e:
+            stats['error'] = str(e)
+        stats['end_time'] = time.time()
+        stats['packets'] = self.packet_counter[i_stream]
+        stats['completed'] = (sequencer.expected > n_expected)
+        if (stats['error'] == ""):
+            # The packets missing at the end are lost as well, they are replaced by zeros
+            # so that the stream has the full length
+            self.decodePackets(i_stream,sequencer.end(n_expected))
+        stats['lost_packets'] = sequencer.lost_packets
+        stats['gaps'] = list(sequencer.gaps)
+        stats['reordered_packets'] = sequencer.reordered_packets
+        stats['late_packets'] = sequencer.late_packets
+        stats['duplicate_packets'] = sequencer.duplicate_packets
+
+    def processPackets(self,i_stream):
+        """
+        Processes the packets received into the ring buffer of a stream: parses the headers,
+        puts the packets in order and decodes the samples into self.channel_data.
+
+        Parameters
+        ----------
+        i_stream : int
+            The stream number (0...3).
+
+        Returns
+        -------
+        int
+            The number of packets with wrong size.
+
+        """
+        capture = self.captures[i_stream]
+        n_bad = 0
+        while (capture.read_count < capture.write_count):
+            first, packets, nbytes, times = capture.read()
+            n = packets.shape[0]
+            n_bad += int(np.count_nonzero(nbytes != capture.packet_size))
+            packet_counter, sample_counter = apdcam10g_parse_headers(packets)
+            # Duplicate or extra packets might be received beyond the expected number
+            n_store = max(min(n,len(self.packet_numbers[i_stream]) - first),0)
+            self.packet_numbers[i_stream][first:first + n_store] = packet_counter[:n_store]
+            self.packet_times[i_stream][first:first + n_store] = times[:n_store]
+            self.packet_counter[i_stream] += n
+            self.decodePackets(i_stream,self.sequencers[i_stream].push(packets,packet_counter))
+        return n_bad
+
+    def decodePackets(self,i_stream,packet_list):
+        """
+        Decodes packets which are in order into self.channel_data.
+
+        Parameters
+        ----------
+        i_stream : int
+            The stream number (0...3).
+        packet_list : list of numpy arrays
+            Arrays of packets, as returned by APDCAM10G_packet_sequencer.push().
+
+        Returns
+        -------
+        None.
+
+        """
+        adc = self.stream_adc[i_stream]
+        for packets in packet_list:
+            d = self.decoders[adc].process(packets)
+            n_sample = min(d.shape[0],self.sample_number - self.sample_counter[adc])
+            self.channel_data[adc][self.sample_counter[adc]:self.sample_counter[adc] + n_sample] = d[:n_sample]
+            self.sample_counter[adc] += n_sample
+
+    def writeData(self,datapath="data"):
+        """
+        Writes the decoded channel signals into Channel_XXX.dat files, the same format
+        as written by APDTest_10G. The sample validity of each ADC board is written into
+        APDCAM_valid.npz: ADC<n> is a bool array with False for the samples which were
+        not received or were in lost packets, gaps_ADC<n> the (first packet counter, number of packets)
+        of the packet loss gaps.
+
+        Parameters
+        ----------
+        datapath : str, optional
+            The directory to write into. The default is "data".
+
+        Returns
+        -------
+        str:
+            "" or error message.
+
+        """
+        for adc,d in enumerate(self.channel_data):
+            if (d is None):
+                continue
+            for j,ch in enumerate(self.decoders[adc].channels):
+                fn = os.path.join(datapath,"Channel_{:03d}.dat".format(adc * 32 + ch))
+                try:
+                    d[:,j].astype(np.int16).tofile(fn)
+                except OSError:
+                    return "Error writing file "+fn
+        valid = {}
+        for i_stream in range(4):
+            if ((self.stream_stats[i_stream] is None) or (self.sample_valid[self.stream_adc[i_stream]] is None)):
+                continue
+            adc = self.stream_adc[i_stream]
+            valid["ADC{:d}".format(adc + 1)] = self.sample_valid[adc]
+            valid["gaps_ADC{:d}".format(adc + 1)] = np.array(self.stream_stats[i_stream]['gaps'],dtype=np.int64).reshape(-1,2)
+        fn = os.path.join(datapath,"APDCAM_valid.npz")
+        try:
+            np.savez_compressed(fn,**valid)
+        except OSError:
+            return "Error writing file "+fn
+        return ""
         
@@ -7,6 +7,7 @@ Created on Thu Apr 21 16:56:38 2022
 
 from .apdcam10g_channel_map import apdcam10g_channel_map
 from .apdcam_channel_map import apdcam_channel_map
+from .apdcam_channel_tables import apdcam_channel_tables, APDCAM_channel_tables
 from .apdcam_types_versions import *
 from .APDCAM10G_control import *
 from .apdcam10g_control_gui import gui
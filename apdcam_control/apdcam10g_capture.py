@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Packet capture of the APDCAM-10G UDP data streams.
+
+The packets of a stream are received with recv_into directly into the consecutive slots
+of a preallocated ring buffer, there is no allocation per packet. The stream headers
+are parsed afterwards in bulk through a structured dtype on the buffer.
+
+On Linux many packets are received with one recvmmsg system call, called through ctypes.
+If recvmmsg is not available the packets are received one by one with recv_into.
+
+CC_STREAMHEADER (22 bytes, big endian), see APDTest_10G/GECCommands.h:
+    serial (4 bytes), S1 (2 bytes), S2 (2 bytes), packet counter (6 bytes),
+    S3 (2 bytes), sample counter (6 bytes)
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import sys
+import time
+import errno
+import socket
+import select
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+CC_STREAMHEADER_SIZE = 22
+
+class _iovec(ctypes.Structure):
+    _fields_ = [('iov_base',ctypes.c_void_p),
+                ('iov_len',ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [('msg_name',ctypes.c_void_p),
+                ('msg_namelen',ctypes.c_uint32),
+                ('msg_iov',ctypes.POINTER(_iovec)),
+                ('msg_iovlen',ctypes.c_size_t),
+                ('msg_control',ctypes.c_void_p),
+                ('msg_controllen',ctypes.c_size_t),
+                ('msg_flags',ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr',_msghdr),
+                ('msg_len',ctypes.c_uint)]
+
+_MSG_DONTWAIT = 0x40
+
+def _load_recvmmsg():
+    """
+    Returns the recvmmsg function of the C library or None if not available.
+    """
+    if (not sys.platform.startswith('linux')):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+        f = libc.recvmmsg
+    except (OSError,AttributeError):
+        return None
+    f.argtypes = [ctypes.c_int,ctypes.POINTER(_mmsghdr),ctypes.c_uint,ctypes.c_int,ctypes.c_void_p]
+    f.restype = ctypes.c_int
+    return f
+
+_recvmmsg = _load_recvmmsg()
+
+def apdcam10g_recvmmsg_available():
+    """
+    Returns True if packets can be received in batches with recvmmsg.
+    """
+    return _recvmmsg is not None
+
+def apdcam10g_stream_header_dtype(packet_size=CC_STREAMHEADER_SIZE):
+    """
+    Returns the structured dtype of the stream header. The 48 bit counters are split
+    into a 16 bit high and a 32 bit low part.
+
+    Parameters
+    ----------
+    packet_size : int, optional
+        The item size of the dtype. With the packet size an array of packets can be viewed
+        with this dtype. The default is the header size.
+
+    Returns
+    -------
+    numpy dtype
+
+    """
+    return np.dtype({'names':['serial','S1','S2','packet_counter_hi','packet_counter_lo','S3',
+                              'sample_counter_hi','sample_counter_lo'],
+                     'formats':['>u4','>u2','>u2','>u2','>u4','>u2','>u2','>u4'],
+                     'offsets':[0,4,6,8,10,14,16,18],
+                     'itemsize':packet_size
+                     })
+
+def apdcam10g_parse_headers(packets):
+    """
+    Parses the stream headers of packets.
+
+    Parameters
+    ----------
+    packets : numpy array of uint8
+        C contiguous array of shape (number of packets, packet size).
+
+    Returns
+    -------
+    packet_counter : numpy array of uint64
+        The packet counter of each packet.
+    sample_counter : numpy array of uint64
+        The sample counter of each packet.
+
+    """
+    h = packets.view(apdcam10g_stream_header_dtype(packets.shape[1]))[:,0]
+    packet_counter = (h['packet_counter_hi'].astype(np.uint64) << np.uint64(32)) | h['packet_counter_lo']
+    sample_counter = (h['sample_counter_hi'].astype(np.uint64) << np.uint64(32)) | h['sample_counter_lo']
+    return packet_counter, sample_counter
+
+class APDCAM10G_stream_capture:
+    """
+    Receives the packets of one stream into a ring buffer.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        The bound UDP socket of the stream.
+    packet_size : int
+        The size of the packets including the stream header.
+    slots : int
+        The number of packets in the ring buffer.
+    use_recvmmsg : bool, optional
+        Receive with recvmmsg if it is available. The default is True.
+
+    Attributes
+    ----------
+    buffer : numpy array of uint8
+        The ring buffer, one packet in each row.
+    nbytes : numpy array of ints
+        The number of bytes received in each slot.
+    times : numpy array of floats
+        The receive time of the packet in each slot.
+    write_count : int
+        The number of packets received.
+    read_count : int
+        The number of packets read out with read().
+    stopped : bool
+        True if the socket timed out or failed.
+    use_recvmmsg : bool
+        True if recvmmsg is used.
+    """
+    def __init__(self, sock, packet_size, slots, use_recvmmsg=True):
+        self.sock = sock
+        self.packet_size = packet_size
+        self.slots = int(slots)
+        self.buffer = np.zeros((self.slots,packet_size),dtype=np.uint8)
+        self.nbytes = np.zeros(self.slots,dtype=np.int32)
+        self.times = np.zeros(self.slots,dtype=float)
+        # Writable views of the slots, made once
+        self._slot_views = [memoryview(self.buffer[i]) for i in range(self.slots)]
+        self.write_count = 0
+        self.read_count = 0
+        self.stopped = False
+        self.use_recvmmsg = use_recvmmsg and (_recvmmsg is not None)
+        if (self.use_recvmmsg):
+            # One message header for each slot, pointing to the slot in the buffer
+            self._iov = (_iovec * self.slots)()
+            self._msgs = (_mmsghdr * self.slots)()
+            base = self.buffer.ctypes.data
+            for i in range(self.slots):
+                self._iov[i].iov_base = base + i * packet_size
+                self._iov[i].iov_len = packet_size
+                self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iov[i])
+                self._msgs[i].msg_hdr.msg_iovlen = 1
+            self._msg_len = np.ctypeslib.as_array(ctypes.cast(self._msgs,ctypes.POINTER(ctypes.c_uint)),
+                                                  shape=(self.slots,ctypes.sizeof(_mmsghdr) // 4))
+            self._msg_len_col = _mmsghdr.msg_len.offset // 4
+
+    def free_slots(self):
+        """
+        Returns the number of slots which can be written without overwriting unread packets.
+        """
+        return self.slots - (self.write_count - self.read_count)
+
+    def receive(self, max_packets):
+        """
+        Receives packets into the free slots. Blocks according to the socket timeout.
+
+        Parameters
+        ----------
+        max_packets : int
+            The maximum number of packets to receive.
+
+        Returns
+        -------
+        int
+            The number of packets received. After a timeout or socket error stopped is set.
+
+        """
+        n = min(max_packets,self.free_slots())
+        if (self.use_recvmmsg):
+            return self._receive_mmsg(n)
+        recv_into = self.sock.recv_into
+        views = self._slot_views
+        nbytes = self.nbytes
+        times = self.times
+        slot = self.write_count % self.slots
+        for i in range(n):
+            try:
+                nbytes[slot] = recv_into(views[slot])
+            except (socket.timeout,OSError):
+                self.stopped = True
+                return i
+            times[slot] = time.time()
+            self.write_count += 1
+            slot += 1
+            if (slot == self.slots):
+                slot = 0
+        return n
+
+    def _receive_mmsg(self, n):
+        """
+        Receives n packets with recvmmsg. Waits for the socket timeout if no packet is available.
+        """
+        timeout = self.sock.gettimeout()
+        fd = self.sock.fileno()
+        received = 0
+        while (received < n):
+            try:
+                readable = select.select([fd],[],[],timeout)[0]
+            except (OSError,ValueError):
+                self.stopped = True
+                break
+            if (len(readable) == 0):
+                self.stopped = True
+                break
+            slot = self.write_count % self.slots
+            vlen = min(n - received,self.slots - slot)
+            r = _recvmmsg(fd,ctypes.byref(self._msgs[slot]),vlen,_MSG_DONTWAIT,None)
+            if (r < 0):
+                if (ctypes.get_errno() in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR)):
+                    continue
+                self.stopped = True
+                break
+            self.nbytes[slot:slot + r] = self._msg_len[slot:slot + r,self._msg_len_col]
+            self.times[slot:slot + r] = time.time()
+            self.write_count += r
+            received += r
+        return received
+
+    def read(self):
+        """
+        Returns the unread packets up to the end of the ring buffer and marks them read.
+
+        Returns
+        -------
+        first : int
+            The index of the first packet in the stream.
+        packets : numpy array of uint8
+            Array of shape (number of packets, packet size). A view into the ring buffer,
+            valid until the slots are received again.
+        nbytes : numpy array of ints
+            The number of bytes received for each packet.
+        times : numpy array of floats
+            The receive time of each packet.
+
+        """
+        first = self.read_count
+        slot = first % self.slots
+        n = min(self.write_count - first,self.slots - slot)
+        self.read_count += n
+        return first, self.buffer[slot:slot + n], self.nbytes[slot:slot + n], self.times[slot:slot + n]
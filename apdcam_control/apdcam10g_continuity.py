@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Continuity check of the APDCAM-10G data streams.
+
+The packets of a stream are numbered by the packet counter in the stream header, starting
+from 1. The packets are put back into counter order, packets arriving late are waited for
+within a reorder window. Packets missing after that are lost, they are replaced by packets
+with zero data like in ProcessData in APDTest_10G/DataEvaluation.cpp, and the gap is recorded.
+If more than max_packet_loss consecutive packets are lost, or the counter jumps back,
+the stream is broken. This is the m_ContinuityError of DataEvaluation.cpp.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import numpy as np
+
+MAX_PACKET_LOSS = 50
+
+class APDCAM10G_packet_sequencer:
+    """
+    Puts the packets of one stream in order and fills in the lost packets.
+
+    Parameters
+    ----------
+    packet_size : int
+        The size of the packets including the stream header.
+    reorder_window : int, optional
+        A missing packet is waited for until a packet this many counters later arrives.
+        The default is 64.
+    max_packet_loss : int, optional
+        The maximum number of consecutive lost packets which are replaced by zeros.
+        The default is MAX_PACKET_LOSS.
+
+    Attributes
+    ----------
+    expected : int
+        The counter of the next packet in order.
+    lost_packets : int
+        The number of lost packets. They are replaced by packets with zero data.
+    gaps : list of tuples
+        (first packet counter, number of packets) of each series of lost packets.
+    reordered_packets : int
+        The number of packets which arrived after a packet with higher counter but in the reorder window.
+    late_packets : int
+        The number of packets which arrived after they had been replaced by zeros. These are dropped.
+    duplicate_packets : int
+        The number of packets received more than once. These are dropped.
+    error : str
+        "" or the reason of the continuity error. After an error no more packets are accepted.
+    """
+    def __init__(self, packet_size, reorder_window=64, max_packet_loss=MAX_PACKET_LOSS):
+        self.packet_size = packet_size
+        self.reorder_window = int(reorder_window)
+        self.max_packet_loss = int(max_packet_loss)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the state.
+        """
+        self.expected = 1
+        self.lost_packets = 0
+        self.gaps = []
+        self.reordered_packets = 0
+        self.late_packets = 0
+        self.duplicate_packets = 0
+        self.error = ""
+        # The highest packet counter received
+        self._last = 0
+        # Packets received ahead of a missing one, by counter
+        self._pending = {}
+
+    def push(self, packets, packet_counter):
+        """
+        Adds received packets.
+
+        Parameters
+        ----------
+        packets : numpy array of uint8
+            Array of shape (number of packets, packet size). Can be a view into a receive buffer,
+            packets which have to wait are copied.
+        packet_counter : numpy array of ints
+            The packet counter of each packet.
+
+        Returns
+        -------
+        list of numpy arrays
+            The packets in order as arrays of shape (number of packets, packet size), lost ones replaced by
+            packets with zero data. Empty after a continuity error.
+
+        """
+        n = packets.shape[0]
+        if ((n == 0) or (self.error != "")):
+            return []
+        # Fast path: no missing packet
+        if ((len(self._pending) == 0) and (int(packet_counter[0]) == self.expected)
+            and (int(packet_counter[-1]) == self.expected + n - 1)
+            and ((n == 1) or np.all(np.diff(packet_counter.astype(np.int64)) == 1))):
+            self.expected += n
+            self._last = self.expected - 1
+            return [packets]
+        out = []
+        start = 0
+        for i in range(n):
+            c = int(packet_counter[i])
+            if ((c == self.expected) and (len(self._pending) == 0)):
+                self.expected += 1
+                self._last = max(self._last,c)
+                continue
+            if (i > start):
+                out.append(packets[start:i])
+            start = i + 1
+            if (c < self.expected):
+                if (self._in_gap(c)):
+                    self.late_packets += 1
+                elif (self.expected - c > self.reorder_window):
+                    self.error = "Packet counter jumped back from {:d} to {:d}.".format(self.expected - 1,c)
+                    self._pending = {}
+                    return out
+                else:
+                    self.duplicate_packets += 1
+                continue
+            if (c in self._pending):
+                self.duplicate_packets += 1
+                continue
+            if (c < self._last):
+                self.reordered_packets += 1
+            else:
+                self._last = c
+            self._pending[c] = packets[i].copy()
+            out.extend(self._release(force=False))
+            if (self.error != ""):
+                return out
+        if (n > start):
+            out.append(packets[start:n])
+        return out
+
+    def flush(self):
+        """
+        Releases the packets waiting for missing ones at the end of the stream. The missing packets
+        before them are lost.
+
+        Returns
+        -------
+        list of numpy arrays
+            The packets, see push().
+
+        """
+        if (self.error != ""):
+            return []
+        out = []
+        while (len(self._pending) != 0):
+            out.extend(self._release(force=True))
+            if (self.error != ""):
+                break
+        return out
+
+    def end(self, last_counter):
+        """
+        Records the packets missing at the end of the stream as lost and replaces them by packets
+        with zero data. Should be called after flush().
+
+        Parameters
+        ----------
+        last_counter : int
+            The counter of the last packet of the stream.
+
+        Returns
+        -------
+        list of numpy arrays
+            The zero packets, see push(). The arrays are views of the same zero buffer.
+
+        """
+        if ((self.error != "") or (self.expected > last_counter)):
+            return []
+        n_lost = last_counter - self.expected + 1
+        self.gaps.append((self.expected,n_lost))
+        self.lost_packets += n_lost
+        self.expected = last_counter + 1
+        # The end gap can be the whole stream, a small zero buffer is returned repeatedly
+        zeros = np.zeros((min(n_lost,1024),self.packet_size),dtype=np.uint8)
+        return [zeros[:min(len(zeros),n_lost - i)] for i in range(0,n_lost,len(zeros))]
+
+    def _release(self, force):
+        """
+        Releases the pending packets which follow the expected one. If the reorder window is
+        exceeded or force is True the missing packets before the first pending one are given up.
+        """
+        out = []
+        while (len(self._pending) != 0):
+            if (self.expected in self._pending):
+                p = self._pending.pop(self.expected)
+                out.append(p.reshape(1,-1))
+                self.expected += 1
+                continue
+            first = min(self._pending)
+            if (not force and (max(self._pending) - self.expected < self.reorder_window)):
+                break
+            n_lost = first - self.expected
+            if (n_lost > self.max_packet_loss):
+                self.error = "{:d} packets lost after packet {:d}.".format(n_lost,self.expected - 1)
+                self._pending = {}
+                break
+            self.gaps.append((self.expected,n_lost))
+            self.lost_packets += n_lost
+            out.append(np.zeros((n_lost,self.packet_size),dtype=np.uint8))
+            self.expected = first
+        return out
+
+    def _in_gap(self, c):
+        for first,n in self.gaps:
+            if (first <= c < first + n):
+                return True
+        return False
+
+def apdcam10g_invalid_samples(gaps, payload_size, bytes_per_sample):
+    """
+    Returns the sample ranges affected by lost packets.
+
+    Parameters
+    ----------
+    gaps : list of tuples
+        (first packet counter, number of packets) of each gap, as in APDCAM10G_packet_sequencer.gaps.
+    payload_size : int
+        The number of data bytes in a packet, without the stream header.
+    bytes_per_sample : int
+        The size of a sample block in the stream.
+
+    Returns
+    -------
+    list of tuples
+        (first sample, number of samples) for each gap. A sample is affected if any of its bytes
+        was in a lost packet.
+
+    """
+    samples = []
+    for first,n in gaps:
+        start = (first - 1) * payload_size
+        end = (first - 1 + n) * payload_size
+        s1 = start // bytes_per_sample
+        s2 = (end + bytes_per_sample - 1) // bytes_per_sample
+        samples.append((s1,s2 - s1))
+    return samples
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Decoding of the APDCAM-10G data stream into channel signals.
+
+The UDP stream of one ADC board is a sequence of packets, each with a CC_STREAMHEADER
+followed by the payload. The payloads form a continuous byte stream of sample blocks, a block
+can continue in the next packet. A sample block contains one sample of each enabled channel
+of the 4 ADC chips (8 channels each) of the board, bits bit each, MSB first. The data of each
+chip is padded to a byte boundary and the block is padded to bytes_per_sample bytes.
+This is the same as GetData8/12/14 and ProcessBlock in APDTest_10G/DataEvaluation.cpp.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import numpy as np
+
+def apdcam10g_block_layout(channel_mask, bits):
+    """
+    Returns the position of the channels in a sample block.
+
+    Parameters
+    ----------
+    channel_mask : int
+        The 32 bit channel mask of the ADC board. Bit 0 is channel 1.
+    bits : int
+        The bit resolution: 8, 12 or 14.
+
+    Returns
+    -------
+    channels : list of ints
+        The enabled channels (0...31).
+    bit_offsets : list of ints
+        The bit offset of each channel in the block.
+    block_bytes : int
+        The number of bytes used in the block.
+
+    """
+    if (bits not in (8,12,14)):
+        raise ValueError("Invalid bit resolution: {:s}".format(str(bits)))
+    channels = []
+    bit_offsets = []
+    offset = 0
+    for i_chip in range(4):
+        for i_ch in range(8):
+            ch = i_chip * 8 + i_ch
+            if ((channel_mask >> ch) & 1):
+                channels.append(ch)
+                bit_offsets.append(offset)
+                offset += bits
+        # Padding to byte boundary
+        if (offset % 8 != 0):
+            offset = (offset // 8 + 1) * 8
+    return channels, bit_offsets, offset // 8
+
+class APDCAM10G_packet_decoder:
+    """
+    Decodes the packets of one ADC board stream to samples. Packets can be processed
+    in consecutive batches, sample blocks continuing in the next batch are kept.
+
+    Parameters
+    ----------
+    channel_mask : int
+        The 32 bit channel mask of the ADC board. Bit 0 is channel 1.
+    bits : int
+        The bit resolution: 8, 12 or 14.
+    bytes_per_sample : int
+        The size of a sample block in the stream including padding, as calculated
+        by APDCAM10G_data.allocate.
+    header_size : int, optional
+        The size of the stream header at the start of each packet. The default is 22.
+
+    Attributes
+    ----------
+    channels : list of ints
+        The enabled channels (0...31), in the order of the columns of the decoded data.
+    sample_count : int
+        The number of samples decoded since reset().
+    """
+    def __init__(self, channel_mask, bits, bytes_per_sample, header_size=22):
+        self.bits = bits
+        self.bytes_per_sample = int(bytes_per_sample)
+        self.header_size = header_size
+        self.channels, bit_offsets, block_bytes = apdcam10g_block_layout(channel_mask,bits)
+        if (block_bytes > self.bytes_per_sample):
+            raise ValueError("Sample block of {:d} bytes does not fit into bytes_per_sample {:d}.".format(
+                             block_bytes,self.bytes_per_sample))
+        # Each channel is taken from a 24 bit word starting at its first byte
+        self._byte = [o // 8 for o in bit_offsets]
+        self._shift = [24 - o % 8 - bits for o in bit_offsets]
+        self._mask = (1 << bits) - 1
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the state.
+        """
+        self._carry = np.zeros(0,dtype=np.uint8)
+        self.sample_count = 0
+
+    def decode_blocks(self, blocks, out=None):
+        """
+        Decodes sample blocks.
+
+        Parameters
+        ----------
+        blocks : numpy array of uint8
+            Array of shape (number of samples, bytes_per_sample).
+        out : numpy array of int16, optional
+            Array of shape (number of samples, number of channels) to write the samples into.
+
+        Returns
+        -------
+        numpy array of int16
+            The samples, the second dimension is the channel.
+
+        """
+        n = blocks.shape[0]
+        if (out is None):
+            out = np.empty((n,len(self.channels)),dtype=np.int16)
+        # Zero padding for the bytes after the block used in the 24 bit words
+        padded = np.zeros((n,self.bytes_per_sample + 2),dtype=np.uint32)
+        padded[:,:self.bytes_per_sample] = blocks
+        for j,(b,s) in enumerate(zip(self._byte,self._shift)):
+            word = (padded[:,b] << 16) | (padded[:,b + 1] << 8) | padded[:,b + 2]
+            word >>= s
+            word &= self._mask
+            out[:,j] = word
+        return out
+
+    def process(self, packets):
+        """
+        Decodes a batch of packets.
+
+        Parameters
+        ----------
+        packets : numpy array of uint8 or list of bytes
+            The packets with header. A 2D array has one packet in each row.
+
+        Returns
+        -------
+        numpy array of int16
+            The samples of all sample blocks completed in this batch, the second dimension is the channel.
+
+        """
+        if (type(packets) is list):
+            payload = [np.frombuffer(p,dtype=np.uint8)[self.header_size:] for p in packets]
+        else:
+            payload = [np.asarray(packets,dtype=np.uint8).reshape(-1,packets.shape[-1])[:,self.header_size:].ravel()]
+        stream = np.concatenate([self._carry] + payload)
+        n = len(stream) // self.bytes_per_sample
+        self._carry = stream[n * self.bytes_per_sample:].copy()
+        samples = self.decode_blocks(stream[:n * self.bytes_per_sample].reshape(n,self.bytes_per_sample))
+        self.sample_count += n
+        return samples
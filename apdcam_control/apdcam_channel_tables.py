@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Precompiled channel name and file lookup tables for the APDCAM cameras.
+
+The tables are built once per camera type, version and sensor rotation and
+are shared by all users. All arrays in the tables are read-only.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import functools
+import types
+
+import numpy as np
+
+from .apdcam10g_channel_map import apdcam10g_channel_map
+from .apdcam_channel_map import apdcam_channel_map
+
+class APDCAM_channel_tables:
+    """
+    Lookup tables between channel names, ADC channels, detector pixels and data files
+    for one camera configuration. Do not create directly, use apdcam_channel_tables().
+
+    Attributes
+    ----------
+    key : tuple
+        The camera configuration: (camera_family, camera_type, camera_version) for 10G,
+        (camera_family, sensor_rotation) for 1G cameras.
+    chmap : numpy array of ints
+        The channel map as returned by apdcam10g_channel_map or apdcam_channel_map.
+    ch_names : tuple of strings
+        All possible channel names. Each pixel appears twice, as APD-r-c (APD-n for 1D maps)
+        and as ADCxxx.
+    name_index : mapping
+        Index in ch_names for each channel name.
+    adc : numpy array of ints
+        The ADC channel number for each name in ch_names.
+    row, col : numpy array of ints
+        The detector row and column (1...) for each name in ch_names. 0 for ADCxxx names and
+        for 1D channel maps.
+    fnames : numpy array of strings
+        The data file name for each name in ch_names.
+    adc_row, adc_col : numpy array of ints
+        The detector row and column (1...) indexed with the ADC channel number.
+        0 if the ADC channel is not connected to a pixel or the map is 1D.
+    adc_fname : numpy array of strings
+        The data file name indexed with the ADC channel number.
+    """
+    def __init__(self, key, chmap):
+        self.key = key
+        camera_family = key[0]
+        self.chmap = chmap
+        if (chmap.ndim == 2):
+            ir, ic = np.meshgrid(np.arange(chmap.shape[0]),np.arange(chmap.shape[1]),indexing='ij')
+            ir = ir.flatten()
+            ic = ic.flatten()
+            adc_pix = chmap.flatten()
+            apd_names = ['APD-{:d}-{:d}'.format(r + 1,c + 1) for r,c in zip(ir,ic)]
+            pix_row = ir + 1
+            pix_col = ic + 1
+        else:
+            adc_pix = chmap.flatten()
+            apd_names = ['APD-{:d}'.format(i + 1) for i in range(len(adc_pix))]
+            pix_row = np.zeros(len(adc_pix),dtype=int)
+            pix_col = np.zeros(len(adc_pix),dtype=int)
+        if (camera_family == 'APDCAM-10G'):
+            pix_fnames = ['Channel_{:03d}.dat'.format(a - 1) for a in adc_pix]
+        else:
+            pix_fnames = ['Channel{:02d}.dat'.format(a - 1) for a in adc_pix]
+        npix = len(adc_pix)
+        # The names are interleaved: APD name, ADC name for each pixel
+        names = []
+        for i in range(npix):
+            names.append(apd_names[i])
+            names.append('ADC{:d}'.format(adc_pix[i]))
+        self.ch_names = tuple(names)
+        self.name_index = types.MappingProxyType({n:i for i,n in enumerate(names)})
+        self.adc = np.repeat(adc_pix,2)
+        self.row = np.zeros(2 * npix,dtype=int)
+        self.row[0::2] = pix_row
+        self.col = np.zeros(2 * npix,dtype=int)
+        self.col[0::2] = pix_col
+        self.fnames = np.repeat(np.array(pix_fnames),2)
+        nadc = int(np.amax(adc_pix)) + 1
+        self.adc_row = np.zeros(nadc,dtype=int)
+        self.adc_row[adc_pix] = pix_row
+        self.adc_col = np.zeros(nadc,dtype=int)
+        self.adc_col[adc_pix] = pix_col
+        self.adc_fname = np.zeros(nadc,dtype=self.fnames.dtype)
+        self.adc_fname[adc_pix] = pix_fnames
+        for a in (self.chmap,self.adc,self.row,self.col,self.fnames,self.adc_row,self.adc_col,self.adc_fname):
+            a.flags.writeable = False
+
+@functools.lru_cache(maxsize=None)
+def apdcam_channel_tables(camera_family, camera_type=None, camera_version=1, sensor_rotation=0):
+    """
+    Returns the channel lookup tables for a camera configuration. The tables are built only
+    once for each configuration.
+
+    Parameters
+    ----------
+    camera_family : string
+        'APDCAM-10G' or 'APDCAM' (1G).
+    camera_type : string, optional
+        The 10G camera type as used by apdcam10g_channel_map, e.g. '4x32'. Not used for 1G.
+    camera_version : int, optional
+        The 10G camera version. Not used for 1G. The default is 1.
+    sensor_rotation : int, optional
+        The sensor rotation for APDCAM-1G [deg]. Not used for 10G. The default is 0.
+
+    Returns
+    -------
+    APDCAM_channel_tables
+        The tables. Shared between callers, should not be modified.
+
+    """
+    if (camera_family == 'APDCAM-10G'):
+        chmap = apdcam10g_channel_map(camera_type=camera_type,camera_version=camera_version)
+        key = (camera_family,camera_type,camera_version)
+    elif (camera_family == 'APDCAM'):
+        chmap = apdcam_channel_map(sensor_rotation=sensor_rotation)
+        key = (camera_family,sensor_rotation)
+    else:
+        raise ValueError("Unknown camera family: {:s}".format(str(camera_family)))
+    return APDCAM_channel_tables(key,chmap)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Anti-aliasing decimation of APDCAM signals with a windowed-sinc FIR filter.
+
+The filter has taps_per_phase * factor taps and is applied in polyphase form: the input is
+divided into blocks of factor samples and each output sample is the sum of taps_per_phase
+blocks weighted with the corresponding phase of the filter. All channels are processed
+together.
+
+Output sample k is centered at the center of input samples [k * factor, (k + 1) * factor)
+of the signal, the same as the bin of the block averaging resampler. To calculate it
+the input should start (taps_per_phase - 1) / 2 * factor samples before the first bin,
+see APDCAM_fir_decimator.halo.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import numpy as np
+
+def apdcam_fir_design(factor, taps_per_phase=15, cutoff=0.9, beta=8.):
+    """
+    Designs the lowpass filter for decimation.
+
+    Parameters
+    ----------
+    factor : int
+        The decimation factor.
+    taps_per_phase : int, optional
+        The number of filter taps per polyphase component. Should be odd. The default is 15.
+    cutoff : float, optional
+        The cutoff frequency relative to the Nyquist frequency after decimation. The default is 0.9.
+    beta : float, optional
+        The parameter of the Kaiser window. The default is 8.
+
+    Returns
+    -------
+    numpy array
+        The filter coefficients, the sum is 1.
+
+    """
+    if ((taps_per_phase < 1) or (taps_per_phase % 2 != 1)):
+        raise ValueError("taps_per_phase should be an odd positive number.")
+    ntaps = taps_per_phase * factor
+    fc = 0.5 / factor * cutoff
+    n = np.arange(ntaps) - (ntaps - 1) / 2
+    h = 2 * fc * np.sinc(2 * fc * n) * np.kaiser(ntaps,beta)
+    return h / np.sum(h)
+
+class APDCAM_fir_decimator:
+    """
+    Polyphase FIR decimator with state. Data can be given in consecutive blocks of any length,
+    the output is the same as processing all the data at once.
+
+    Parameters
+    ----------
+    factor : int
+        The decimation factor.
+    taps_per_phase : int, optional
+        The number of filter taps per polyphase component. Should be odd. The default is 15.
+    cutoff : float, optional
+        The cutoff frequency relative to the Nyquist frequency after decimation. The default is 0.9.
+
+    Attributes
+    ----------
+    halo : int
+        The number of input samples needed before the first and after the last bin.
+    """
+    def __init__(self, factor, taps_per_phase=15, cutoff=0.9):
+        self.factor = int(factor)
+        self.taps_per_phase = taps_per_phase
+        self.halo = (taps_per_phase - 1) // 2 * self.factor
+        # Filter phases: row m is applied to block k + m for output k
+        self.phases = apdcam_fir_design(self.factor,taps_per_phase=taps_per_phase,cutoff=cutoff).reshape(
+                                        taps_per_phase,self.factor)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the state.
+        """
+        self.buffer = None
+
+    def process(self, data, dtype=float):
+        """
+        Processes a block of data.
+
+        Parameters
+        ----------
+        data : numpy array
+            The input data, the first dimension is time, the other dimensions are channels.
+            The first sample fed after reset() is the first sample of the first filter window,
+            halo samples before the first bin.
+        dtype : numpy dtype, optional
+            The data type of the output. The default is float.
+
+        Returns
+        -------
+        numpy array
+            The decimated signal for all bins which are complete with this block.
+
+        """
+        if (self.buffer is not None):
+            x = np.concatenate((self.buffer,data),axis=0)
+        else:
+            x = data
+        L = self.taps_per_phase
+        R = self.factor
+        nb = x.shape[0] // R
+        nout = nb - (L - 1)
+        if (nout <= 0):
+            self.buffer = np.array(x)
+            return np.empty((0,) + x.shape[1:],dtype=dtype)
+        ch_shape = x.shape[1:]
+        xb = x[:nb * R].reshape((nb,R,-1))
+        y = np.empty((nout,xb.shape[2]),dtype=dtype)
+        # Processing a limited number of output samples at once to limit the size of temporary arrays
+        out_per_step = max(1,2 ** 22 // max(1,R * xb.shape[2]))
+        for i_start in range(0,nout,out_per_step):
+            i_end = min(i_start + out_per_step,nout)
+            n = i_end - i_start
+            blocks = xb[i_start:i_end + L - 1].astype(np.float64)
+            # Output k is the sum over phases m of block k + m weighted with phase m
+            acc = self.phases[0] @ blocks[0:n]
+            for m in range(1,L):
+                acc += self.phases[m] @ blocks[m:m + n]
+            y[i_start:i_end] = acc
+            del blocks
+        self.buffer = np.array(x[nout * R:])
+        return y.reshape((nout,) + ch_shape)
+
+def apdcam_fir_decimate(data, factor, pad_before, pad_after, taps_per_phase=15, cutoff=0.9, dtype=float):
+    """
+    Decimates a block of data in one step. The data should contain the halo of the decimator
+    before the first and after the last bin, missing samples are replaced by the first or last sample.
+
+    Parameters
+    ----------
+    data : numpy array
+        The data, the first dimension is time.
+    factor : int
+        The decimation factor.
+    pad_before, pad_after : int
+        The number of samples missing before and after the data.
+    taps_per_phase : int, optional
+        The number of filter taps per polyphase component. The default is 15.
+    cutoff : float, optional
+        The cutoff frequency relative to the output Nyquist frequency. The default is 0.9.
+    dtype : numpy dtype, optional
+        The data type of the output. The default is float.
+
+    Returns
+    -------
+    numpy array
+        The decimated data.
+
+    """
+    if ((pad_before > 0) or (pad_after > 0)):
+        data = np.pad(data,((pad_before,pad_after),) + ((0,0),) * (data.ndim - 1),mode='edge')
+    dec = APDCAM_fir_decimator(factor,taps_per_phase=taps_per_phase,cutoff=cutoff)
+    return dec.process(data,dtype=dtype)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Spatial coordinates of APDCAM pixels.
+
+The geometry file describes the detector of a camera and the calibration of other
+spatial coordinates. It is a configparser (ini) file:
+
+    [Geometry]
+    Pixel pitch x = 2.3
+    Pixel pitch y = 2.3
+    Origin x = 0
+    Origin y = 0
+    Rotation = 0
+
+    [Coordinate Beam axis]
+    Unit = mm
+    Linear = 120., 1., 0.
+
+    [Coordinate R]
+    Unit = m
+    APD-1-1 = 2.134
+    APD-1-2 = 2.137
+    ...
+
+The [Geometry] section gives the Device x and Device y coordinates [mm] of the pixels.
+The pixel pitch is in mm, 'Pixel pitch' sets both directions. The origin is the Device x,y
+of the center of the detector, the detector is rotated counterclockwise by Rotation [deg]
+around it. Row 1 is the top row, column 1 is the leftmost column. For cameras with a 1D
+channel map the pixels are in one row.
+
+Each [Coordinate <name>] section defines a calibrated coordinate with the given unit. The
+values are either a linear function of the device coordinates
+    Linear = c0, cx, cy  ->  c0 + cx * Device x + cy * Device y
+or given for each pixel by the APD or ADC channel name. Pixels without value are NaN.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import functools
+import configparser
+
+import numpy as np
+
+class APDCAM_coordinate_tables:
+    """
+    Coordinate values of the pixels for one camera configuration and geometry file.
+    Use apdcam_coordinate_tables() to get one.
+
+    Attributes
+    ----------
+    units : dict
+        The unit of each coordinate.
+    values : dict
+        The values of each coordinate indexed with the ADC channel number. Read-only.
+        NaN for ADC channels which are not connected to a pixel.
+    """
+    def __init__(self, channel_tables, geometry_file):
+        parser = configparser.ConfigParser()
+        # Channel names are case sensitive
+        parser.optionxform = str
+        try:
+            with open(geometry_file,'rt') as f:
+                parser.read_file(f)
+        except (OSError,configparser.Error) as e:
+            raise IOError("Error reading geometry file {:s}: {:s}".format(geometry_file,str(e)))
+        self.units = {}
+        self.values = {}
+        chmap = channel_tables.chmap
+        adc_pix = chmap.flatten()
+        nadc = len(channel_tables.adc_row)
+        if (chmap.ndim == 2):
+            nrow, ncol = chmap.shape
+            pix_row = channel_tables.adc_row[adc_pix]
+            pix_col = channel_tables.adc_col[adc_pix]
+        else:
+            nrow = 1
+            ncol = len(adc_pix)
+            pix_row = np.ones(ncol,dtype=int)
+            pix_col = np.arange(ncol) + 1
+
+        dev_x = np.full(nadc,np.nan)
+        dev_y = np.full(nadc,np.nan)
+        if (parser.has_section('Geometry')):
+            g = parser['Geometry']
+            try:
+                pitch_x = g.getfloat('Pixel pitch x',fallback=g.getfloat('Pixel pitch',fallback=None))
+                pitch_y = g.getfloat('Pixel pitch y',fallback=g.getfloat('Pixel pitch',fallback=None))
+                origin_x = g.getfloat('Origin x',fallback=0.)
+                origin_y = g.getfloat('Origin y',fallback=0.)
+                rotation = g.getfloat('Rotation',fallback=0.)
+            except ValueError as e:
+                raise ValueError("Invalid [Geometry] in {:s}: {:s}".format(geometry_file,str(e)))
+            if ((pitch_x is None) or (pitch_y is None)):
+                raise ValueError("Pixel pitch is missing from [Geometry] in {:s}".format(geometry_file))
+            u = (pix_col - (ncol + 1) / 2) * pitch_x
+            v = ((nrow + 1) / 2 - pix_row) * pitch_y
+            phi = np.deg2rad(rotation)
+            dev_x[adc_pix] = origin_x + u * np.cos(phi) - v * np.sin(phi)
+            dev_y[adc_pix] = origin_y + u * np.sin(phi) + v * np.cos(phi)
+            self._add('Device x','mm',dev_x)
+            self._add('Device y','mm',dev_y)
+
+        for section in parser.sections():
+            if (section[:11] != 'Coordinate '):
+                continue
+            name = section[11:].strip()
+            sec = parser[section]
+            unit = sec.get('Unit','n.a.')
+            c = np.full(nadc,np.nan)
+            for key,value in sec.items():
+                if (key == 'Unit'):
+                    continue
+                try:
+                    if (key == 'Linear'):
+                        coeff = [float(x) for x in value.split(',')]
+                        if (len(coeff) != 3):
+                            raise ValueError("Linear should have 3 coefficients.")
+                        if ('Device x' not in self.values):
+                            raise ValueError("Linear calibration needs the [Geometry] section.")
+                        c[adc_pix] = coeff[0] + coeff[1] * dev_x[adc_pix] + coeff[2] * dev_y[adc_pix]
+                    else:
+                        try:
+                            i = channel_tables.name_index[key]
+                        except KeyError:
+                            raise ValueError("Unknown channel {:s}".format(key))
+                        c[channel_tables.adc[i]] = float(value)
+                except ValueError as e:
+                    raise ValueError("Invalid [{:s}] in {:s}: {:s}".format(section,geometry_file,str(e)))
+            self._add(name,unit,c)
+
+    def _add(self, name, unit, values):
+        values.flags.writeable = False
+        self.units[name] = unit
+        self.values[name] = values
+
+@functools.lru_cache(maxsize=64)
+def _apdcam_coordinate_tables(channel_tables, geometry_file, stamp):
+    return APDCAM_coordinate_tables(channel_tables,geometry_file)
+
+def apdcam_coordinate_tables(channel_tables, geometry_file):
+    """
+    Returns the coordinate tables for a camera configuration and geometry file.
+    The tables are calculated only once while the file is unchanged.
+
+    Parameters
+    ----------
+    channel_tables : APDCAM_channel_tables
+        The channel tables of the camera.
+    geometry_file : string
+        The geometry file name.
+
+    Returns
+    -------
+    APDCAM_coordinate_tables
+        The tables. Shared between callers, should not be modified.
+
+    """
+    geometry_file = os.path.abspath(geometry_file)
+    try:
+        st = os.stat(geometry_file)
+    except OSError:
+        raise IOError("Geometry file {:s} not found.".format(geometry_file))
+    return _apdcam_coordinate_tables(channel_tables,geometry_file,(st.st_mtime_ns,st.st_size))
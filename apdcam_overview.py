@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-resolution overview of APDCAM measurements.
+
+The overview is stored in the APDCAM_overview directory beside the channel files.
+For each decimation factor it contains the minimum, maximum, mean and RMS of the raw
+ADC signal in consecutive bins of the factor number of samples, for all channels.
+The RMS is the standard deviation of the signal in the bin, the same as the error of the
+resampled data in apdcam_get_data.
+
+The overview is built by apdcam_build_overview() in one pass through the channel files.
+apdcam_get_data uses it for resampling with the 'Overview' option if the resample bin size
+is a multiple of a decimation factor.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import json
+import shutil
+import collections
+import threading
+
+import numpy as np
+
+overview_dirname = 'APDCAM_overview'
+_overview_version = 1
+_stats = ('min','max','mean','rms')
+
+def _apdcam_channel_files(datapath):
+    """
+    Returns the sorted list of channel file names in datapath.
+    """
+    fnames = [f for f in os.listdir(datapath) if (f[:7] == 'Channel') and (f[-4:] == '.dat')]
+    return sorted(fnames)
+
+def apdcam_build_overview(datapath, factors=(10,100,1000,10000), block_samples=1000000):
+    """
+    Builds the overview of a measurement. The channel files are read once, in blocks.
+    Can be run right after the measurement. An existing overview is replaced.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+    factors : list of ints, optional
+        The decimation factors. The default is (10,100,1000,10000).
+    block_samples : int, optional
+        The approximate number of samples per channel processed at once.
+        The default is 1000000.
+
+    Returns
+    -------
+    string
+        The path of the overview directory.
+
+    """
+    factors = sorted(set(int(f) for f in factors))
+    if ((len(factors) == 0) or (factors[0] < 2)):
+        raise ValueError("Decimation factors should be at least 2.")
+    fnames = _apdcam_channel_files(datapath)
+    if (len(fnames) == 0):
+        raise IOError("No channel files found in {:s}".format(datapath))
+    sizes = [os.path.getsize(os.path.join(datapath,f)) for f in fnames]
+    nsample = min(sizes) // 2
+    nch = len(fnames)
+    # The block is a multiple of all factors
+    block = int(np.lcm.reduce(factors))
+    block = block * max(1,block_samples // block)
+
+    outdir = os.path.join(datapath,overview_dirname)
+    tmpdir = outdir + '.tmp'
+    if (os.path.exists(tmpdir)):
+        shutil.rmtree(tmpdir)
+    os.mkdir(tmpdir)
+    arrays = {}
+    for f in factors:
+        nbins = nsample // f
+        for s in _stats:
+            if ((s == 'min') or (s == 'max')):
+                dtype = np.int16
+            else:
+                dtype = np.float32
+            arrays[(f,s)] = np.lib.format.open_memmap(os.path.join(tmpdir,'L{:d}_{:s}.npy'.format(f,s)),
+                                                      mode='w+',dtype=dtype,shape=(nbins,nch))
+    files = [open(os.path.join(datapath,fn),'rb',buffering=0) for fn in fnames]
+    try:
+        buf = np.empty(block,dtype=np.int16)
+        for start in range(0,nsample,block):
+            n = min(block,nsample - start)
+            for i_ch in range(nch):
+                d = buf[:n]
+                nread = files[i_ch].readinto(memoryview(d).cast('B'))
+                if (nread != n * 2):
+                    raise IOError("Error reading {:s}".format(fnames[i_ch]))
+                for f in factors:
+                    nb = n // f
+                    if (nb == 0):
+                        continue
+                    b = d[:nb * f].reshape(nb,f)
+                    b0 = start // f
+                    arrays[(f,'min')][b0:b0 + nb,i_ch] = b.min(axis=1)
+                    arrays[(f,'max')][b0:b0 + nb,i_ch] = b.max(axis=1)
+                    b = b.astype(np.int64)
+                    d_mean = b.sum(axis=1) / f
+                    b *= b
+                    d_var = b.sum(axis=1) / f - d_mean ** 2
+                    np.maximum(d_var,0,out=d_var)
+                    arrays[(f,'mean')][b0:b0 + nb,i_ch] = d_mean
+                    arrays[(f,'rms')][b0:b0 + nb,i_ch] = np.sqrt(d_var)
+    finally:
+        for fd in files:
+            fd.close()
+    for a in arrays.values():
+        a.flush()
+    del arrays
+
+    info = {'version':_overview_version,
+            'factors':factors,
+            'files':fnames,
+            'file_sizes':sizes,
+            'samplenumber':nsample
+            }
+    with open(os.path.join(tmpdir,'overview.json'),'wt') as f:
+        json.dump(info,f)
+    if (os.path.exists(outdir)):
+        shutil.rmtree(outdir)
+    os.rename(tmpdir,outdir)
+    _overview_invalidate(datapath)
+    return outdir
+
+class APDCAM_overview:
+    """
+    The overview of one measurement, as read by apdcam_overview().
+
+    Attributes
+    ----------
+    datapath : string
+        The directory of the measurement.
+    factors : list of ints
+        The decimation factors.
+    files : list of strings
+        The channel file names, in the order of the columns of the overview arrays.
+    column : dict
+        The column index for each channel file name.
+    samplenumber : int
+        The number of samples in the channel files.
+    """
+    def __init__(self, datapath, info):
+        self.datapath = datapath
+        self.factors = info['factors']
+        self.files = info['files']
+        self.column = {f:i for i,f in enumerate(self.files)}
+        self.samplenumber = info['samplenumber']
+        self._arrays = {}
+
+    def get(self, factor, stat):
+        """
+        Returns the overview array of one statistic for a decimation factor.
+        The array is memory mapped, its shape is (number of bins, number of channels).
+
+        Parameters
+        ----------
+        factor : int
+            The decimation factor.
+        stat : string
+            'min', 'max', 'mean' or 'rms'
+
+        """
+        key = (factor,stat)
+        a = self._arrays.get(key)
+        if (a is None):
+            if (factor not in self.factors):
+                raise ValueError("No overview for decimation factor {:d}.".format(factor))
+            if (stat not in _stats):
+                raise ValueError("Invalid overview statistic: {:s}".format(str(stat)))
+            a = np.load(os.path.join(self.datapath,overview_dirname,'L{:d}_{:s}.npy'.format(factor,stat)),
+                        mmap_mode='r')
+            self._arrays[key] = a
+        return a
+
+    def level_for(self, binsize, starts):
+        """
+        Returns the largest decimation factor which can be used for resampling, or None.
+        The bin size and all start samples should be multiples of the factor.
+        """
+        starts = np.atleast_1d(starts)
+        for f in sorted(self.factors,reverse=True):
+            if ((binsize % f == 0) and np.all(starts % f == 0)):
+                return f
+        return None
+
+    def resample(self, fnames, starts, ndata_out, binsize, dtype=float):
+        """
+        Calculates the mean and standard deviation in bins of binsize samples from the overview.
+        Equivalent to apdcam_resample on the raw data, within float32 precision.
+
+        Parameters
+        ----------
+        fnames : list of strings
+            The channel file names.
+        starts : int or numpy array of ints
+            The first sample of each window.
+        ndata_out : int
+            The number of bins in each window.
+        binsize : int
+            The bin size.
+        dtype : numpy dtype, optional
+            The data type of the returned arrays. The default is float.
+
+        Returns
+        -------
+        data_resample : numpy array
+            The mean in the bins, the shape is (number of windows * ndata_out, number of channels).
+        data_error : numpy array
+            The standard deviation in the bins.
+        None is returned instead if the data cannot be calculated from the overview,
+        the raw data should be resampled then.
+
+        """
+        starts = np.atleast_1d(starts)
+        f = self.level_for(binsize,starts)
+        if ((f is None) or any(fn not in self.column for fn in fnames)):
+            return None
+        k = binsize // f
+        cols = [self.column[fn] for fn in fnames]
+        m = self.get(f,'mean')
+        r = self.get(f,'rms')
+        data_resample = np.empty((len(starts) * ndata_out,len(cols)),dtype=dtype)
+        data_error = np.empty((len(starts) * ndata_out,len(cols)),dtype=dtype)
+        if (np.any(starts < 0) or (int(np.max(starts)) // f + ndata_out * k > m.shape[0])):
+            return None
+        for i,start in enumerate(starts):
+            b0 = int(start) // f
+            d_mean = m[b0:b0 + ndata_out * k,cols].astype(np.float64).reshape(ndata_out,k,len(cols))
+            d_rms = r[b0:b0 + ndata_out * k,cols].astype(np.float64).reshape(ndata_out,k,len(cols))
+            d_var = (d_rms ** 2 + d_mean ** 2).mean(axis=1)
+            d_mean = d_mean.mean(axis=1)
+            d_var -= d_mean ** 2
+            np.maximum(d_var,0,out=d_var)
+            data_resample[i * ndata_out:(i + 1) * ndata_out] = d_mean
+            data_error[i * ndata_out:(i + 1) * ndata_out] = np.sqrt(d_var)
+        return data_resample, data_error
+
+_overview_cache = collections.OrderedDict()
+_overview_cache_lock = threading.Lock()
+_overview_cache_size = 16
+
+def _overview_invalidate(datapath):
+    with _overview_cache_lock:
+        _overview_cache.pop(os.path.abspath(datapath),None)
+
+def apdcam_overview(datapath):
+    """
+    Returns the overview of a measurement, or None if there is no valid overview.
+    The overview is not valid if the channel files changed after it was built.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+
+    Returns
+    -------
+    APDCAM_overview or None
+
+    """
+    key = os.path.abspath(datapath)
+    infofile = os.path.join(key,overview_dirname,'overview.json')
+    try:
+        st = os.stat(infofile)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns,st.st_size)
+    with _overview_cache_lock:
+        entry = _overview_cache.get(key)
+        if ((entry is not None) and (entry[0] == stamp)):
+            _overview_cache.move_to_end(key)
+            return entry[1]
+    try:
+        with open(infofile,'rt') as f:
+            info = json.load(f)
+    except (OSError,ValueError):
+        return None
+    ov = None
+    if (info.get('version') == _overview_version):
+        try:
+            sizes = [os.path.getsize(os.path.join(key,fn)) for fn in info['files']]
+        except OSError:
+            sizes = None
+        if (sizes == info['file_sizes']):
+            ov = APDCAM_overview(key,info)
+    with _overview_cache_lock:
+        _overview_cache[key] = (stamp,ov)
+        while (len(_overview_cache) > _overview_cache_size):
+            _overview_cache.popitem(last=False)
+    return ov
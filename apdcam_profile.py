@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and I/O instrumentation of the APDCAM data reader.
+
+The reader marks its processing stages with profile_stage() and reports file I/O with profile_io().
+These are recorded by the APDCAM_profile objects active in the thread. A profile is active inside
+a with block or between start() and stop(), in the thread which started it and in the worker
+threads started through profile_bind(). When no profile is active the instrumentation costs
+practically nothing.
+
+Example:
+    with flap_apdcam.APDCAM_profile() as prof:
+        d = flap.get_data('APDCAM',name='APD-*',options={'Datapath':path})
+    print(prof)
+
+Alternatively the 'Profile' option of apdcam_get_data records the call into a profile,
+with True into apdcam_global_profile, which aggregates all such calls.
+
+Stages:
+    'get_data': The whole apdcam_get_data call.
+    'metadata': Reading the xml file (or taking it from the cache).
+    'select': Channel selection and data layout.
+    'read': Reading the channel files.
+    'resample': Resampling.
+    'scale': Conversion to the output signal.
+    'offset': Offset subtraction.
+    'coordinates': Creating the coordinates.
+    'data_object': Creating the flap.DataObject.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import time
+import threading
+import tracemalloc
+
+_tracemalloc_lock = threading.Lock()
+# The number of threads in which a profile tracing memory is active, counted for each profile
+_tracemalloc_users = 0
+# True if tracemalloc was started here, it is stopped when there are no more users
+_tracemalloc_started = False
+# The stages being traced for memory in all threads
+_mem_stages = []
+# The active profiles, their start() nesting and the current stage in each thread
+_local = threading.local()
+
+def _active():
+    return getattr(_local,'profiles',())
+
+def _nesting():
+    n = getattr(_local,'nesting',None)
+    if (n is None):
+        n = {}
+        _local.nesting = n
+    return n
+
+class APDCAM_profile:
+    """
+    Collects the time, bytes read, file opens and peak memory allocation for each
+    stage of the reader while active. Counters accumulate over all calls until reset().
+
+    The time of a stage is summed over the threads which run it in parallel, nested stages
+    are included in the time of the enclosing stage.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        Record the peak memory allocation in each stage using tracemalloc. This slows down
+        the reading. The default is False.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all counters.
+        """
+        with self._lock:
+            self.stages = {}
+
+    def start(self):
+        """
+        Starts recording in the calling thread. Can be called multiple times and in multiple
+        threads, recording in a thread stops at the matching number of stop() calls in that thread.
+        """
+        global _tracemalloc_users, _tracemalloc_started
+        nesting = _nesting()
+        nesting[self] = nesting.get(self,0) + 1
+        if (nesting[self] > 1):
+            return
+        if (self.trace_memory):
+            with _tracemalloc_lock:
+                if (_tracemalloc_users == 0):
+                    _tracemalloc_started = not tracemalloc.is_tracing()
+                    if (_tracemalloc_started):
+                        tracemalloc.start()
+                _tracemalloc_users += 1
+        _local.profiles = _active() + (self,)
+
+    def stop(self):
+        """
+        Stops recording in the calling thread.
+        """
+        global _tracemalloc_users, _tracemalloc_started
+        nesting = _nesting()
+        if (nesting.get(self,0) == 0):
+            return
+        nesting[self] -= 1
+        if (nesting[self] > 0):
+            return
+        del nesting[self]
+        _local.profiles = tuple(p for p in _active() if (p is not self))
+        if (self.trace_memory):
+            with _tracemalloc_lock:
+                _tracemalloc_users -= 1
+                if ((_tracemalloc_users == 0) and _tracemalloc_started):
+                    tracemalloc.stop()
+                    _tracemalloc_started = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _stage(self, name):
+        s = self.stages.get(name)
+        if (s is None):
+            s = {'calls':0,'time':0.,'bytes_read':0,'file_opens':0,'peak_alloc':0}
+            self.stages[name] = s
+        return s
+
+    def _add_time(self, name, dt, peak):
+        with self._lock:
+            s = self._stage(name)
+            s['calls'] += 1
+            s['time'] += dt
+            if ((peak is not None) and (peak > s['peak_alloc'])):
+                s['peak_alloc'] = peak
+
+    def _add_io(self, name, nbytes, opens):
+        with self._lock:
+            s = self._stage(name)
+            s['bytes_read'] += nbytes
+            s['file_opens'] += opens
+
+    def report(self):
+        """
+        Returns the counters.
+
+        Returns
+        -------
+        dict
+            For each stage name a dict with
+            'calls': The number of times the stage was run.
+            'time': The total time [s].
+            'bytes_read': The number of bytes read from files.
+            'file_opens': The number of files opened or mapped.
+            'peak_alloc': The largest peak memory allocation in one run of the stage [bytes],
+                          including its nested stages. tracemalloc traces the whole process,
+                          allocations of other threads during the stage are included.
+                          0 if memory was not traced.
+        """
+        with self._lock:
+            return {name:dict(s) for name,s in self.stages.items()}
+
+    def __str__(self):
+        lines = ["{:12s} {:>7s} {:>10s} {:>12s} {:>6s} {:>12s}".format('Stage','Calls','Time [s]','Bytes read',
+                                                                      'Opens','Peak alloc')]
+        for name,s in self.report().items():
+            lines.append("{:12s} {:7d} {:10.4f} {:12d} {:6d} {:12d}".format(name,s['calls'],s['time'],
+                                                                           s['bytes_read'],s['file_opens'],
+                                                                           s['peak_alloc']))
+        return "\n".join(lines)
+
+# The profile used by the 'Profile':True option of apdcam_get_data
+apdcam_global_profile = APDCAM_profile()
+
+def _fold_peak():
+    """
+    Folds the traced peak into the running peak of all stages being traced and starts a new
+    peak interval. Should be called with _tracemalloc_lock held.
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    for st in _mem_stages:
+        if (peak > st.peak):
+            st.peak = peak
+    tracemalloc.reset_peak()
+    return current
+
+class _Stage:
+    def __init__(self, name, profiles):
+        self.name = name
+        self.profiles = profiles
+
+    def __enter__(self):
+        self.prev = getattr(_local,'stage',None)
+        _local.stage = self.name
+        self.mem0 = None
+        if (tracemalloc.is_tracing()):
+            # Resetting the peak for this stage does not lose the peak of the enclosing stages
+            # or the stages of other threads, it is folded into them first
+            with _tracemalloc_lock:
+                self.mem0 = _fold_peak()
+                self.peak = self.mem0
+                _mem_stages.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        dt = time.perf_counter() - self.t0
+        peak = None
+        if (self.mem0 is not None):
+            with _tracemalloc_lock:
+                if (tracemalloc.is_tracing()):
+                    _fold_peak()
+                _mem_stages.remove(self)
+            peak = self.peak - self.mem0
+        _local.stage = self.prev
+        for p in self.profiles:
+            p._add_time(self.name,dt,peak)
+        return False
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_stage = _NullStage()
+
+def profile_stage(name):
+    """
+    Returns a context manager marking a stage of the reader.
+    """
+    profiles = _active()
+    if (len(profiles) == 0):
+        return _null_stage
+    return _Stage(name,profiles)
+
+def profile_io(nbytes, opens=0):
+    """
+    Records file I/O in the current stage of the thread, 'read' if there is none.
+    """
+    profiles = _active()
+    if (len(profiles) == 0):
+        return
+    name = getattr(_local,'stage',None)
+    if (name is None):
+        name = 'read'
+    for p in profiles:
+        p._add_io(name,nbytes,opens)
+
+def profile_bind(func):
+    """
+    Returns func so that when it is called in another thread it records into the profiles
+    and the current stage of the calling thread. Used for the worker threads of the reader.
+    """
+    profiles = _active()
+    if (len(profiles) == 0):
+        return func
+    stage = getattr(_local,'stage',None)
+    def bound(*args, **kwargs):
+        prev_profiles = _active()
+        prev_stage = getattr(_local,'stage',None)
+        _local.profiles = profiles
+        _local.stage = stage
+        try:
+            return func(*args,**kwargs)
+        finally:
+            _local.profiles = prev_profiles
+            _local.stage = prev_stage
+    return bound
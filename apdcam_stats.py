@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Per-pixel statistics index of APDCAM measurements.
+
+The index APDCAM_stats.npz is stored beside the channel files. For each pixel and each
+time block of block_samples samples it contains the mean, RMS, minimum, maximum of the
+signal and the number of saturated samples. The signal is in digits as returned by
+apdcam_get_data with 'Scaling':'Digit', that is APDCAM-10G data is inverted.
+A sample is saturated if it is within sat_margin digits of the full ADC range.
+
+The index is built by apdcam_build_stats() in one pass through the data, holding only one
+time block in memory. apdcam_stats() returns the index, its query methods do not read the
+measurement data:
+
+    stats = flap_apdcam.apdcam_stats(datapath)
+    stats.saturating_pixels(timerange=[0.1,0.2])
+    stats.dead_pixels()
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import json
+import collections
+import threading
+
+import numpy as np
+
+from .flap_apdcam_code import apdcam_raw_channels
+from .apdcam_compressed import apdcam_compressed_name
+from .apdcam_container import apdcam_container, container_filename
+
+stats_filename = 'APDCAM_stats.npz'
+_stats_version = 1
+_block_stats = ('mean','rms','min','max','saturated')
+
+def _apdcam_source_sizes(datapath, container, fnames):
+    """
+    Returns the sizes of the files holding the data of the channels, used for checking
+    whether the index is up to date. Channels without data have size None.
+    """
+    if (container is not None):
+        size = os.path.getsize(os.path.join(datapath,container_filename))
+        return [size if fn in container.column else None for fn in fnames]
+    sizes = []
+    for fn in fnames:
+        filename = os.path.join(datapath,fn)
+        for f in (filename,apdcam_compressed_name(filename)):
+            try:
+                sizes.append(os.path.getsize(f))
+                break
+            except OSError:
+                pass
+        else:
+            sizes.append(None)
+    return sizes
+
+def apdcam_build_stats(datapath, block_samples=100000, sat_margin=0, options=None):
+    """
+    Builds the statistics index of a measurement. The data is read once, one time block
+    of all pixels at a time. An existing index is replaced.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+    block_samples : int, optional
+        The number of samples in a time block of the index. The default is 100000.
+    sat_margin : int, optional
+        Samples within this number of digits of the ADC full range are saturated. The default is 0.
+    options : dict, optional
+        The 'Camera type' and 'Camera version' options of apdcam_get_data if they are not in the xml file.
+
+    Returns
+    -------
+    string
+        The name of the index file.
+
+    """
+    if (block_samples < 1):
+        raise ValueError("block_samples should be positive.")
+    raw_channels = apdcam_raw_channels(datapath,'APD-*',options=options)
+    t = raw_channels.config
+    sizes = _apdcam_source_sizes(datapath,raw_channels.container,raw_channels.files)
+    pixels = [ch for ch,s in zip(raw_channels.channels,sizes) if (s is not None)]
+    fnames = [fn for fn,s in zip(raw_channels.files,sizes) if (s is not None)]
+    sizes = [s for s in sizes if (s is not None)]
+    if (len(fnames) == 0):
+        raise IOError("No channel data found in {:s}".format(datapath))
+    npix = len(fnames)
+    nsample = t['samplenumber']
+    nblock = (nsample + block_samples - 1) // block_samples
+    maxval = 2 ** t['bits'] - 1
+    inverted = (raw_channels.camera_family == 'APDCAM-10G')
+
+    arrays = {'mean':np.empty((nblock,npix),dtype=np.float32),
+              'rms':np.empty((nblock,npix),dtype=np.float32),
+              'min':np.empty((nblock,npix),dtype=np.int16),
+              'max':np.empty((nblock,npix),dtype=np.int16),
+              'saturated':np.empty((nblock,npix),dtype=np.int32)
+              }
+    for b in range(nblock):
+        start = b * block_samples
+        n = min(block_samples,nsample - start)
+        raw = raw_channels.read(fnames,start,n)
+        d_min = np.amin(raw,axis=0)
+        d_max = np.amax(raw,axis=0)
+        if (inverted):
+            d_sat = np.count_nonzero(raw <= sat_margin,axis=0)
+        else:
+            d_sat = np.count_nonzero(raw >= maxval - sat_margin,axis=0)
+        # Integer data is accumulated exactly in int64
+        d = raw.astype(np.int64)
+        del raw
+        d_mean = np.sum(d,axis=0) / n
+        d *= d
+        d_var = np.sum(d,axis=0) / n - d_mean ** 2
+        del d
+        arrays['rms'][b] = np.sqrt(np.maximum(d_var,0))
+        arrays['saturated'][b] = d_sat
+        if (inverted):
+            arrays['mean'][b] = maxval - d_mean
+            arrays['min'][b] = maxval - d_max
+            arrays['max'][b] = maxval - d_min
+        else:
+            arrays['mean'][b] = d_mean
+            arrays['min'][b] = d_min
+            arrays['max'][b] = d_max
+
+    info = {'version':_stats_version,
+            'pixels':pixels,
+            'files':fnames,
+            'file_sizes':sizes,
+            'samplenumber':nsample,
+            'block_samples':block_samples,
+            'starttime':float(t['starttime']),
+            'sampletime':float(t['sampletime']),
+            'bits':t['bits'],
+            'sat_margin':sat_margin
+            }
+    outfile = os.path.join(datapath,stats_filename)
+    # np.savez adds the .npz extension to the name if it is missing
+    tmpfile = outfile + '.tmp.npz'
+    np.savez_compressed(tmpfile,info=np.array(json.dumps(info)),**arrays)
+    os.replace(tmpfile,outfile)
+    _stats_invalidate(datapath)
+    return outfile
+
+class APDCAM_stats:
+    """
+    The statistics index of one measurement, as read by apdcam_stats().
+
+    Attributes
+    ----------
+    datapath : string
+        The directory of the measurement.
+    pixels : list of strings
+        The pixel names, in the order of the columns of the statistics arrays.
+    files : list of strings
+        The channel file name of each pixel.
+    samplenumber : int
+        The number of samples in the measurement.
+    block_samples : int
+        The number of samples in a time block. The last block can be shorter.
+    starttime : float
+        The time of the first sample [s].
+    sampletime : float
+        The sample time [s].
+    bits : int
+        The ADC bit resolution.
+    sat_margin : int
+        The saturation margin used when building the index.
+    file_sizes : list of ints
+        The sizes of the data files when building the index.
+    """
+    def __init__(self, datapath, info, arrays):
+        self.datapath = datapath
+        self.pixels = info['pixels']
+        self.files = info['files']
+        self.samplenumber = info['samplenumber']
+        self.block_samples = info['block_samples']
+        self.starttime = info['starttime']
+        self.sampletime = info['sampletime']
+        self.bits = info['bits']
+        self.sat_margin = info['sat_margin']
+        self.file_sizes = info['file_sizes']
+        self._arrays = arrays
+        nblock = arrays['mean'].shape[0]
+        self._counts = np.full(nblock,self.block_samples,dtype=np.int64)
+        self._counts[-1] = self.samplenumber - (nblock - 1) * self.block_samples
+
+    def blocks(self, timerange=None):
+        """
+        Returns the range of time blocks overlapping a time range.
+
+        Parameters
+        ----------
+        timerange : list of floats, optional
+            The start and end time [s]. The default is None, the whole measurement.
+
+        Returns
+        -------
+        slice
+            The blocks.
+
+        """
+        nblock = len(self._counts)
+        if (timerange is None):
+            return slice(0,nblock)
+        if (len(timerange) != 2):
+            raise ValueError("timerange should be [start,end] in seconds.")
+        s0 = int(np.floor((timerange[0] - self.starttime) / self.sampletime + 0.5))
+        s1 = int(np.floor((timerange[1] - self.starttime) / self.sampletime + 0.5))
+        s0 = max(s0,0)
+        s1 = min(s1,self.samplenumber - 1)
+        if (s1 < s0):
+            raise ValueError("No data in timerange.")
+        return slice(s0 // self.block_samples,s1 // self.block_samples + 1)
+
+    def block_times(self):
+        """
+        Returns the start and end time of each block [s], array of shape (number of blocks, 2).
+        """
+        start = np.arange(len(self._counts)) * self.block_samples
+        return np.stack((start,start + self._counts - 1),axis=1) * self.sampletime + self.starttime
+
+    def get(self, stat, timerange=None):
+        """
+        Returns a statistic for each block and pixel.
+
+        Parameters
+        ----------
+        stat : string
+            'mean', 'rms', 'min', 'max' or 'saturated'
+        timerange : list of floats, optional
+            Only the blocks overlapping this time range are returned. The default is None, all blocks.
+
+        Returns
+        -------
+        numpy array
+            Array of shape (number of blocks, number of pixels).
+
+        """
+        if (stat not in _block_stats):
+            raise ValueError("Invalid statistic: {:s}".format(str(stat)))
+        return self._arrays[stat][self.blocks(timerange)]
+
+    def pixel_stats(self, timerange=None):
+        """
+        Returns the statistics of each pixel in the blocks overlapping a time range.
+
+        Parameters
+        ----------
+        timerange : list of floats, optional
+            The start and end time [s]. The default is None, the whole measurement.
+
+        Returns
+        -------
+        dict
+            'mean', 'rms', 'min', 'max', 'saturated': Arrays with one element for each pixel.
+
+        """
+        sl = self.blocks(timerange)
+        n = self._counts[sl][:,np.newaxis]
+        mean = self._arrays['mean'][sl].astype(np.float64)
+        rms = self._arrays['rms'][sl].astype(np.float64)
+        total_mean = np.sum(mean * n,axis=0) / np.sum(n)
+        total_var = np.sum((rms ** 2 + mean ** 2) * n,axis=0) / np.sum(n) - total_mean ** 2
+        return {'mean':total_mean,
+                'rms':np.sqrt(np.maximum(total_var,0)),
+                'min':np.amin(self._arrays['min'][sl],axis=0),
+                'max':np.amax(self._arrays['max'][sl],axis=0),
+                'saturated':np.sum(self._arrays['saturated'][sl],axis=0,dtype=np.int64)
+                }
+
+    def saturating_pixels(self, timerange=None, min_count=1):
+        """
+        Returns the pixels which saturate in a time range.
+
+        Parameters
+        ----------
+        timerange : list of floats, optional
+            The start and end time [s]. The default is None, the whole measurement.
+            As the index has block resolution the whole blocks overlapping the range are considered.
+        min_count : int, optional
+            The minimum number of saturated samples. The default is 1.
+
+        Returns
+        -------
+        list of strings
+            The pixel names.
+
+        """
+        sat = np.sum(self.get('saturated',timerange),axis=0,dtype=np.int64)
+        return [self.pixels[i] for i in np.nonzero(sat >= min_count)[0]]
+
+    def dead_pixels(self, rms_limit=0.5, timerange=None):
+        """
+        Returns the pixels whose signal does not change.
+
+        Parameters
+        ----------
+        rms_limit : float, optional
+            Pixels with RMS below this [digit] are dead. The default is 0.5.
+        timerange : list of floats, optional
+            The start and end time [s]. The default is None, the whole measurement.
+
+        Returns
+        -------
+        list of strings
+            The pixel names.
+
+        """
+        rms = self.pixel_stats(timerange)['rms']
+        return [self.pixels[i] for i in np.nonzero(rms < rms_limit)[0]]
+
+_stats_cache = collections.OrderedDict()
+_stats_cache_lock = threading.Lock()
+_stats_cache_size = 16
+
+def _stats_invalidate(datapath):
+    with _stats_cache_lock:
+        _stats_cache.pop(os.path.abspath(datapath),None)
+
+def apdcam_stats(datapath):
+    """
+    Returns the statistics index of a measurement, or None if there is no valid index.
+    The index is not valid if the data files changed after it was built.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+
+    Returns
+    -------
+    APDCAM_stats or None
+
+    """
+    key = os.path.abspath(datapath)
+    filename = os.path.join(key,stats_filename)
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns,st.st_size)
+    with _stats_cache_lock:
+        entry = _stats_cache.get(key)
+        if ((entry is not None) and (entry[0] == stamp)):
+            _stats_cache.move_to_end(key)
+            stats = entry[1]
+        else:
+            stats = None
+    if (stats is None):
+        try:
+            with np.load(filename) as f:
+                info = json.loads(str(f['info']))
+                arrays = {s:f[s] for s in _block_stats}
+        except (OSError,ValueError,KeyError):
+            return None
+        if (info.get('version') != _stats_version):
+            return None
+        stats = APDCAM_stats(key,info,arrays)
+        with _stats_cache_lock:
+            _stats_cache[key] = (stamp,stats)
+            while (len(_stats_cache) > _stats_cache_size):
+                _stats_cache.popitem(last=False)
+    # The data files are checked at every call as the index file does not change with them
+    container = None
+    if (os.path.exists(os.path.join(key,container_filename))
+        and not os.path.exists(os.path.join(key,'APDCAM_config.xml'))):
+        container = apdcam_container(key)
+    if (_apdcam_source_sizes(key,container,stats.files) != stats.file_sizes):
+        return None
+    return stats
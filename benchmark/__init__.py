@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the APDCAM data reader.
+
+make_synthetic_shot() creates APDCAM-1G and APDCAM-10G measurement directories with
+synthetic data, run_benchmark() times the typical reading scenarios and writes a JSON report.
+From the command line:
+    python -m flap_apdcam.benchmark --report report.json
+
+receive_benchmark.run_receive_benchmark() compares the APDCAM-10G packet receive rate with and without recvmmsg:
+    python -m flap_apdcam.benchmark.receive_benchmark
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+from .synthetic_shot import make_synthetic_shot
+from .run_benchmark import run_benchmark, compare_reports
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the APDCAM reader benchmark: python -m flap_apdcam.benchmark --help
+"""
+
+from .run_benchmark import main
+
+main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Packet receive rate of the APDCAM-10G stream capture with and without recvmmsg.
+
+A sender process sends packets of the APDCAM-10G stream size over the loopback interface
+as fast as possible, the capture receives them into its ring buffer. The rate is the number
+of packets received per second. Packets lost in the kernel are counted.
+
+Run from the command line:
+    python -m flap_apdcam.benchmark.receive_benchmark
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import sys
+import time
+import socket
+import argparse
+import multiprocessing
+
+from ..apdcam_control.apdcam10g_capture import APDCAM10G_stream_capture, apdcam10g_recvmmsg_available
+
+def _sender(port, packet_size, packets, ready):
+    s = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    data = bytes(packet_size)
+    ready.wait()
+    for i in range(packets):
+        s.sendto(data,('127.0.0.1',port))
+    s.close()
+
+def receive_rate(use_recvmmsg, packets=200000, packet_size=8966, batch=256, slots=4096, port=10100):
+    """
+    Measures the receive rate of the stream capture.
+
+    Parameters
+    ----------
+    use_recvmmsg : bool
+        Receive with recvmmsg.
+    packets : int, optional
+        The number of packets sent. The default is 200000.
+    packet_size : int, optional
+        The packet size [bytes]. The default is 8966, the packet size at 9000 byte MTU.
+    batch : int, optional
+        The number of packets requested in one receive call. The default is 256.
+    slots : int, optional
+        The ring buffer size in packets. The default is 4096.
+    port : int, optional
+        The UDP port used. The default is 10100.
+
+    Returns
+    -------
+    dict
+        'packets': The number of packets received.
+        'time': The receive time [s].
+        'rate': Packets per second.
+        'recvmmsg': True if recvmmsg was used.
+
+    """
+    sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,256 * 2 ** 20)
+    sock.bind(('127.0.0.1',port))
+    sock.settimeout(0.5)
+    capture = APDCAM10G_stream_capture(sock,packet_size,slots,use_recvmmsg=use_recvmmsg)
+    ready = multiprocessing.Event()
+    p = multiprocessing.Process(target=_sender,args=(port,packet_size,packets,ready))
+    p.start()
+    ready.set()
+    t_first = None
+    t_last = None
+    try:
+        while (not capture.stopped and (capture.write_count < packets)):
+            n = capture.receive(min(batch,packets - capture.write_count))
+            if (n != 0):
+                if (t_first is None):
+                    t_first = capture.times[capture.read_count % capture.slots]
+                t_last = time.time()
+            # Emptying the ring buffer
+            while (capture.read_count < capture.write_count):
+                capture.read()
+    finally:
+        p.join()
+        sock.close()
+    if ((t_first is None) or (t_last == t_first)):
+        rate = 0.
+    else:
+        rate = (capture.write_count - 1) / (t_last - t_first)
+    return {'packets':capture.write_count,
+            'time':0. if t_first is None else t_last - t_first,
+            'rate':rate,
+            'recvmmsg':capture.use_recvmmsg
+            }
+
+def run_receive_benchmark(packets=200000, packet_size=8966, repeat=3, verbose=True):
+    """
+    Compares the receive rate with and without recvmmsg.
+
+    Parameters
+    ----------
+    packets : int, optional
+        The number of packets sent in one run. The default is 200000.
+    packet_size : int, optional
+        The packet size [bytes]. The default is 8966.
+    repeat : int, optional
+        The number of runs, the best is reported. The default is 3.
+    verbose : bool, optional
+        Print the results. The default is True.
+
+    Returns
+    -------
+    dict
+        For 'recv_into' and 'recvmmsg' the best result of receive_rate().
+        'recvmmsg' is missing if it is not available.
+
+    """
+    modes = [('recv_into',False)]
+    if (apdcam10g_recvmmsg_available()):
+        modes.append(('recvmmsg',True))
+    result = {}
+    for name,use_recvmmsg in modes:
+        runs = [receive_rate(use_recvmmsg,packets=packets,packet_size=packet_size) for i in range(repeat)]
+        result[name] = max(runs,key=lambda r: r['rate'])
+        if (verbose):
+            r = result[name]
+            print("{:10s} {:12.0f} packets/s  {:7.1f} MB/s  {:d} of {:d} packets received".format(
+                  name,r['rate'],r['rate'] * packet_size / 1e6,r['packets'],packets))
+            sys.stdout.flush()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="APDCAM-10G packet receive benchmark")
+    parser.add_argument('--packets',type=int,default=200000,help="Packets per run")
+    parser.add_argument('--packet-size',type=int,default=8966,help="Packet size [bytes]")
+    parser.add_argument('--repeat',type=int,default=3,help="Runs per mode")
+    args = parser.parse_args(argv)
+    run_receive_benchmark(packets=args.packets,packet_size=args.packet_size,repeat=args.repeat)
+
+if __name__ == '__main__':
+    main()
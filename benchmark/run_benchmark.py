@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the APDCAM data reader in typical scenarios.
+
+Run from the command line:
+    python -m flap_apdcam.benchmark --report report.json
+Compare two reports:
+    python -m flap_apdcam.benchmark --compare old.json new.json
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+import flap
+
+from .synthetic_shot import make_synthetic_shot
+from ..flap_apdcam_code import apdcam_get_data, apdcam_invalidate_cache
+from ..apdcam_control.apdcam_channel_tables import apdcam_channel_tables
+
+# The cameras measured by default
+default_cameras = ['APDCAM-10G_8x8','APDCAM-10G_4x32','APDCAM-10G_FC','APDCAM-1G']
+
+def _scenarios(camera_type, samplenumber, f_sample):
+    """
+    Returns the scenarios for a camera: list of (name, data_name, options, coordinates).
+    """
+    if (camera_type[:10] == 'APDCAM-10G'):
+        tables = apdcam_channel_tables('APDCAM-10G',camera_type=camera_type[11:])
+    else:
+        tables = apdcam_channel_tables('APDCAM')
+    pixel = tables.ch_names[0]
+    window = flap.Coordinate(name='Sample',c_range=[samplenumber // 2,samplenumber // 2 + 999])
+    return [('single_pixel',pixel,{},None),
+            ('all_pixels_3d','APD-*',{},None),
+            ('all_pixels_2d','ADC*',{},None),
+            ('short_window','APD-*',{},window),
+            ('resample','APD-*',{'Resample':f_sample / 100},None),
+            ('volt','APD-*',{'Scaling':'Volt'},None),
+            ('volt_float32','APD-*',{'Scaling':'Volt','Dtype':'float32'},None),
+            ('all_pixels_4_threads','APD-*',{'Read threads':4},None),
+            ]
+
+def _git_commit():
+    try:
+        return subprocess.run(['git','rev-parse','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True,text=True,timeout=10).stdout.strip()
+    except (OSError,subprocess.SubprocessError):
+        return None
+
+def run_benchmark(workdir=None, cameras=None, samplenumber=1000000, repeat=5, report=None, verbose=True):
+    """
+    Creates synthetic measurements and times reading them in different scenarios.
+    Each scenario is run once before timing, so the files are in the OS cache.
+
+    Parameters
+    ----------
+    workdir : string, optional
+        The directory for the synthetic measurements. The default is None, a temporary
+        directory which is deleted at the end.
+    cameras : list of strings, optional
+        The camera types. The default is default_cameras.
+    samplenumber : int, optional
+        The number of samples per channel. The default is 1000000.
+    repeat : int, optional
+        The number of timed runs of each scenario. The default is 5.
+    report : string, optional
+        The JSON report is written to this file. The default is None, no file.
+    verbose : bool, optional
+        Print the results. The default is True.
+
+    Returns
+    -------
+    dict
+        The report.
+
+    """
+    if (cameras is None):
+        cameras = default_cameras
+    result = {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'commit':_git_commit(),
+              'python':platform.python_version(),
+              'numpy':np.__version__,
+              'platform':platform.platform(),
+              'samplenumber':samplenumber,
+              'repeat':repeat,
+              'results':{}
+              }
+    tmpdir = None
+    if (workdir is None):
+        tmpdir = tempfile.TemporaryDirectory()
+        workdir = tmpdir.name
+    try:
+        for camera_type in cameras:
+            datapath = os.path.join(workdir,camera_type)
+            make_synthetic_shot(datapath,camera_type=camera_type,samplenumber=samplenumber)
+            f_sample = 2e6
+            for name,data_name,options,coordinates in _scenarios(camera_type,samplenumber,f_sample):
+                _options = dict(options)
+                _options['Datapath'] = datapath
+                d = apdcam_get_data(data_name=data_name,options=_options,coordinates=coordinates)
+                nbytes = d.data.nbytes
+                shape = list(d.data.shape)
+                del d
+                times = []
+                for i in range(repeat):
+                    t0 = time.perf_counter()
+                    d = apdcam_get_data(data_name=data_name,options=_options,coordinates=coordinates)
+                    times.append(time.perf_counter() - t0)
+                    del d
+                key = camera_type + '/' + name
+                result['results'][key] = {'min':min(times),
+                                          'median':float(np.median(times)),
+                                          'output_bytes':nbytes,
+                                          'shape':shape
+                                          }
+                if (verbose):
+                    print("{:40s} {:9.4f} s  {:s}".format(key,min(times),str(shape)))
+                    sys.stdout.flush()
+            apdcam_invalidate_cache(datapath)
+    finally:
+        if (tmpdir is not None):
+            tmpdir.cleanup()
+    if (report is not None):
+        with open(report,'wt') as f:
+            json.dump(result,f,indent=2)
+    return result
+
+def compare_reports(old, new, verbose=True):
+    """
+    Compares two benchmark reports.
+
+    Parameters
+    ----------
+    old, new : string or dict
+        The report files or reports.
+    verbose : bool, optional
+        Print the comparison. The default is True.
+
+    Returns
+    -------
+    dict
+        The ratio of the new and old minimum times for each scenario in both reports.
+
+    """
+    reports = []
+    for r in (old,new):
+        if (type(r) is str):
+            with open(r,'rt') as f:
+                r = json.load(f)
+        reports.append(r)
+    ratio = {}
+    for key in reports[0]['results']:
+        if (key in reports[1]['results']):
+            ratio[key] = reports[1]['results'][key]['min'] / reports[0]['results'][key]['min']
+            if (verbose):
+                print("{:40s} {:9.4f} s {:9.4f} s  x{:.2f}".format(key,
+                                                                  reports[0]['results'][key]['min'],
+                                                                  reports[1]['results'][key]['min'],
+                                                                  ratio[key]))
+    return ratio
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="APDCAM reader benchmark")
+    parser.add_argument('--report',help="JSON report file")
+    parser.add_argument('--workdir',help="Directory for the synthetic measurements")
+    parser.add_argument('--samples',type=int,default=1000000,help="Samples per channel")
+    parser.add_argument('--repeat',type=int,default=5,help="Timed runs per scenario")
+    parser.add_argument('--cameras',nargs='+',help="Camera types")
+    parser.add_argument('--compare',nargs=2,metavar=('OLD','NEW'),help="Compare two reports")
+    args = parser.parse_args(argv)
+    if (args.compare is not None):
+        compare_reports(args.compare[0],args.compare[1])
+        return
+    run_benchmark(workdir=args.workdir,cameras=args.cameras,samplenumber=args.samples,repeat=args.repeat,
+                  report=args.report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic APDCAM measurements for benchmarking and testing the reader.
+
+@author: Sandor Zoletnik, Centre for Energy Research
+         zoletnik.sandor@ek-cer.hu
+"""
+
+import os
+
+import numpy as np
+
+from ..apdcam_control.apdcamXml import apdcamXml
+from ..apdcam_control.apdcam_channel_tables import apdcam_channel_tables
+from ..apdcam_control.apdcam_types_versions import apdcam_types_versions
+
+def make_synthetic_shot(datapath, camera_type='APDCAM-10G_8x8', camera_version=1, samplenumber=100000,
+                        bits=14, samplediv=5, channel_mask=None, trigger=-1., seed=0, block_samples=1000000):
+    """
+    Creates a measurement directory with APDCAM_config.xml and channel files with synthetic data.
+    The signal of each channel is an offset, a sine wave and Gaussian noise within the ADC range.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory to create. Existing files are overwritten.
+    camera_type : string, optional
+        One of the camera types in apdcam_types_versions(). The default is 'APDCAM-10G_8x8'.
+    camera_version : int, optional
+        The camera version for 10G cameras. The default is 1.
+    samplenumber : int, optional
+        The number of samples per channel. The default is 100000.
+    bits : int, optional
+        The ADC bit resolution. The default is 14.
+    samplediv : int, optional
+        The sample divider. The ADC clock is 10 MHz, the default gives 2 MHz sampling.
+    channel_mask : int, optional
+        Bit mask of the ADC channels to write, bit 0 is ADC 1. The default is None, all channels
+        used by the camera.
+    trigger : float, optional
+        The trigger time [s]. Negative means no trigger. The default is -1.
+    seed : int, optional
+        Random seed. The default is 0.
+    block_samples : int, optional
+        The data is generated in blocks of this many samples. The default is 1000000.
+
+    Returns
+    -------
+    list of strings
+        The names of the channel files written.
+
+    """
+    camera_types, camera_versions = apdcam_types_versions()
+    try:
+        i_type = camera_types.index(camera_type)
+    except ValueError:
+        raise ValueError("Invalid camera type: {:s}".format(str(camera_type)))
+    if (camera_type[:10] == 'APDCAM-10G'):
+        camera_family = 'APDCAM-10G'
+        if (camera_version not in camera_versions[i_type]):
+            raise ValueError("Invalid camera version {:d} for {:s}".format(camera_version,camera_type))
+        tables = apdcam_channel_tables(camera_family,camera_type=camera_type[11:],camera_version=camera_version)
+    else:
+        camera_family = 'APDCAM'
+        if (camera_type == 'APDCAM-1G'):
+            sensor_angle = 0
+        else:
+            sensor_angle = int(camera_type[10:])
+        tables = apdcam_channel_tables(camera_family,sensor_rotation=sensor_angle)
+    adc_list = np.unique(tables.adc)
+    if (channel_mask is None):
+        channel_mask = 0
+        for adc in adc_list:
+            channel_mask |= 1 << (int(adc) - 1)
+
+    os.makedirs(datapath,exist_ok=True)
+    m = apdcamXml(os.path.join(datapath,'APDCAM_config.xml'))
+    m.createHead(camera_family)
+    m.addElement(section='ADCSettings',element='ADCMult',value=20)
+    m.addElement(section='ADCSettings',element='ADCDiv',value=40)
+    m.addElement(section='ADCSettings',element='Samplediv',value=int(samplediv))
+    m.addElement(section='ADCSettings',element='SampleNumber',value=int(samplenumber))
+    m.addElement(section='ADCSettings',element='Bits',value=int(bits))
+    m.addElement(section='ADCSettings',element='Trigger',value=float(trigger))
+    if (camera_family == 'APDCAM-10G'):
+        for i in range(4):
+            m.addElement(section='ADCSettings',element='ChannelMask{:d}'.format(i + 1),
+                         value='{:08X}'.format((channel_mask >> (32 * i)) & 0xFFFFFFFF),value_type='long')
+        m.addElement(section='APDCAM',element='CameraType',value=camera_type,value_type='string')
+        m.addElement(section='APDCAM',element='CameraVersion',value=int(camera_version))
+    else:
+        m.addElement(section='ADCSettings',element='ChannelMask',
+                     value='{:08X}'.format(channel_mask & 0xFFFFFFFF),value_type='long')
+        m.addElement(section='APDCAM',element='CameraType',value=sensor_angle)
+    m.writeFile()
+
+    rng = np.random.default_rng(seed)
+    maxval = 2 ** bits - 1
+    fnames = []
+    for adc in adc_list:
+        if ((channel_mask >> (int(adc) - 1)) & 1 == 0):
+            continue
+        if (camera_family == 'APDCAM-10G'):
+            fn = 'Channel_{:03d}.dat'.format(int(adc) - 1)
+        else:
+            fn = 'Channel{:02d}.dat'.format(int(adc) - 1)
+        offset = maxval * (0.1 + 0.3 * rng.random())
+        amp = maxval * 0.1 * rng.random()
+        period = 1000 + 10000 * rng.random()
+        noise = maxval * 0.01
+        with open(os.path.join(datapath,fn),'wb') as f:
+            for start in range(0,samplenumber,block_samples):
+                n = min(block_samples,samplenumber - start)
+                t = np.arange(start,start + n)
+                d = offset + amp * np.sin(2 * np.pi * t / period) + rng.normal(0,noise,n)
+                np.clip(np.rint(d),0,maxval).astype(np.int16).tofile(f)
+        fnames.append(fn)
+    return fnames
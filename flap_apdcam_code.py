@@ -14,11 +14,21 @@ import numpy as np
 import copy
 import os
 import fnmatch
+import concurrent.futures
+import collections
+import threading
+import tempfile
+import json
 
 import flap
 
-from .apdcam_control.apdcam10g_channel_map import apdcam10g_channel_map
-from .apdcam_control.apdcam_channel_map import apdcam_channel_map
+from .apdcam_control.apdcam_channel_tables import apdcam_channel_tables
+from .apdcam_overview import apdcam_overview
+from .apdcam_compressed import apdcam_compressed_name, apdcam_compressed_channel
+from .apdcam_container import apdcam_container, container_filename
+from .apdcam_profile import profile_stage, profile_io, profile_bind, apdcam_global_profile
+from .apdcam_fir import APDCAM_fir_decimator
+from .apdcam_geometry import apdcam_coordinate_tables
 from .apdcam_control.apdcam_types_versions import *
 
 
@@ -73,118 +83,420 @@ def apdcam_get_config(xml):
         retval['Sensor angle'] = int(xml.get_element('APDCAM', 'CameraType')['Value'])      
     except ValueError:
         pass
-         
-    try:
-        ADCMult= Decimal(xml.get_element('ADCSettings', 'ADCMult')['Value'])
-        ADCDiv= Decimal(xml.get_element('ADCSettings','ADCDiv')['Value'])
-        retval['f_ADC'] = Decimal(20e6)*ADCMult/ADCDiv
-        samplediv= Decimal(xml.get_element('ADCSettings','Samplediv')['Value'])
-        retval['f_sample'] = retval['f_ADC'] / samplediv
-        retval['sampletime'] = Decimal(1.)/retval['f_sample']
-        retval['samplenumber'] = int(xml.get_element('ADCSettings', 'SampleNumber')['Value'])
-        retval['bits'] = int(xml.get_element('ADCSettings', 'Bits')['Value'])
-        trigger = Decimal(xml.get_element('ADCSettings', 'Trigger')['Value'])
-        if (trigger < 0):
-            trigger = float(0)
-        retval['starttime'] = trigger
-        if (camera_family == 'APDCAM-10G'):
-            mask1 = int(xml.get_element('ADCSettings', 'ChannelMask1')['Value'],16)
-            mask2 = int(xml.get_element('ADCSettings', 'ChannelMask2')['Value'],16)
-            mask3 = int(xml.get_element('ADCSettings', 'ChannelMask3')['Value'],16)
-            mask4 = int(xml.get_element('ADCSettings', 'ChannelMask4')['Value'],16)
-            chmask = mask1 + (mask2<<32) + (mask3<<64) + (mask4<<96)
-        if (camera_family == 'APDCAM'):
-            chmask = int(xml.get_element('ADCSettings','ChannelMask')['Value'],16)
-    except ValueError as e:
-        raise e
     return retval
 
-def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, coordinates=None, data_source=None,
-                    ):
-    """ 
-    Data read function for APDCAM 1G and 10G.
-    
+def apdcam_read_channel(filename, start, count, memmap=False, out=None, threads=1):
+    """
+    Reads samples from one APDCAM channel file. If the file does not exist but the compressed
+    file (.apz) does, the data is read from the compressed file.
+
     Parameters
     ----------
-    data_name: string
-               ADCxxx: ADC number. Unix style regular expressions are allowed:
-                       ADC*
-                       ADC[2-5]
-                       Can also be a list of data names, eg. ['ADC1','ADC3']
-               APD-r-c (string): APD pixel number
-    coordinates: List of flap.Coordinate() or a single flap.Coordinate
-                 Defines read ranges. The following coordinates are interpreted:
-                     'Sample': The read samples
-                     'Time': The read times
-                     Only a single equidistant range is interpreted. Use option "Resample"
-                     to resample the signal to lower frequency than the original sampling frequency.
-    options: dict
-        'Scaling':  'Digit'
-                    'Volt'
-        'Datapath': Data path (string)
-        'Camera type': string
-                        None: Determine camera type from xml file
-                        string: Set camera type as below.
-                        The camera type:
-                         APDCAM-10G:
-                             APDCAM-10G_4x32
-                             APDCAM-10G_8x8
-                             APDCAM-10G_4x16
-                             APDCAM-10G_8x16
-                             APDCAM-10G_8x16A
-                             APDCAM-10G_FC
-                         APDCAM-1G: 
-                             APDCAM-1G : Standard APDCAM-1G (Horizontal array)
-                             APDCAM-1G_90: APDCAM-1G with sensor rotated 90 degree CCW
-                             APDCAM-1G_180: APDCAM-1G with sensor rotated 180 degree CCW
-                             APDCAM-1G_270: APDCAM-1G with sensor rotated 270 degree CCW
-        'Camera_version': int
-            Only applicable to 10G cameras: 0,1,2
-        'Resample': Resample to this frequency [Hz]. Only frequencies below the sampling frequency can be used.
-                    The frequency will be rounded to the integer times the sampling frequency. 
-                    Data will be averaged in blocks and the variance in blocks will be added as error.
-   
-    Return value
-    ------------
-    flap.DataObject:
-        The output flap data object. The data dimension depends on the requested channels.
-        If only 1 channel is requested: 1D
-        If any of the channels is ADCxxx or the camera is FC type or the requested channels
-        do not form a 2D array: 2D
-        If the camera is 2D and the requested channels form a regular 2D subarray of it: 3D
-            
+    filename : string
+        The channel file name.
+    start : int or array of ints
+        The first sample to read. If an array, count samples are read from each start
+        and returned after each other. The file is opened only once.
+    count : int
+        The number of samples to read from each start.
+    memmap : bool, optional
+        If True the file is memory mapped and a read-only view of the requested samples is returned.
+        Data is read from disk only when the array is accessed. If start is an array a copy
+        of the requested samples is returned. The default is False.
+    out : numpy array of int16, optional
+        Contiguous array of count elements (times the number of starts). If set the samples 
+        are read directly into this array with no intermediate buffer. Not used if memmap is True
+        and start is a single value.
+    threads : int, optional
+        The number of threads decompressing the chunks of a compressed file. The default is 1.
+
+    Returns
+    -------
+    numpy array of int16
+        The samples. This is out if it was set.
+
     """
+    if (not os.path.exists(filename)):
+        cfile = apdcam_compressed_name(filename)
+        if (os.path.exists(cfile)):
+            # Compressed files cannot be memory mapped, they are always decompressed
+            ch = apdcam_compressed_channel(cfile)
+            starts = np.array(start,dtype=np.int64).flatten()
+            if (out is None):
+                out = np.empty(len(starts) * count,dtype=np.int16)
+            for i in range(len(starts)):
+                ch.read(int(starts[i]),count,out=out[i * count:(i + 1) * count],threads=threads)
+            return out
+    profile_io(np.size(start) * count * 2,opens=1)
+    if (np.ndim(start) != 0):
+        starts = np.array(start,dtype=np.int64).flatten()
+        if (out is None):
+            out = np.empty(len(starts) * count,dtype=np.int16)
+        if (memmap or (count < 256)):
+            # Many short reads: the file is mapped and the samples are picked in one operation
+            try:
+                m = np.memmap(filename,dtype=np.int16,mode='r')
+            except (OSError,ValueError):
+                raise IOError("Error mapping file: " + filename)
+            if (count == 1):
+                index = starts
+            else:
+                index = (starts[:,np.newaxis] + np.arange(count)).flatten()
+            try:
+                np.take(m,index,out=out)
+            except IndexError:
+                raise IOError("Error reading from file: " + filename)
+            del m
+            return out
+        try:
+            f = open(filename,"rb",buffering=0)
+        except OSError:
+            raise OSError("Error opening file: " + filename)
+        try:
+            # Reading in increasing file position
+            for i in np.argsort(starts,kind='stable'):
+                _apdcam_readinto(f,filename,int(starts[i]),out[i * count:(i + 1) * count])
+        finally:
+            f.close()
+        return out
 
-    default_options = {'Datapath':'data',
-                       'Scaling':'Digit',
-                       'Camera type': None,
-                       'Camera version': None,
-                       'Resample':None
-                       }
-    if (data_source is None):
-        data_source = 'APDCAM'
+    if (memmap):
+        try:
+            return np.memmap(filename,dtype=np.int16,mode='r',offset=start * 2,shape=(count,))
+        except (OSError,ValueError):
+            raise IOError("Error mapping file: " + filename)
+    if (out is None):
+        out = np.empty(count,dtype=np.int16)
+    try:
+        f = open(filename,"rb",buffering=0)
+    except OSError:
+        raise OSError("Error opening file: " + filename)
+    try:
+        _apdcam_readinto(f,filename,start,out)
+    finally:
+        f.close()
+    return out
 
-    _options = flap.config.merge_options(default_options,options,data_source=data_source)
-    datapath = _options['Datapath']
+def _apdcam_readinto(f, filename, start, out):
+    """
+    Reads int16 samples from an open file starting at sample start into the contiguous array out.
+    """
+    try:
+        f.seek(start * 2,os.SEEK_SET)
+        buf = memoryview(out).cast('B')
+        nread = 0
+        while (nread < len(buf)):
+            n = f.readinto(buf[nread:])
+            if (not n):
+                break
+            nread += n
+    except IOError:
+        raise IOError("Error reading from file: " + filename)
+    if (nread != len(buf)):
+        raise IOError("Error reading from file: " + filename)
+
+def apdcam_resample(data, binsize, dtype=float):
+    """
+    Resamples a block of data by averaging in bins along the first dimension. 
+    All channels are processed together.
+
+    Parameters
+    ----------
+    data : numpy array
+        The data. The first dimension is time, any further dimensions are channels.
+    binsize : int
+        The number of samples in one bin. Samples after the last full bin are dropped.
+    dtype : numpy dtype, optional
+        The data type of the returned arrays, float32 or float64. The default is float.
+
+    Returns
+    -------
+    data_resample : numpy array
+        The mean in the bins.
+    data_error : numpy array
+        The standard deviation in the bins.
+
+    """
+    ndata_out = data.shape[0] // binsize
+    d = data[:ndata_out * binsize].reshape((ndata_out,binsize) + data.shape[1:])
+    data_resample = np.empty((ndata_out,) + data.shape[1:],dtype=dtype)
+    data_error = np.empty((ndata_out,) + data.shape[1:],dtype=dtype)
+    # Integer data is accumulated exactly in int64, so the result does not depend on
+    # how the channels are grouped into blocks.
+    if (np.issubdtype(data.dtype,np.integer)):
+        acc_type = np.int64
+    else:
+        acc_type = np.float64
+    # Processing a limited number of bins at once to limit the size of temporary arrays
+    bins_per_step = max(1,2 ** 22 // max(1,int(np.prod(d.shape[1:]))))
+    for i_start in range(0,ndata_out,bins_per_step):
+        i_end = min(i_start + bins_per_step,ndata_out)
+        block = d[i_start:i_end].astype(acc_type)
+        d_sum = block.sum(axis=1)
+        block *= block
+        d_sum2 = block.sum(axis=1)
+        del block
+        d_mean = d_sum / binsize
+        d_var = d_sum2 / binsize - d_mean ** 2
+        np.maximum(d_var,0,out=d_var)
+        data_resample[i_start:i_end] = d_mean
+        data_error[i_start:i_end] = np.sqrt(d_var)
+    return data_resample, data_error
+
+def apdcam_scale(data, bits, camera_family, scale_to_volts, out=None):
+    """
+    Converts raw ADC data to the output signal. APDCAM-10G data is inverted.
+
+    Parameters
+    ----------
+    data : numpy array
+        The raw ADC data or the resampled raw data.
+    bits : int
+        The ADC bit resolution.
+    camera_family : string
+        'APDCAM-10G' or 'APDCAM'
+    scale_to_volts : bool
+        True: Scale to Volts, False: leave in digits.
+    out : numpy array, optional
+        The result is written into this array. It can be data itself, in which case
+        the conversion is done in place. Should be a float array if scale_to_volts is True.
+
+    Returns
+    -------
+    numpy array
+        The scaled data. If out is None and no change is needed the input array is returned.
 
+    """
+    if (out is None):
+        if (scale_to_volts):
+            if (camera_family == 'APDCAM-10G'):
+                return ((2 ** bits - 1) - data) / (2. ** bits - 1) * 2
+            else:
+                return data / (2.**bits - 1) * 2
+        else:
+            if (camera_family == 'APDCAM-10G'):
+                return (2 ** bits - 1) - data
+            else:
+                return data
+    if (scale_to_volts):
+        if (camera_family == 'APDCAM-10G'):
+            np.subtract(2 ** bits - 1,data,out=out)
+            np.divide(out,2. ** bits - 1,out=out)
+        else:
+            np.divide(data,2.**bits - 1,out=out)
+        np.multiply(out,2,out=out)
+    else:
+        if (camera_family == 'APDCAM-10G'):
+            np.subtract(2 ** bits - 1,data,out=out)
+        elif (out is not data):
+            out[...] = data
+    return out
+
+# Process-wide cache of shot metadata, see apdcam_shot_metadata()
+_metadata_cache = collections.OrderedDict()
+_metadata_cache_lock = threading.RLock()
+_metadata_cache_size = 64
+
+def apdcam_shot_metadata(datapath):
+    """
+    Returns the metadata of a shot: the parsed APDCAM_config.xml and the channel tables.
+    If the directory does not contain APDCAM_config.xml the configuration is read from the 
+    single file container (see apdcam_container.py).
+    The metadata is cached for the process, an entry is valid as long as the modification time 
+    and size of the xml (or container) file do not change. The least recently used entries are dropped if the 
+    cache grows above its size, see apdcam_metadata_cache_size().
+
+    Parameters
+    ----------
+    datapath : string
+        The data directory of the shot.
+
+    Returns
+    -------
+    dict
+        'config': The shot configuration as returned by apdcam_get_config.
+        'camera_family': 'APDCAM-10G' or 'APDCAM'
+        'tables': Channel tables for the camera settings which have been used.
+        'container': The APDCAM_container if the data is in a container, None otherwise.
+        Should not be modified.
+
+    """
     xmlfile = os.path.join(datapath,'APDCAM_config.xml')
-    xml = flap.FlapXml()
+    container = None
     try:
-        xml.read_file(xmlfile)
-    except Exception:
-        raise IOError("Error reading XML file:" + xmlfile)
+        st = os.stat(xmlfile)
+    except OSError:
+        try:
+            st = os.stat(os.path.join(datapath,container_filename))
+        except OSError:
+            raise IOError("Error reading XML file:" + xmlfile)
+        container = True
+    key = os.path.abspath(datapath)
+    stamp = (st.st_mtime_ns,st.st_size)
+    with _metadata_cache_lock:
+        meta = _metadata_cache.get(key)
+        if ((meta is not None) and (meta['stamp'] == stamp)):
+            _metadata_cache.move_to_end(key)
+            return meta
+
+    xml = flap.FlapXml()
+    if (container is not None):
+        container = apdcam_container(datapath)
+        # The xml text is parsed through a temporary file as FlapXml reads files
+        with tempfile.TemporaryDirectory() as tmpdir:
+            xmlfile = os.path.join(tmpdir,'APDCAM_config.xml')
+            with open(xmlfile,'wt') as f:
+                f.write(container.xml_text)
+            try:
+                xml.read_file(xmlfile)
+            except Exception:
+                raise IOError("Error reading XML from container in " + datapath)
+    else:
+        try:
+            xml.read_file(xmlfile)
+        except Exception:
+            raise IOError("Error reading XML file:" + xmlfile)
     if (xml.head.tag != 'General'):
         raise TypeError("XML file " + xmlfile + " is not an APDCAM xml file.")
     try:
         camera_family = xml.head.attrib['Device']
     except KeyError:
         raise TypeError("APDCAM family is not found in XML file head.")
-    t = apdcam_get_config(xml)
-    if (_options['Resample'] is not None):
-        if (_options['Resample'] > 1 / t['sampletime']):
-            raise ValueError("Resampling frequency should be below the original sample frequency.")
-        resample_binsize = int(round((1 / _options['Resample']) / float(t['sampletime'])))
-    fnames = os.listdir(datapath)
+    meta = {'stamp':stamp,
+            'config':apdcam_get_config(xml),
+            'camera_family':camera_family,
+            'tables':{},
+            'container':container
+            }
+    with _metadata_cache_lock:
+        _metadata_cache[key] = meta
+        _metadata_cache.move_to_end(key)
+        while (len(_metadata_cache) > _metadata_cache_size):
+            _metadata_cache.popitem(last=False)
+    return meta
+
+def apdcam_invalidate_cache(datapath=None):
+    """
+    Removes shot metadata from the cache.
+
+    Parameters
+    ----------
+    datapath : string or None, optional
+        The data directory of the shot to remove. If None the whole cache is cleared.
+        The default is None.
+
+    Returns
+    -------
+    None.
+
+    """
+    with _metadata_cache_lock:
+        if (datapath is None):
+            _metadata_cache.clear()
+        else:
+            _metadata_cache.pop(os.path.abspath(datapath),None)
+
+def apdcam_metadata_cache_size(size=None):
+    """
+    Returns and optionally sets the maximum number of shots in the metadata cache.
+
+    Parameters
+    ----------
+    size : int or None, optional
+        The new cache size. If None the size is not changed. The default is None.
+
+    Returns
+    -------
+    int
+        The cache size.
+
+    """
+    global _metadata_cache_size
+    if (size is not None):
+        if (size < 1):
+            raise ValueError("The cache size should be at least 1.")
+        with _metadata_cache_lock:
+            _metadata_cache_size = int(size)
+            while (len(_metadata_cache) > _metadata_cache_size):
+                _metadata_cache.popitem(last=False)
+    return _metadata_cache_size
+
+# Memoised channel selections, see _apdcam_select_channels()
+_selection_cache = collections.OrderedDict()
+_selection_cache_size = 1024
+
+def _apdcam_select_channels(tables, chspec):
+    """
+    Selects channels from the channel tables using flap.select_signals. The results are memoised
+    for each camera configuration and channel specification.
+
+    Parameters
+    ----------
+    tables : APDCAM_channel_tables
+        The channel tables.
+    chspec : list of strings
+        The channel names, with wildcards.
+
+    Returns
+    -------
+    chname_proc : list of strings
+        The selected channel names.
+    ch_index : numpy array of ints
+        The indices of the selected channels in tables.ch_names. Read-only.
+
+    """
+    key = (tables.key,tuple(chspec))
+    with _metadata_cache_lock:
+        sel = _selection_cache.get(key)
+        if (sel is not None):
+            _selection_cache.move_to_end(key)
+            return list(sel[0]), sel[1]
+    chname_proc, ch_index = flap.select_signals(list(tables.ch_names),chspec)
+    ch_index = np.array(ch_index,dtype=int)
+    ch_index.flags.writeable = False
+    with _metadata_cache_lock:
+        _selection_cache[key] = (tuple(chname_proc),ch_index)
+        while (len(_selection_cache) > _selection_cache_size):
+            _selection_cache.popitem(last=False)
+    return list(chname_proc), ch_index
+
+_default_options = {'Datapath':'data',
+                    'Scaling':'Digit',
+                    'Camera type': None,
+                    'Camera version': None,
+                    'Resample':None,
+                    'Memmap':False,
+                    'Read threads':1,
+                    'Channel major':False,
+                    'Lazy':False,
+                    'Dtype':None,
+                    'Overview':False,
+                    'Profile':False,
+                    'Resample method':'Average',
+                    'Offset timerange':None,
+                    'Geometry file':None
+                    }
+
+def _apdcam_camera_tables(meta, _options):
+    """
+    Returns the channel tables for the camera of a shot. The camera type and version are
+    taken from the options, if not set from the xml file.
+
+    Parameters
+    ----------
+    meta : dict
+        The shot metadata from apdcam_shot_metadata.
+    _options : dict
+        The options of apdcam_get_data, merged with the defaults.
+
+    Returns
+    -------
+    APDCAM_channel_tables
+        The tables.
+
+    """
+    t = meta['config']
+    camera_family = meta['camera_family']
     if (camera_family == 'APDCAM-10G'):
         camera_type = _options['Camera type']
         if (camera_type is None): 
@@ -200,7 +512,7 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                 camera_version = t['Camera version']
             except KeyError:
                 camera_version = 1
-        chmap = apdcam10g_channel_map(camera_type=camera_type[11:],camera_version=camera_version)
+        table_key = (camera_family,camera_type,camera_version)
     elif (camera_family == 'APDCAM'):
         if (_options['Camera type'] is not None): 
             camera_type = _options['Camera type']
@@ -215,47 +527,56 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                 sensor_angle = t['Sensor angle']
             except KeyError:
                 sensor_angle = 0
-        chmap = apdcam_channel_map(sensor_rotation=sensor_angle) 
+        table_key = (camera_family,sensor_angle)
     else:
-        raise ValueError("Unknown camera family in xml file: {:s}".camera_family)
+        raise ValueError("Unknown camera family in xml file: {:s}".format(camera_family))
     
-    # Settting up a list of possible channel names and associated file names
-    ch_names = []
-    fnames = []
-    col_list = []
-    row_list = []
-    adc_list = []
-    if (chmap.ndim == 2):
-        nrow = chmap.shape[0]
-        ncol = chmap.shape[1]
-        for ir in range(nrow):
-            for ic in range(ncol):
-                ch_names.append('APD-{:d}-{:d}'.format(ir + 1,ic + 1))
-                row_list.append(ir + 1)
-                col_list.append(ic + 1)
-                ch_names.append('ADC{:d}'.format(chmap[ir,ic]))
-                row_list.append(None)
-                col_list.append(None)
-                if (camera_family == 'APDCAM-10G'):
-                    fn = 'Channel_{:03d}.dat'.format(chmap[ir,ic] - 1)
-                else:
-                    fn = 'Channel{:02d}.dat'.format(chmap[ir,ic] - 1)
-                fnames.append(fn)
-                fnames.append(fn)
-                adc_list.append(chmap[ir,ic])
-                adc_list.append(chmap[ir,ic])
+    with _metadata_cache_lock:
+        tables = meta['tables'].get(table_key)
+    if (tables is None):
+        if (camera_family == 'APDCAM-10G'):
+            tables = apdcam_channel_tables(camera_family,
+                                           camera_type=camera_type[11:],
+                                           camera_version=camera_version
+                                           )
+        else:
+            tables = apdcam_channel_tables(camera_family,sensor_rotation=sensor_angle)
+        with _metadata_cache_lock:
+            meta['tables'][table_key] = tables
+    return tables
+
+def _apdcam_setup(data_name, _options):
+    """
+    Reads the shot configuration, sets up the channel tables and selects the requested channels.
+
+    Parameters
+    ----------
+    data_name : string or list of strings
+        The channel names as in apdcam_get_data.
+    _options : dict
+        The options of apdcam_get_data, merged with the defaults.
+
+    Returns
+    -------
+    dict
+        The shot configuration and the description of the selected channels.
+
+    """
+    datapath = _options['Datapath']
+
+    with profile_stage('metadata'):
+        meta = apdcam_shot_metadata(datapath)
+    t = meta['config']
+    camera_family = meta['camera_family']
+    if (_options['Resample'] is not None):
+        if (_options['Resample'] > 1 / t['sampletime']):
+            raise ValueError("Resampling frequency should be below the original sample frequency.")
+        resample_binsize = int(round((1 / _options['Resample']) / float(t['sampletime'])))
     else:
-        for ir in range(len(chmap)):
-                ch_names.append('APD-{:d}'.format(ir + 1))
-                ch_names.append('ADC{:d}'.format(chmap[ir]))
-                if (camera_family == 'APDCAM-10G'):
-                    fn = 'Channel_{:03d}.dat'.format(chmap[ir] - 1)
-                else:
-                    fn = 'Channel{:02d}.dat'.format(chmap[ir] - 1)
-                fnames.append(fn)
-                fnames.append(fn)
-                adc_list.append(chmap[ir])
-                adc_list.append(chmap[ir])
+        resample_binsize = None
+    if (_options['Resample method'] not in ('Average','FIR')):
+        raise ValueError("Invalid Resample method: {:s}".format(str(_options['Resample method'])))
+    tables = _apdcam_camera_tables(meta,_options)
         
     if type(data_name) is not list:
         chspec = [data_name]
@@ -263,46 +584,81 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
         chspec = data_name
 
     # Selecting the required channels
-    try:
-        chname_proc, ch_index = flap.select_signals(ch_names,chspec)
-    except ValueError as e:
-        raise e     
+    chname_proc, ch_index = _apdcam_select_channels(tables,chspec)
     
-    fnames_proc = [fnames[i] for i in ch_index]
-    if (len(col_list) != 0):
-        col_proc = [col_list[i] for i in ch_index]
-    if (len(row_list) != 0):
-        row_proc = [row_list[i] for i in ch_index]
-    adc_proc = [adc_list[i] for i in ch_index]
+    fnames_proc = tables.fnames[ch_index].tolist()
+    row_proc = tables.row[ch_index]
+    col_proc = tables.col[ch_index]
+    adc_proc = tables.adc[ch_index].tolist()
     
     # Determining the dimension of the output data array
+    out_row_list = None
+    out_col_list = None
+    out_row_index = None
+    out_col_index = None
     if (len(chname_proc) == 1):
         outdim = 1
-    elif (chmap.ndim == 1):
+    elif (tables.chmap.ndim == 1):
+        outdim = 2
+    # If any of the channels is an ADC name (no row and column), the output is 2D
+    elif (np.any(row_proc == 0) or np.any(col_proc == 0)):
         outdim = 2
     else:
         outdim = 3
-        # If any of the channels has None in column or row, the output is 2D
-        for c,r in zip(col_proc,row_proc):
-            if ((c is None) or (r is None)):
-                outdim = 2
-                break
-        if (outdim == 3):
-            out_row_list = sorted(set(row_proc))
-            out_col_list = sorted(set(col_proc))
-            if ((len(out_col_list) * len(out_row_list) != len(chname_proc))
-                or (len(out_col_list) == 1) or  (len(out_row_list) == 1)  
-                ):
-                outdim = 2
-            else:
-                out_col_index = []
-                out_row_index = []
-                for i in range(len(row_proc)):
-                    out_row_index.append(out_row_list.index(row_proc[i]))
-                    out_col_index.append(out_col_list.index(col_proc[i]))
+        out_row_list = np.unique(row_proc).tolist()
+        out_col_list = np.unique(col_proc).tolist()
+        if ((len(out_col_list) * len(out_row_list) != len(chname_proc))
+            or (len(out_col_list) == 1) or  (len(out_row_list) == 1)  
+            ):
+            outdim = 2
+        else:
+            out_row_index = np.searchsorted(out_row_list,row_proc).tolist()
+            out_col_index = np.searchsorted(out_col_list,col_proc).tolist()
                     
+    retval = {}
+    retval['datapath'] = datapath
+    retval['config'] = t
+    retval['camera_family'] = camera_family
+    retval['container'] = meta['container']
+    retval['chname_proc'] = chname_proc
+    retval['fnames_proc'] = fnames_proc
+    retval['adc_proc'] = adc_proc
+    retval['row_proc'] = row_proc.tolist()
+    retval['col_proc'] = col_proc.tolist()
+    retval['outdim'] = outdim
+    retval['out_row_list'] = out_row_list
+    retval['out_col_list'] = out_col_list
+    retval['out_row_index'] = out_row_index
+    retval['out_col_index'] = out_col_index
+    retval['resample_binsize'] = resample_binsize
+    return retval
+
+def _apdcam_read_range(coordinates, t):
+    """
+    Determines the samples to read from the coordinate descriptions.
+
+    Parameters
+    ----------
+    coordinates : flap.Coordinate or list of flap.Coordinate or None
+        The coordinate ranges as in apdcam_get_data.
+    t : dict
+        The shot configuration from apdcam_get_config.
+
+    Returns
+    -------
+    read_range : numpy array or None
+        The requested time range if it was given. Shape is (2) for a single range,
+        (n,2) for n intervals.
+    read_samplerange : numpy array or None
+        The first and last sample to read. Shape is (2) for a single range,
+        (n,2) for n intervals. None if individual samples are read.
+    read_samples : numpy array or None
+        The sample indices if individual samples are read, None otherwise.
+
+    """
     read_range = None
     read_samplerange = None
+    read_samples = None
     if (coordinates is not None):
         if (type(coordinates) is not list):
              _coordinates = [coordinates]
@@ -311,29 +667,37 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
         for coord in _coordinates:
             if (type(coord) is not flap.Coordinate):
                 raise TypeError("Coordinate description should be flap.Coordinate.")
+            if ((coord.unit.name != 'Time') and (coord.unit.name != 'Sample')):
+                continue
+            if ((not coord.mode.equidistant) and (coord.values is not None)):
+                # Individual samples or times
+                values = np.array(coord.values,dtype=float).flatten()
+                if (coord.unit.name == 'Time'):
+                    values = (values - float(t['starttime'])) / float(t['sampletime'])
+                read_samples = np.rint(values).astype(np.int64)
+                if ((np.amin(read_samples) < 0) or (np.amax(read_samples) >= t['samplenumber'])):
+                    raise ValueError("Some of the requested samples are outside the measurement.")
+                return None, None, read_samples
+            if (coord.c_range is None):
+                continue
             if (coord.unit.name == 'Time'):
-                if (coord.mode.equidistant):
-                    if (coord.c_range is None):
-                        continue
-                    read_range = [float(coord.c_range[0]),float(coord.c_range[1])]
-                else:
-                    raise NotImplementedError("Non-equidistant Time axis is not implemented yet.")
-                break
-            if coord.unit.name == 'Sample':
-                if (coord.mode.equidistant):
-                    read_samplerange = coord.c_range
-                else:
-                    raise \
-                        NotImplementedError("Non-equidistant Sample axis is not implemented yet.")
-                break
+                read_range = np.array(coord.c_range,dtype=float)
+            else:
+                read_samplerange = np.array(coord.c_range)
+            break
     if ((read_range is None) and (read_samplerange is None)):
         read_samplerange = np.array([0,t['samplenumber']])
-    if (read_range is not None):
-        read_range = np.array(read_range)
     if (read_samplerange is None):
         read_samplerange = np.rint((read_range - float(t['starttime'])) / float(t['sampletime']))
-    else:
-        read_samplerange = np.array(read_samplerange)
+    if ((read_samplerange.ndim == 2) and (read_samplerange.shape[1] == 2)):
+        # Multiple intervals
+        if ((np.amin(read_samplerange) < 0) or (np.amax(read_samplerange) >= t['samplenumber'])):
+            raise ValueError("Some of the requested intervals are outside the measurement.")
+        if (np.any(read_samplerange[:,1] < read_samplerange[:,0])):
+            raise ValueError("Invalid interval, end is before start.")
+        return read_range, read_samplerange, None
+    if (read_samplerange.shape != (2,)):
+        raise ValueError("Time or Sample range should be a single [start,end] range or a list of ranges.")
     if ((read_samplerange[1] < 0) or (read_samplerange[0] >= t['samplenumber'])):
         raise ValueError("No data in time range.")
     if (read_samplerange[0] < 0):
@@ -341,123 +705,588 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
     if (read_samplerange[1] >= t['samplenumber']):
         read_samplerange[1] = t['samplenumber'] - 1
 
-    ndata_read = int(read_samplerange[1] - read_samplerange[0] + 1)
-    if (_options['Resample'] is not None):
-        ndata_out = int(ndata_read / resample_binsize) 
-        ndata_read = ndata_out * resample_binsize
-    else:
-        ndata_out = ndata_read
+    return read_range, read_samplerange, None
+
+def _apdcam_data_unit(_options):
+    """
+    Returns the unit of the data for the Scaling option.
+    """
     if (_options['Scaling'] == 'Volt'):
-        scale_to_volts = True
-        dtype = float
-        data_unit = flap.Unit(name='Signal',unit='Volt')
+        return flap.Unit(name='Signal',unit='Volt')
     else:
-        scale_to_volts = False
-        dtype = np.int16
-        data_unit = flap.Unit(name='Signal',unit='Digit')
-    
+        return flap.Unit(name='Signal',unit='Digit')
+
+def _apdcam_dtype(_options, resample_binsize):
+    """
+    Returns the data type of the output arrays from the Dtype option.
+    """
+    float_data = ((_options['Scaling'] == 'Volt') or (resample_binsize is not None) 
+                  or (_options['Offset timerange'] is not None))
+    if (_options['Dtype'] is None):
+        if (float_data):
+            return np.dtype(np.float64)
+        else:
+            return np.dtype(np.int16)
+    try:
+        dtype = np.dtype(_options['Dtype'])
+    except TypeError:
+        raise ValueError("Invalid Dtype option: {:s}".format(str(_options['Dtype'])))
+    if (dtype not in (np.int16,np.float32,np.float64)):
+        raise ValueError("Dtype should be int16, float32 or float64.")
+    if ((dtype == np.int16) and float_data):
+        raise ValueError("Dtype int16 is possible only with Digit scaling without resampling and offset subtraction.")
+    return dtype
+
+def _apdcam_out_shape(setup, ndata):
+    """
+    Returns the shape of the data array with ndata samples along the time dimension.
+    """
+    outdim = setup['outdim']
     if (outdim == 1):
-        data_arr = np.empty(ndata_out,dtype=dtype) 
+        return (ndata,)
     elif (outdim == 2):
-        data_arr = np.empty((ndata_out,len(chname_proc)),dtype=dtype)
+        return (ndata,len(setup['chname_proc']))
     else:
-        data_arr = np.empty((ndata_out,len(out_row_list),len(out_col_list)),dtype=dtype)
-    if (_options['Resample'] is not None):
-        if (outdim == 1):
-            error_arr = np.empty(ndata_out,dtype=dtype) 
-        elif (outdim == 2):
-            error_arr = np.empty((ndata_out,len(chname_proc)),dtype=dtype)
+        return (ndata,len(setup['out_row_list']),len(setup['out_col_list']))
+
+def _apdcam_read_data(setup, read_start, ndata_read, _options, no_data=False, channels=None):
+    """
+    Reads, resamples and scales the data of the selected channels.
+
+    Parameters
+    ----------
+    setup : dict
+        The output of _apdcam_setup.
+    read_start : int or numpy array of ints
+        The first sample to read. If an array, ndata_read samples are read from each start
+        and the data along the first dimension is the concatenation of these windows.
+    ndata_read : int
+        The number of samples to read from each start. Should be a multiple of the resample bin size.
+    _options : dict
+        The options of apdcam_get_data, merged with the defaults.
+    no_data : bool, optional
+        If True the data arrays are allocated but not filled. The default is False.
+    channels : list of ints or None, optional
+        If set only these channels (indices in setup['chname_proc']) are read, the data of the
+        other channels is 0. The default is None, all channels are read.
+
+    Returns
+    -------
+    data_arr : numpy array
+        The data.
+    error_arr : numpy array or None
+        The error of the data if resampling was done.
+    data_unit : flap.Unit
+        The unit of the data.
+
+    """
+    datapath = setup['datapath']
+    t = setup['config']
+    camera_family = setup['camera_family']
+    chname_proc = setup['chname_proc']
+    fnames_proc = setup['fnames_proc']
+    outdim = setup['outdim']
+    out_row_index = setup['out_row_index']
+    out_col_index = setup['out_col_index']
+    resample_binsize = setup['resample_binsize']
+    container = setup['container']
+    if (resample_binsize is not None):
+        ndata_out = ndata_read // resample_binsize
+    else:
+        ndata_out = ndata_read
+    # The number of read windows
+    n_read = np.size(read_start)
+    data_unit = _apdcam_data_unit(_options)
+    scale_to_volts = (_options['Scaling'] == 'Volt')
+    dtype = _apdcam_dtype(_options,resample_binsize)
+    
+    out_shape = _apdcam_out_shape(setup,n_read * ndata_out)
+    # Channels which are not read are left 0. np.zeros does not touch the memory until it is written.
+    if (channels is None):
+        alloc = np.empty
+    else:
+        alloc = np.zeros
+    if (_options['Channel major']):
+        # The array is allocated with reversed dimensions and transposed, this way the 
+        # time series of each channel is contiguous in memory
+        data_arr = alloc(out_shape[::-1],dtype=dtype).T
+    else:
+        data_arr = alloc(out_shape,dtype=dtype)
+    fir = ((_options['Resample method'] == 'FIR') and (resample_binsize is not None))
+    if (fir):
+        fir_halo = APDCAM_fir_decimator(resample_binsize).halo
+    if ((resample_binsize is not None) and not fir):
+        if (_options['Channel major']):
+            error_arr = alloc(out_shape[::-1],dtype=dtype).T
         else:
-            error_arr = np.empty((ndata_out,len(out_row_list),len(out_col_list)),dtype=dtype)
+            error_arr = alloc(out_shape,dtype=dtype)
     else:
         error_arr = None
         
     
-    if (no_data is False):
-        for i in range(len(chname_proc)):
-            fn = os.path.join(datapath,fnames_proc[i])
+    if (channels is None):
+        channels = list(range(len(chname_proc)))
+    if ((no_data is False) and (len(channels) != 0)):
+        read_threads = _options['Read threads']
+        if ((read_threads is None) or (read_threads < 1)):
+            read_threads = 1
+        # Threads which are not used for reading channels decompress the chunks of compressed files
+        chunk_threads = max(1,read_threads // len(channels))
+        read_threads = min(read_threads,len(channels))
+        if (container is not None):
+            # The container stores the channels of a sample together, each channel group would read the same rows
+            read_threads = 1
+        
+        # Checking whether the resampled data can be calculated from the overview
+        overview = None
+        if ((resample_binsize is not None) and _options['Overview'] and not fir):
+            overview = apdcam_overview(datapath)
+            if ((overview is not None) 
+                and ((overview.level_for(resample_binsize,read_start) is None) 
+                     or any(fn not in overview.column for fn in fnames_proc)
+                     )
+                ):
+                overview = None
+
+        if ((outdim == 1) and (resample_binsize is None) and _options['Memmap'] and (n_read == 1)
+            and (container is None)):
+            # A memory mapped single channel is returned as it is if no scaling is needed.
+            with profile_stage('read'):
+                d = apdcam_read_channel(os.path.join(datapath,fnames_proc[0]),read_start,ndata_read,memmap=True,
+                                        threads=chunk_threads)
+            if ((camera_family == 'APDCAM-10G') or scale_to_volts or (dtype != np.int16)):
+                apdcam_scale(d,t['bits'],camera_family,scale_to_volts,out=data_arr)
+            else:
+                data_arr = d
+        else:
+            # The index of a channel or a group of channels in the output arrays
+            if (outdim == 1):
+                def out_index(ch_list):
+                    return (slice(None),)
+            elif (outdim == 2):
+                def out_index(ch_list):
+                    return (slice(None),ch_list)
+            else:
+                def out_index(ch_list):
+                    return (slice(None),
+                            [out_row_index[i] for i in ch_list],
+                            [out_col_index[i] for i in ch_list]
+                            )
+            def channel_index(i):
+                if (outdim == 1):
+                    return (slice(None),)
+                elif (outdim == 2):
+                    return (slice(None),i)
+                else:
+                    return (slice(None),out_row_index[i],out_col_index[i])
+
+            def read_raw(ch_list, start, count):
+                return _apdcam_read_raw(setup,[fnames_proc[i] for i in ch_list],start,count,threads=chunk_threads)
+
+            def load_channels(ch_list):
+                # Reads, resamples and scales a group of channels into their place in the output arrays.
+                # Channel groups are independent, so they can be processed in parallel threads.
+                overview_result = None
+                if ((resample_binsize is not None) and (overview is not None)):
+                    with profile_stage('resample'):
+                        # None if the overview does not cover the data, the raw data is read then
+                        overview_result = overview.resample([fnames_proc[i] for i in ch_list],read_start,ndata_out,
+                                                            resample_binsize,dtype=dtype)
+                if ((resample_binsize is not None) and fir):
+                    d = np.empty((n_read * ndata_out,len(ch_list)),dtype=dtype)
+                    # The data is fed to the decimator in limited steps, it keeps the samples needed
+                    # for the next step
+                    step = max(1,2 ** 22 // len(ch_list) // resample_binsize) * resample_binsize
+                    for i_w,s in enumerate(np.atleast_1d(read_start)):
+                        # The filter needs samples before and after the bins, at the ends of the
+                        # measurement the first and last samples are repeated
+                        lo = int(s) - fir_halo
+                        hi = int(s) + ndata_read + fir_halo
+                        lo_c = max(lo,0)
+                        hi_c = min(hi,t['samplenumber'])
+                        decimator = APDCAM_fir_decimator(resample_binsize)
+                        i_out = i_w * ndata_out
+                        for pos in range(lo_c,hi_c,step):
+                            n = min(step,hi_c - pos)
+                            with profile_stage('read'):
+                                raw_arr = read_raw(ch_list,pos,n)
+                            with profile_stage('resample'):
+                                if ((pos == lo_c) and (lo_c > lo)):
+                                    raw_arr = np.concatenate((np.repeat(raw_arr[:1],lo_c - lo,axis=0),raw_arr),axis=0)
+                                if ((pos + n == hi_c) and (hi > hi_c)):
+                                    raw_arr = np.concatenate((raw_arr,np.repeat(raw_arr[-1:],hi - hi_c,axis=0)),axis=0)
+                                y = decimator.process(raw_arr,dtype=dtype)
+                                d[i_out:i_out + y.shape[0]] = y
+                                i_out += y.shape[0]
+                            del raw_arr
+                    d_error = None
+                elif ((resample_binsize is not None) and (overview_result is not None)):
+                    d, d_error = overview_result
+                elif ((resample_binsize is not None) and (container is not None)):
+                    with profile_stage('read'):
+                        raw_arr = container.read_channels([fnames_proc[i] for i in ch_list],read_start,ndata_read)
+                    with profile_stage('resample'):
+                        d, d_error = apdcam_resample(raw_arr,resample_binsize,dtype=dtype)
+                    del raw_arr
+                elif (resample_binsize is not None):
+                    with profile_stage('read'):
+                        # Channel-major raw block, each channel is read directly into its column
+                        raw_arr = np.empty((len(ch_list),n_read * ndata_read),dtype=np.int16).T
+                        for j,i in enumerate(ch_list):
+                            fn = os.path.join(datapath,fnames_proc[i])
+                            if (_options['Memmap']):
+                                raw_arr[:,j] = apdcam_read_channel(fn,read_start,ndata_read,memmap=True,threads=chunk_threads)
+                            else:
+                                apdcam_read_channel(fn,read_start,ndata_read,out=raw_arr[:,j],threads=chunk_threads)
+                    with profile_stage('resample'):
+                        d, d_error = apdcam_resample(raw_arr,resample_binsize,dtype=dtype)
+                    del raw_arr
+                if (resample_binsize is not None):
+                    with profile_stage('scale'):
+                        if (outdim == 1):
+                            d = d[:,0]
+                        data_arr[out_index(ch_list)] = apdcam_scale(d,t['bits'],camera_family,scale_to_volts,out=d)
+                        if (d_error is not None):
+                            if (outdim == 1):
+                                d_error = d_error[:,0]
+                            if (scale_to_volts):
+                                d_error *= 2 / (2.**t['bits'] - 1)
+                            error_arr[out_index(ch_list)] = d_error
+                elif (container is not None):
+                    # All channels of the group are read together from the container
+                    with profile_stage('read'):
+                        raw_arr = container.read_channels([fnames_proc[i] for i in ch_list],read_start,ndata_read)
+                    with profile_stage('scale'):
+                        for j,i in enumerate(ch_list):
+                            apdcam_scale(raw_arr[:,j],t['bits'],camera_family,scale_to_volts,out=data_arr[channel_index(i)])
+                    del raw_arr
+                else:
+                    buf = None
+                    for i in ch_list:
+                        fn = os.path.join(datapath,fnames_proc[i])
+                        d_out = data_arr[channel_index(i)]
+                        with profile_stage('read'):
+                            if (_options['Memmap']):
+                                d = apdcam_read_channel(fn,read_start,ndata_read,memmap=True,threads=chunk_threads)
+                            elif ((d_out.dtype == np.int16) and d_out.flags.c_contiguous):
+                                # Reading directly into the output array, scaling in place
+                                d = apdcam_read_channel(fn,read_start,ndata_read,out=d_out,threads=chunk_threads)
+                            else:
+                                if (buf is None):
+                                    buf = np.empty(n_read * ndata_read,dtype=np.int16)
+                                d = apdcam_read_channel(fn,read_start,ndata_read,out=buf,threads=chunk_threads)
+                        with profile_stage('scale'):
+                            apdcam_scale(d,t['bits'],camera_family,scale_to_volts,out=d_out)
+
+            ch_groups = [list(g) for g in np.array_split(np.array(channels,dtype=int),read_threads)]
+            if (read_threads == 1):
+                load_channels(ch_groups[0])
+            else:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=read_threads) as executor:
+                    # list() collects the results so that exceptions in the threads are raised here
+                    list(executor.map(profile_bind(load_channels),ch_groups))
+
+        if (_options['Offset timerange'] is not None):
+            with profile_stage('offset'):
+                offsets = _apdcam_offsets(setup,_options['Offset timerange'])
+                # The offsets are scaled in the same way as the data
+                offsets = np.array(apdcam_scale(offsets,t['bits'],camera_family,scale_to_volts),dtype=float)
+                not_read = np.ones(len(chname_proc),dtype=bool)
+                not_read[channels] = False
+                offsets[not_read] = 0
+                if (outdim == 1):
+                    offsets = offsets[0]
+                elif (outdim == 3):
+                    off_arr = np.zeros((len(setup['out_row_list']),len(setup['out_col_list'])))
+                    off_arr[out_row_index,out_col_index] = offsets
+                    offsets = off_arr
+                np.subtract(data_arr,offsets,out=data_arr)
+    return data_arr, error_arr, data_unit
+
+def _apdcam_read_raw(setup, fnames, start, count, threads=1):
+    """
+    Reads raw data of channels from the channel files or the container. 
+    The second dimension of the returned array is the channel.
+    """
+    container = setup['container']
+    if (container is not None):
+        return container.read_channels(fnames,start,count)
+    raw_arr = np.empty((len(fnames),count),dtype=np.int16).T
+    for j,fn in enumerate(fnames):
+        apdcam_read_channel(os.path.join(setup['datapath'],fn),start,count,out=raw_arr[:,j],threads=threads)
+    return raw_arr
+
+class APDCAM_raw_channels:
+    """
+    Raw ADC data of selected channels of a measurement, for building derived data
+    from the raw signal. Use apdcam_raw_channels() to create one.
+
+    Attributes
+    ----------
+    datapath : string
+        The directory of the measurement.
+    channels : list of strings
+        The names of the selected channels.
+    files : list of strings
+        The channel file name of each channel.
+    config : dict
+        The measurement configuration, e.g. 'samplenumber', 'bits', 'starttime', 'sampletime'.
+    camera_family : string
+        'APDCAM-10G' or 'APDCAM'. The raw APDCAM-10G data is inverted.
+    container : APDCAM_container or None
+        The container if the data is in a container.
+    """
+    def __init__(self, setup):
+        self._setup = setup
+        self.datapath = setup['datapath']
+        self.channels = list(setup['chname_proc'])
+        self.files = list(setup['fnames_proc'])
+        self.config = setup['config']
+        self.camera_family = setup['camera_family']
+        self.container = setup['container']
+
+    def read(self, fnames, start, count, threads=1):
+        """
+        Reads raw samples of channels.
+
+        Parameters
+        ----------
+        fnames : list of strings
+            The channel file names, see files.
+        start : int
+            The first sample.
+        count : int
+            The number of samples.
+        threads : int, optional
+            The number of threads for decompressing compressed channel files. The default is 1.
+
+        Returns
+        -------
+        numpy array of int16
+            The samples, the second dimension is the channel.
+
+        """
+        return _apdcam_read_raw(self._setup,fnames,start,count,threads=threads)
+
+def apdcam_raw_channels(datapath, data_name='APD-*', options=None):
+    """
+    Returns access to the raw ADC data of channels of a measurement.
+
+    Parameters
+    ----------
+    datapath : string
+        The directory of the measurement.
+    data_name : string or list of strings, optional
+        The channel names as in apdcam_get_data. The default is 'APD-*'.
+    options : dict, optional
+        The 'Camera type' and 'Camera version' options of apdcam_get_data if they are not in the xml file.
+
+    Returns
+    -------
+    APDCAM_raw_channels
+
+    """
+    _options = copy.deepcopy(_default_options)
+    if (options is not None):
+        _options.update(options)
+    _options['Datapath'] = datapath
+    return APDCAM_raw_channels(_apdcam_setup(data_name,_options))
+
+_offset_filename = 'APDCAM_offsets.json'
+
+def _apdcam_offsets(setup, timerange):
+    """
+    Returns the mean of the raw signal of the selected channels in a time range.
+    The offsets are cached in the shot metadata and in the APDCAM_offsets.json file
+    in the data directory. Only the offsets of channels which are not in the cache are calculated.
+
+    Parameters
+    ----------
+    setup : dict
+        The output of _apdcam_setup.
+    timerange : list of floats
+        The start and end time [s].
+
+    Returns
+    -------
+    numpy array
+        The raw offset for each channel in setup['chname_proc'].
+
+    """
+    t = setup['config']
+    try:
+        sample_range = np.rint((np.array(timerange,dtype=float) - float(t['starttime'])) / float(t['sampletime']))
+    except (TypeError,ValueError):
+        raise ValueError("Offset timerange should be [start,end] in seconds.")
+    if (sample_range.shape != (2,)):
+        raise ValueError("Offset timerange should be [start,end] in seconds.")
+    lo = int(max(sample_range[0],0))
+    hi = int(min(sample_range[1],t['samplenumber'] - 1))
+    if (hi < lo):
+        raise ValueError("No data in Offset timerange.")
+    key = '{:d}-{:d}'.format(lo,hi)
+    datapath = setup['datapath']
+    meta = apdcam_shot_metadata(datapath)
+    with _metadata_cache_lock:
+        if ('offsets' not in meta):
+            # Loading the offsets calculated earlier
+            offsets = {}
             try:
-                f = open(fn,"rb")
-            except OSError:
-                raise OSError("Error opening file: " + fn)
+                with open(os.path.join(datapath,_offset_filename),'rt') as f:
+                    saved = json.load(f)
+                if (saved.get('stamp') == list(meta['stamp'])):
+                    offsets = saved['offsets']
+            except (OSError,ValueError,KeyError,AttributeError):
+                pass
+            meta['offsets'] = offsets
+        cached = dict(meta['offsets'].get(key,{}))
+    missing = [fn for fn in setup['fnames_proc'] if fn not in cached]
+    if (len(missing) != 0):
+        raw = _apdcam_read_raw(setup,missing,lo,hi - lo + 1)
+        mean = np.sum(raw,axis=0,dtype=np.int64) / raw.shape[0]
+        del raw
+        with _metadata_cache_lock:
+            interval = meta['offsets'].setdefault(key,{})
+            for fn,m in zip(missing,mean):
+                interval[fn] = float(m)
+            cached = dict(interval)
+            saved = {'stamp':list(meta['stamp']),'offsets':meta['offsets']}
             try:
-                f.seek(int(read_samplerange[0]) * 2,os.SEEK_SET)
-                d = np.fromfile(f,dtype=np.int16,count=ndata_read)
-            except IOError:
-                raise IOError("Error reading from file: " + fn)
-            f.close()
-            if (_options['Resample'] is not None):
-                d = d.astype(float)
-                d_resample = np.zeros(ndata_out,dtype=float)
-                d_error = np.zeros(ndata_out,dtype=float)
-                if (ndata_out > resample_binsize):
-                    for i_slice in range(0,resample_binsize):
-                        d_resample += d[slice(i_slice,len(d),resample_binsize)]
-                        d_error += d[slice(i_slice,len(d),resample_binsize)] ** 2
-                else:
-                    for i_resamp in range(0,len(d_resample)):
-                        d_resample[i_resamp] = np.sum(d[i_resamp * resample_binsize : (i_resamp + 1) * resample_binsize])
-                        d_error[i_resamp] = np.sum(d[i_resamp * resample_binsize : (i_resamp + 1) * resample_binsize] ** 2)
-                d_error = np.sqrt(d_error / resample_binsize - (d_resample / resample_binsize) ** 2)
-                d = d_resample / resample_binsize
-                if (outdim == 1):
-                    error_arr = d_error
-                elif (outdim == 2):
-                    error_arr[:,i] = d_error
-                else:
-                    error_arr[:,out_row_index[i],out_col_index[i]] = d_error
-            if (outdim == 1):
-                data_arr = d
-            elif (outdim == 2):
-                data_arr[:,i] = d
-            else:
-                data_arr[:,out_row_index[i],out_col_index[i]] = d
-                
-        if (scale_to_volts):
-            if (camera_family == 'APDCAM-10G'):
-                data_arr = ((2 ** t['bits'] - 1) - data_arr) / (2. ** t['bits'] - 1) * 2
-            else:
-                data_arr = data_arr / (2.**t['bits'] - 1) * 2
-            if (_options['Resample'] is not None):
-                error_arr *= 2 / (2.**t['bits'] - 1) 
-        else:
-            if (camera_family == 'APDCAM-10G'):
-                data_arr = (2.**t['bits'] - 1) - data_arr
+                tmpfile = os.path.join(datapath,_offset_filename + '.tmp')
+                with open(tmpfile,'wt') as f:
+                    json.dump(saved,f)
+                os.replace(tmpfile,os.path.join(datapath,_offset_filename))
+            except OSError:
+                # The data directory may be read-only, the offsets are kept in memory
+                pass
+    return np.array([cached[fn] for fn in setup['fnames_proc']])
+
+def _apdcam_coordinates(setup, read_range, read_samplerange, ndata_out, read_samples=None):
+    """
+    Creates the coordinates for the data read from the selected channels.
+
+    Parameters
+    ----------
+    setup : dict
+        The output of _apdcam_setup.
+    read_range : numpy array or None
+        The requested time range or ranges.
+    read_samplerange : numpy array or None
+        The first and last sample read. If this is a 2D array each row is a window.
+    ndata_out : int
+        The number of samples in the output (in one window).
+    read_samples : numpy array or None
+        The sample indices if individual samples were read.
+
+    Returns
+    -------
+    list of flap.Coordinate
+        The coordinates.
 
+    """
+    t = setup['config']
+    chname_proc = setup['chname_proc']
+    adc_proc = setup['adc_proc']
+    outdim = setup['outdim']
+    out_row_list = setup['out_row_list']
+    out_col_list = setup['out_col_list']
+    out_row_index = setup['out_row_index']
+    out_col_index = setup['out_col_index']
+    resample_binsize = setup['resample_binsize']
     coord = []
-    c_mode = flap.CoordinateMode(equidistant=True)
-    if (_options['Resample'] is not None):
-        s_start = read_samplerange[0] + resample_binsize / 2
+    if (resample_binsize is not None):
+        s_offset = resample_binsize / 2
         s_step = resample_binsize
     else:
-        s_start = read_samplerange[0]
+        s_offset = 0
         s_step = 1
-    coord.append(flap.Coordinate(name='Sample',
-                                 unit='n.a.',
-                                 mode=c_mode,
-                                 shape=ndata_out,
-                                 start=s_start,
-                                 step=s_step,
-                                 dimension_list=[0]
-                                 )
-                 )
-    if (read_range is None):
-        read_range = float(t['starttime']) + read_samplerange * float(t['sampletime'])
-    if (_options['Resample'] is not None):
-        tstart = read_range[0] + float(t['sampletime']) * resample_binsize / 2
-        tstep = float(t['sampletime']) * resample_binsize
+    if (read_samples is not None):
+        # Individual samples
+        c_mode = flap.CoordinateMode(equidistant=False)
+        coord.append(flap.Coordinate(name='Sample',
+                                     unit='n.a.',
+                                     mode=c_mode,
+                                     shape=read_samples.shape,
+                                     values=read_samples,
+                                     dimension_list=[0]
+                                     )
+                     )
+        coord.append(flap.Coordinate(name='Time',
+                                     unit='Second',
+                                     mode=c_mode,
+                                     shape=read_samples.shape,
+                                     values=float(t['starttime']) + read_samples * float(t['sampletime']),
+                                     dimension_list=[0]
+                                     )
+                     )
+        first_dim = 1
+    elif (read_samplerange.ndim == 2):
+        # Multiple windows: dimension 0 is the window, dimension 1 is time in the window
+        n_window = read_samplerange.shape[0]
+        c_mode = flap.CoordinateMode(equidistant=True)
+        coord.append(flap.Coordinate(name='Window',
+                                     unit='n.a.',
+                                     mode=c_mode,
+                                     shape=n_window,
+                                     start=0,
+                                     step=1,
+                                     dimension_list=[0]
+                                     )
+                     )
+        coord.append(flap.Coordinate(name='Rel. Time',
+                                     unit='Second',
+                                     mode=c_mode,
+                                     shape=ndata_out,
+                                     start=s_offset * float(t['sampletime']),
+                                     step=s_step * float(t['sampletime']),
+                                     dimension_list=[1]
+                                     )
+                     )
+        if (read_range is None):
+            read_range = float(t['starttime']) + read_samplerange * float(t['sampletime'])
+        c_mode = flap.CoordinateMode(equidistant=False)
+        c_array = read_samplerange[:,0:1] + s_offset + np.arange(ndata_out) * s_step
+        coord.append(flap.Coordinate(name='Sample',
+                                     unit='n.a.',
+                                     mode=c_mode,
+                                     shape=c_array.shape,
+                                     values=c_array,
+                                     dimension_list=[0,1]
+                                     )
+                     )
+        c_array = read_range[:,0:1] + (s_offset + np.arange(ndata_out) * s_step) * float(t['sampletime'])
+        coord.append(flap.Coordinate(name='Time',
+                                     unit='Second',
+                                     mode=c_mode,
+                                     shape=c_array.shape,
+                                     values=c_array,
+                                     dimension_list=[0,1]
+                                     )
+                     )
+        first_dim = 2
     else:
-        tstart = read_range[0]
-        tstep = float(t['sampletime'])
-    coord.append(flap.Coordinate(name='Time',
-                                 unit='Second',
-                                 mode=c_mode,
-                                 shape=ndata_out,
-                                 start=tstart,
-                                 step=tstep,
-                                 dimension_list=[0]
-                                 )
-                 )
+        c_mode = flap.CoordinateMode(equidistant=True)
+        coord.append(flap.Coordinate(name='Sample',
+                                     unit='n.a.',
+                                     mode=c_mode,
+                                     shape=ndata_out,
+                                     start=read_samplerange[0] + s_offset,
+                                     step=s_step,
+                                     dimension_list=[0]
+                                     )
+                     )
+        if (read_range is None):
+            read_range = float(t['starttime']) + read_samplerange * float(t['sampletime'])
+        coord.append(flap.Coordinate(name='Time',
+                                     unit='Second',
+                                     mode=c_mode,
+                                     shape=ndata_out,
+                                     start=read_range[0] + float(t['sampletime']) * s_offset,
+                                     step=float(t['sampletime']) * s_step,
+                                     dimension_list=[0]
+                                     )
+                     )
+        first_dim = 1
     if (outdim == 1):
         c_mode = flap.CoordinateMode(equidistant=False)
         coord.append(flap.Coordinate(name='ADC Channel',
@@ -483,7 +1312,7 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=[len(adc_proc)],
                                      values=np.array(adc_proc),
-                                     dimension_list=[1]
+                                     dimension_list=[first_dim]
                                      )
                      )
         coord.append(flap.Coordinate(name='Signal name',
@@ -491,14 +1320,14 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=[len(adc_proc)],
                                      values=np.array(chname_proc),
-                                     dimension_list=[1]
+                                     dimension_list=[first_dim]
                                      )
                      )
-        if ('out_row_list' in locals()):
+        if (out_row_list is not None):
             if (len(out_row_list) == 1):
                 dimlist = []
             else:
-                dimlist = [1]
+                dimlist = [first_dim]
             coord.append(flap.Coordinate(name='Row',
                                          unit='n.a.',
                                          mode=c_mode,
@@ -507,11 +1336,11 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                          dimension_list=dimlist
                                          )
                          )
-        if ('out_col_list' in locals()):
+        if (out_col_list is not None):
             if (len(out_col_list) == 1):
                 dimlist = []
             else:
-                dimlist = [1]
+                dimlist = [first_dim]
             coord.append(flap.Coordinate(name='Column',
                                          unit='n.a.',
                                          mode=c_mode,
@@ -530,7 +1359,7 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=c_array.shape,
                                      values=c_array,
-                                     dimension_list=[1,2]
+                                     dimension_list=[first_dim,first_dim + 1]
                                      )
                      )
         maxlen = 0
@@ -545,7 +1374,7 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=c_array.shape,
                                      values=c_array,
-                                     dimension_list=[1,2]
+                                     dimension_list=[first_dim,first_dim + 1]
                                      )
                      )
         coord.append(flap.Coordinate(name='Row',
@@ -553,7 +1382,7 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=[len(out_row_list)],
                                      values=np.array(out_row_list),
-                                     dimension_list=[1]
+                                     dimension_list=[first_dim]
                                      )
                      )
         coord.append(flap.Coordinate(name='Column',
@@ -561,20 +1390,736 @@ def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, co
                                      mode=c_mode,
                                      shape=[len(out_col_list)],
                                      values=np.array(out_col_list),
-                                     dimension_list=[2]
+                                     dimension_list=[first_dim + 1]
                                      )
                      )
-        
-    data_title = camera_family + " data"
-    if (data_arr.ndim == 1):
-        data_title += " " + chname_proc[0]
+    return coord
+
+def _apdcam_data_title(setup):
+    """
+    Returns the data title for the selected channels.
+    """
+    data_title = setup['camera_family'] + " data"
+    if (setup['outdim'] == 1):
+        data_title += " " + setup['chname_proc'][0]
+    return data_title
+
+def _apdcam_data_object(setup, data_arr, error_arr, data_unit, coord):
+    """
+    Creates the flap.DataObject from the data arrays and coordinates.
+    """
     d = flap.DataObject(data_array=data_arr,error=error_arr,data_unit=data_unit,
-                        coordinates=coord, exp_id=None,data_title=data_title)
+                        coordinates=coord, exp_id=None,data_title=_apdcam_data_title(setup))
     return d
 
+def _apdcam_read_request(setup, coordinates, _options):
+    """
+    Determines the samples to read from the coordinate descriptions.
+
+    Returns
+    -------
+    dict
+        The description of the read, the input of _apdcam_load and _apdcam_coordinates.
+
+    """
+    read_range, read_samplerange, read_samples = _apdcam_read_range(coordinates,setup['config'])
+    if (read_samples is not None):
+        if (setup['resample_binsize'] is not None):
+            raise ValueError("Resampling is not possible when individual samples are read.")
+        read_start = read_samples
+        ndata_read = 1
+        ndata_out = 1
+    else:
+        if (read_samplerange.ndim == 2):
+            # Multiple windows, all are read with the length of the shortest one
+            read_start = read_samplerange[:,0].astype(np.int64)
+            ndata_read = int(np.amin(read_samplerange[:,1] - read_samplerange[:,0]) + 1)
+        else:
+            read_start = int(read_samplerange[0])
+            ndata_read = int(read_samplerange[1] - read_samplerange[0] + 1)
+        if (_options['Resample'] is not None):
+            ndata_out = int(ndata_read / setup['resample_binsize']) 
+            ndata_read = ndata_out * setup['resample_binsize']
+        else:
+            ndata_out = ndata_read
+    return {'read_range':read_range,
+            'read_samplerange':read_samplerange,
+            'read_samples':read_samples,
+            'read_start':read_start,
+            'ndata_read':ndata_read,
+            'ndata_out':ndata_out
+            }
+
+def _apdcam_load(setup, request, _options, no_data=False, channels=None):
+    """
+    Reads the data described by a request from _apdcam_read_request. Data of multiple windows
+    is returned with the window as the first dimension.
+    """
+    data_arr, error_arr, data_unit = _apdcam_read_data(setup,
+                                                       request['read_start'],
+                                                       request['ndata_read'],
+                                                       _options,
+                                                       no_data=no_data,
+                                                       channels=channels
+                                                       )
+    read_samplerange = request['read_samplerange']
+    if ((request['read_samples'] is None) and (read_samplerange.ndim == 2)):
+        # Splitting the time dimension to window and time in window
+        n_window = read_samplerange.shape[0]
+        data_arr = data_arr.reshape((n_window,request['ndata_out']) + data_arr.shape[1:])
+        if (error_arr is not None):
+            error_arr = error_arr.reshape((n_window,request['ndata_out']) + error_arr.shape[1:])
+    return data_arr, error_arr, data_unit
+
+def _apdcam_coordinates_for_request(setup, request):
+    """
+    Creates the coordinates for a request from _apdcam_read_request.
+    """
+    return _apdcam_coordinates(setup,
+                               request['read_range'],
+                               request['read_samplerange'],
+                               request['ndata_out'],
+                               read_samples=request['read_samples']
+                               )
+
+def _apdcam_slice_hull(description):
+    """
+    Returns the range of coordinate values covered by a slicing description of flap.slice_data.
+
+    Returns
+    -------
+    (lo, hi) or None
+        The lowest and highest coordinate value, None if the description is not understood.
+
+    """
+    if (type(description) is flap.Intervals):
+        if (description.step is not None):
+            return float(np.amin(description.start)), np.inf
+        return float(np.amin(description.start)), float(np.amax(description.stop))
+    if (type(description) is slice):
+        if (description.start is None):
+            lo = -np.inf
+        else:
+            lo = float(description.start)
+        if (description.stop is None):
+            hi = np.inf
+        else:
+            hi = float(description.stop)
+        return lo, hi
+    try:
+        values = np.array(description)
+    except Exception:
+        return None
+    if ((values.size == 0) or (values.dtype.kind not in 'iuf')):
+        return None
+    return float(np.amin(values)), float(np.amax(values))
+
+class APDCAM_DataObject(flap.DataObject):
+    """
+    A flap.DataObject whose data is read from the channel files only when it is first accessed.
+    Returned by apdcam_get_data with option 'Lazy'. 
+    
+    slice_data() on an object which is not read yet reads only the time interval and the channels
+    needed for the slicing, then slices this smaller object with flap. Summing is also done on the
+    smaller object. The result is identical to slicing the fully read object.
+    """
+    def __init__(self, setup, request, _options):
+        self._data = None
+        self._error = None
+        self._reader = None
+        shape = _apdcam_out_shape(setup,request['ndata_out'])
+        if ((request['read_samples'] is None) and (request['read_samplerange'].ndim == 2)):
+            shape = (request['read_samplerange'].shape[0],) + shape
+        super().__init__(data_array=None,
+                         error=None,
+                         data_unit=_apdcam_data_unit(_options),
+                         coordinates=_apdcam_coordinates_for_request(setup,request),
+                         exp_id=None,
+                         data_title=_apdcam_data_title(setup),
+                         data_shape=shape
+                         )
+        self._reader = (setup,request,_options)
+        
+    @property
+    def data(self):
+        if (self._reader is not None):
+            self._load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        if (value is not None):
+            # Setting the data replaces the data in the files
+            self._reader = None
+        self._data = value
+
+    @property
+    def error(self):
+        if ((self._reader is not None) and (self._reader[0]['resample_binsize'] is not None)
+            and (self._reader[2]['Resample method'] != 'FIR')):
+            self._load()
+        return self._error
+
+    @error.setter
+    def error(self, value):
+        self._error = value
+
+    def is_loaded(self):
+        """
+        Returns True if the data has been read from the files.
+        """
+        return self._reader is None
+
+    def _load(self):
+        setup, request, _options = self._reader
+        self._data, self._error, data_unit = _apdcam_load(setup,request,_options)
+        self._reader = None
+
+    def _sub_object(self, slicing):
+        """
+        Reads the part of the data which is needed for slicing. Returns None if this is not
+        possible, then the whole data should be read.
+        """
+        setup, request, _options = self._reader
+        if ((request['read_samples'] is not None) or (request['read_samplerange'].ndim != 1)):
+            return None
+        t = setup['config']
+        sampletime = float(t['sampletime'])
+        ndata_out = request['ndata_out']
+        if (setup['resample_binsize'] is not None):
+            binsize = setup['resample_binsize']
+        else:
+            binsize = 1
+        if (request['read_range'] is None):
+            time0 = float(t['starttime']) + request['read_samplerange'][0] * sampletime
+        else:
+            time0 = request['read_range'][0]
+        # The first and last output sample needed
+        k_range = [0,ndata_out - 1]
+        # The channels needed
+        ch_sel = np.ones(len(setup['chname_proc']),dtype=bool)
+        for name in slicing:
+            hull = None
+            if (name in ('Time','Sample')):
+                hull = _apdcam_slice_hull(slicing[name])
+                if (hull is None):
+                    continue
+                if (name == 'Time'):
+                    k = (np.array(hull) - time0) / sampletime
+                else:
+                    k = np.array(hull) - request['read_samplerange'][0]
+                # A margin of one sample on both sides, the exact selection is done by flap
+                k = (k - binsize / 2) / binsize
+                with np.errstate(invalid='ignore'):
+                    k_lo = int(np.clip(np.floor(k[0]) - 1,0,ndata_out - 1))
+                    k_hi = int(np.clip(np.ceil(k[1]) + 1,0,ndata_out - 1))
+                k_range = [max(k_range[0],k_lo),min(k_range[1],k_hi)]
+            elif (name == 'Signal name'):
+                names = slicing[name]
+                if (type(names) is str):
+                    names = [names]
+                try:
+                    names = [str(n) for n in names]
+                except TypeError:
+                    continue
+                ch_sel &= np.array([any(fnmatch.fnmatch(ch,n) for n in names) for ch in setup['chname_proc']])
+            elif (name in ('ADC Channel','Row','Column')):
+                if (name == 'ADC Channel'):
+                    values = np.array(setup['adc_proc'])
+                elif (setup['outdim'] != 3):
+                    continue
+                elif (name == 'Row'):
+                    values = np.array(setup['row_proc'])
+                else:
+                    values = np.array(setup['col_proc'])
+                hull = _apdcam_slice_hull(slicing[name])
+                if (hull is None):
+                    continue
+                # Extending the range to the nearest existing values
+                lo, hi = hull
+                if (np.any(values <= lo)):
+                    lo = np.amax(values[values <= lo])
+                if (np.any(values >= hi)):
+                    hi = np.amin(values[values >= hi])
+                ch_sel &= (values >= lo) & (values <= hi)
+        if (k_range[0] > k_range[1]):
+            return None
+        channels = np.nonzero(ch_sel)[0].tolist()
+        if (len(channels) == 0):
+            channels = None
+        elif (len(channels) == len(ch_sel)):
+            channels = None
+        sub_request = dict(request)
+        sub_request['read_start'] = request['read_start'] + k_range[0] * binsize
+        sub_request['ndata_out'] = k_range[1] - k_range[0] + 1
+        sub_request['ndata_read'] = sub_request['ndata_out'] * binsize
+        sub_request['read_samplerange'] = np.array([sub_request['read_start'],
+                                                    sub_request['read_start'] + sub_request['ndata_read'] - 1])
+        sub_request['read_range'] = np.array([time0 + k_range[0] * binsize * sampletime,
+                                              time0 + (k_range[1] + 1) * binsize * sampletime])
+        data_arr, error_arr, data_unit = _apdcam_load(setup,sub_request,_options,channels=channels)
+        return _apdcam_data_object(setup,data_arr,error_arr,data_unit,
+                                   _apdcam_coordinates_for_request(setup,sub_request))
+
+    def slice_data(self, slicing=None, summing=None, options=None):
+        """
+        flap.DataObject.slice_data. If the data is not read yet only the part of it needed 
+        for the slicing is read.
+        """
+        if ((self._reader is None) or (slicing is None) or (type(slicing) is not dict)):
+            return super().slice_data(slicing=slicing,summing=summing,options=options)
+        d = self._sub_object(slicing)
+        if (d is None):
+            return super().slice_data(slicing=slicing,summing=summing,options=options)
+        return d.slice_data(slicing=slicing,summing=summing,options=options)
+
+def apdcam_get_data(exp_id=None, data_name=None, no_data=False, options=None, coordinates=None, data_source=None,
+                    ):
+    """ 
+    Data read function for APDCAM 1G and 10G.
+    
+    Parameters
+    ----------
+    data_name: string
+               ADCxxx: ADC number. Unix style regular expressions are allowed:
+                       ADC*
+                       ADC[2-5]
+                       Can also be a list of data names, eg. ['ADC1','ADC3']
+               APD-r-c (string): APD pixel number
+    coordinates: List of flap.Coordinate() or a single flap.Coordinate
+                 Defines read ranges. The following coordinates are interpreted:
+                     'Sample': The read samples
+                     'Time': The read times
+                 The range can be given in c_range as
+                     [start,end]: A single range.
+                     [[start1,end1],[start2,end2],...]: Multiple intervals. Each channel file is
+                         opened once and all intervals are read with the length of the shortest one.
+                         The output has an extra first dimension, 'Window'. Time and Sample 
+                         become 2D coordinates, 'Rel. Time' is the time in the window.
+                 Non-equidistant Time or Sample coordinate with values set reads the 
+                 individual samples (nearest to the times) into a non-equidistant time axis.
+                 Use option "Resample" to resample the signal to lower frequency than the 
+                 original sampling frequency.
+    options: dict
+        'Scaling':  'Digit'
+                    'Volt'
+        'Datapath': Data path (string)
+        'Camera type': string
+                        None: Determine camera type from xml file
+                        string: Set camera type as below.
+                        The camera type:
+                         APDCAM-10G:
+                             APDCAM-10G_4x32
+                             APDCAM-10G_8x8
+                             APDCAM-10G_4x16
+                             APDCAM-10G_8x16
+                             APDCAM-10G_8x16A
+                             APDCAM-10G_FC
+                         APDCAM-1G: 
+                             APDCAM-1G : Standard APDCAM-1G (Horizontal array)
+                             APDCAM-1G_90: APDCAM-1G with sensor rotated 90 degree CCW
+                             APDCAM-1G_180: APDCAM-1G with sensor rotated 180 degree CCW
+                             APDCAM-1G_270: APDCAM-1G with sensor rotated 270 degree CCW
+        'Camera_version': int
+            Only applicable to 10G cameras: 0,1,2
+        'Resample': Resample to this frequency [Hz]. Only frequencies below the sampling frequency can be used.
+                    The frequency will be rounded to the integer times the sampling frequency. 
+                    Data will be averaged in blocks and the variance in blocks will be added as error.
+        'Resample method': string
+                    'Average': Average in blocks (boxcar). The default.
+                    'FIR': Anti-aliasing windowed-sinc lowpass filter and decimation (see apdcam_fir.py).
+                           The output samples have the same times as with 'Average', no error is
+                           calculated. At the ends of the measurement the first and last samples 
+                           are repeated for the filter.
+        'Offset timerange': [start,end]
+                  Subtract the mean of each channel in this time range [s]. The offsets are scaled
+                  as the data. They are calculated only once for a shot and time range and stored in
+                  APDCAM_offsets.json in the data directory. The default is None, no subtraction.
+        'Memmap': bool
+                  If True the channel files are memory mapped instead of read. Time/Sample ranges become
+                  views of the mapped files and data is read from disk only when it is accessed.
+                  A single channel read without resampling and scaling returns the memory mapped
+                  array itself, no copy is made.
+        'Read threads': int
+                  The number of threads reading the channel files in parallel. Each thread reads,
+                  resamples and scales a group of channels into the output array. The result is 
+                  identical to the single thread read. The default is 1.
+        'Channel major': bool
+                  If True the output array is allocated so as the time series of each channel is 
+                  contiguous in memory (Fortran order). Channel files are then read directly
+                  into the output array. The dimensions of the data are not changed.
+                  The default is False.
+        'Dtype': string or numpy dtype
+                  The data type of the data and error: 'int16', 'float32' or 'float64'. 
+                  int16 is possible only for Digit scaling without resampling. float32 
+                  represents the 14 bit ADC data without loss. All conversions are done 
+                  in the output array. 
+                  The default is None: int16 for Digit data, float64 if resampled or scaled to Volt.
+        'Overview': bool
+                  If True and the overview of the measurement was built with apdcam_build_overview 
+                  resampled data is calculated from the overview when the bin size and the start sample
+                  are multiples of one of its decimation factors. The overview stores float32 means 
+                  and RMS values, so the result agrees with resampling the raw data only within 
+                  float32 precision (about 1e-4 digit). Otherwise the raw data is resampled. 
+                  The default is False.
+        'Profile': bool or APDCAM_profile
+                  True: Record the time, I/O and memory of the processing stages in 
+                        apdcam_global_profile, which aggregates over calls.
+                  APDCAM_profile: Record into this profile.
+                  See apdcam_profile.py. The default is False.
+        'Lazy': bool
+                  If True an APDCAM_DataObject is returned and the channel files are read only 
+                  when the data is first accessed. slice_data() on this object reads only 
+                  the time interval and channels needed for the slicing. The default is False.
+   
+    Return value
+    ------------
+    flap.DataObject:
+        The output flap data object. The data dimension depends on the requested channels.
+        If only 1 channel is requested: 1D
+        If any of the channels is ADCxxx or the camera is FC type or the requested channels
+        do not form a 2D array: 2D
+        If the camera is 2D and the requested channels form a regular 2D subarray of it: 3D
+            
+    """
+
+    if (data_source is None):
+        data_source = 'APDCAM'
+
+    _options = flap.config.merge_options(copy.deepcopy(_default_options),options,data_source=data_source)
+    profile = _options['Profile']
+    if (profile is True):
+        profile = apdcam_global_profile
+    elif (profile is False):
+        profile = None
+    if (profile is not None):
+        profile.start()
+    try:
+        with profile_stage('get_data'):
+            with profile_stage('select'):
+                setup = _apdcam_setup(data_name,_options)
+                request = _apdcam_read_request(setup,coordinates,_options)
+            if (_options['Lazy'] and not no_data):
+                return APDCAM_DataObject(setup,request,_options)
+            data_arr, error_arr, data_unit = _apdcam_load(setup,request,_options,no_data=no_data)
+            with profile_stage('coordinates'):
+                coord = _apdcam_coordinates_for_request(setup,request)
+            with profile_stage('data_object'):
+                return _apdcam_data_object(setup,data_arr,error_arr,data_unit,coord)
+    finally:
+        if (profile is not None):
+            profile.stop()
+
+def iter_apdcam_chunks(datapath=None, data_name=None, chunk_samples=1000000, overlap=0, coordinates=None,
+                       options=None, output_type='DataObject', data_source=None):
+    """
+    Iterates over consecutive time blocks of an APDCAM shot. Only one block is in memory at a time,
+    this way long measurements can be processed in bounded memory. Channel selection, options and
+    coordinates are interpreted as in apdcam_get_data.
+
+    Parameters
+    ----------
+    datapath : string or None, optional
+        The data path. If None the 'Datapath' option is used.
+    data_name : string or list of strings
+        The channel names as in apdcam_get_data.
+    chunk_samples : int, optional
+        The number of raw samples in one block. If 'Resample' is set this should be
+        an integer multiple of the resample bin size. The default is 1000000.
+    overlap : int, optional
+        The number of raw samples overlapping between consecutive blocks. If 'Resample' is set this
+        should be an integer multiple of the resample bin size. The default is 0.
+    coordinates : flap.Coordinate or list of flap.Coordinate, optional
+        Time or Sample range to process. The default is None, the whole measurement.
+    options : dict, optional
+        The options of apdcam_get_data.
+    output_type : string, optional
+        'DataObject': The blocks are returned as flap.DataObject.
+        'Array': The blocks are returned as a tuple of numpy arrays: (data, error, sample, time),
+                 where sample and time are the Sample and Time coordinates along the first
+                 dimension of the data. error is None if no resampling was done.
+        The default is 'DataObject'.
+    data_source : string, optional
+        The data source name. The default is 'APDCAM'.
+
+    Yields
+    ------
+    flap.DataObject or tuple of numpy arrays
+        The consecutive blocks of data.
+
+    """
+    if (data_source is None):
+        data_source = 'APDCAM'
+    _options = flap.config.merge_options(copy.deepcopy(_default_options),options,data_source=data_source)
+    if (datapath is not None):
+        _options['Datapath'] = datapath
+    if ((output_type != 'DataObject') and (output_type != 'Array')):
+        raise ValueError("Invalid output_type: {:s}".format(str(output_type)))
+    setup = _apdcam_setup(data_name,_options)
+    t = setup['config']
+    read_range, read_samplerange, read_samples = _apdcam_read_range(coordinates,t)
+    if ((read_samples is not None) or (read_samplerange.ndim != 1)):
+        raise ValueError("Only a single Time or Sample range can be processed in blocks.")
+    if (setup['resample_binsize'] is not None):
+        binsize = setup['resample_binsize']
+    else:
+        binsize = 1
+    if ((chunk_samples % binsize != 0) or (overlap % binsize != 0)):
+        raise ValueError("chunk_samples and overlap should be integer multiples of the resample bin size ({:d}).".format(binsize))
+    if ((overlap < 0) or (overlap >= chunk_samples)):
+        raise ValueError("overlap should be non-negative and less than chunk_samples.")
+
+    start = int(read_samplerange[0])
+    last = int(read_samplerange[1])
+    while (start <= last):
+        ndata_out = min(chunk_samples,last - start + 1) // binsize
+        if (ndata_out == 0):
+            break
+        ndata_read = ndata_out * binsize
+        data_arr, error_arr, data_unit = _apdcam_read_data(setup,start,ndata_read,_options)
+        chunk_samplerange = np.array([start,start + ndata_read - 1])
+        if (output_type == 'DataObject'):
+            coord = _apdcam_coordinates(setup,None,chunk_samplerange,ndata_out)
+            yield _apdcam_data_object(setup,data_arr,error_arr,data_unit,coord)
+        else:
+            if (setup['resample_binsize'] is not None):
+                sample = start + binsize / 2 + np.arange(ndata_out) * binsize
+            else:
+                sample = start + np.arange(ndata_out)
+            time = float(t['starttime']) + sample * float(t['sampletime'])
+            yield data_arr, error_arr, sample, time
+        if (start + ndata_read > last):
+            break
+        start += chunk_samples - overlap
+
+def _apdcam_shot_worker(datapath, data_name, coordinates, options, data_source):
+    """
+    Reads one shot in a worker process of iter_apdcam_shots.
+    """
+    _options = copy.deepcopy(options)
+    _options['Datapath'] = datapath
+    # The data is sent back to the main process, it is read here
+    _options['Lazy'] = False
+    _options['Memmap'] = False
+    return apdcam_get_data(data_name=data_name,options=_options,coordinates=coordinates,data_source=data_source)
+
+def iter_apdcam_shots(datapaths, data_name=None, coordinates=None, options=None, processes=None, data_source=None):
+    """
+    Reads the same channels from multiple shots in parallel processes. The shots are 
+    returned as they are finished, in arbitrary order. An error in a shot does not stop 
+    the reading of the other shots.
+
+    Parameters
+    ----------
+    datapaths : list of strings
+        The data directories of the shots.
+    data_name : string or list of strings
+        The channel names as in apdcam_get_data.
+    coordinates : flap.Coordinate or list of flap.Coordinate, optional
+        The Time or Sample range as in apdcam_get_data. The same for all shots.
+    options : dict, optional
+        The options of apdcam_get_data. 'Datapath' is set from datapaths.
+    processes : int or None, optional
+        The number of worker processes. None: the number of processors. 0 or 1: The shots are
+        read one after the other in this process. The default is None.
+    data_source : string, optional
+        The data source name. The default is 'APDCAM'.
+
+    Yields
+    ------
+    i_shot : int
+        The index of the shot in datapaths.
+    data : flap.DataObject or None
+        The data of the shot, None if reading failed.
+    error : Exception or None
+        The exception raised when reading the shot, None if reading was successful.
+
+    """
+    if (data_source is None):
+        data_source = 'APDCAM'
+    if (options is None):
+        _options = {}
+    else:
+        _options = dict(options)
+    datapaths = list(datapaths)
+    if ((processes is not None) and (processes <= 1)):
+        for i_shot,datapath in enumerate(datapaths):
+            try:
+                d = _apdcam_shot_worker(datapath,data_name,coordinates,_options,data_source)
+            except Exception as e:
+                yield i_shot, None, e
+            else:
+                yield i_shot, d, None
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {}
+        for i_shot,datapath in enumerate(datapaths):
+            f = executor.submit(_apdcam_shot_worker,datapath,data_name,coordinates,_options,data_source)
+            futures[f] = i_shot
+        for f in concurrent.futures.as_completed(futures):
+            try:
+                d = f.result()
+            except Exception as e:
+                yield futures[f], None, e
+            else:
+                yield futures[f], d, None
+
+def apdcam_get_data_multishot(datapaths, data_name=None, coordinates=None, options=None, processes=None,
+                              stack=False, data_source=None):
+    """
+    Reads the same channels from multiple shots in parallel processes. See iter_apdcam_shots
+    for processing the shots as they are read.
+
+    Parameters
+    ----------
+    datapaths : list of strings
+        The data directories of the shots.
+    data_name : string or list of strings
+        The channel names as in apdcam_get_data.
+    coordinates : flap.Coordinate or list of flap.Coordinate, optional
+        The Time or Sample range as in apdcam_get_data. The same for all shots.
+    options : dict, optional
+        The options of apdcam_get_data. 'Datapath' is set from datapaths.
+    processes : int or None, optional
+        The number of worker processes. None: the number of processors. 0 or 1: The shots are
+        read one after the other in this process. The default is None.
+    stack : bool, optional
+        False: Return a list of DataObjects.
+        True: Return one DataObject with a new first dimension for the shots. 'Shot' is the 
+              index of the shot in datapaths, 'Datapath' is the data directory. All other 
+              coordinates are taken from the first shot. Shots with data shape different from the
+              first shot are reported as failed. 
+        The default is False.
+    data_source : string, optional
+        The data source name. The default is 'APDCAM'.
+
+    Returns
+    -------
+    data : list of flap.DataObject or flap.DataObject
+        The data of the shots, None for failed shots. If stack is True the stacked 
+        DataObject, None if all shots failed.
+    errors : dict
+        The exception for each failed shot, the keys are the indices in datapaths.
+
+    """
+    datapaths = list(datapaths)
+    data = [None] * len(datapaths)
+    errors = {}
+    for i_shot, d, e in iter_apdcam_shots(datapaths,data_name=data_name,coordinates=coordinates,options=options,
+                                          processes=processes,data_source=data_source):
+        if (e is not None):
+            errors[i_shot] = e
+        else:
+            data[i_shot] = d
+    if (not stack):
+        return data, errors
+    
+    ok_list = [i for i in range(len(datapaths)) if data[i] is not None]
+    if (len(ok_list) == 0):
+        return None, errors
+    d0 = data[ok_list[0]]
+    for i in ok_list[1:]:
+        if (data[i].data.shape != d0.data.shape):
+            errors[i] = ValueError("Data shape {:s} is different from the first shot {:s}.".format(
+                                   str(data[i].data.shape),str(d0.data.shape)))
+    ok_list = [i for i in ok_list if i not in errors]
+    data_arr = np.empty((len(ok_list),) + d0.data.shape,dtype=d0.data.dtype)
+    if (d0.error is not None):
+        error_arr = np.empty((len(ok_list),) + d0.data.shape,dtype=d0.error.dtype)
+    else:
+        error_arr = None
+    for j,i in enumerate(ok_list):
+        data_arr[j] = data[i].data
+        if (error_arr is not None):
+            error_arr[j] = data[i].error
+        # Releasing the shot data as soon as it is copied
+        data[i] = None
+    coord = []
+    c_mode = flap.CoordinateMode(equidistant=False)
+    coord.append(flap.Coordinate(name='Shot',
+                                 unit='n.a.',
+                                 mode=c_mode,
+                                 shape=[len(ok_list)],
+                                 values=np.array(ok_list),
+                                 dimension_list=[0]
+                                 )
+                 )
+    coord.append(flap.Coordinate(name='Datapath',
+                                 unit='n.a.',
+                                 mode=c_mode,
+                                 shape=[len(ok_list)],
+                                 values=np.array([datapaths[i] for i in ok_list]),
+                                 dimension_list=[0]
+                                 )
+                 )
+    for c in d0.coordinates:
+        c_new = copy.deepcopy(c)
+        c_new.dimension_list = [dim + 1 for dim in c.dimension_list]
+        coord.append(c_new)
+    d = flap.DataObject(data_array=data_arr,error=error_arr,data_unit=d0.data_unit,
+                        coordinates=coord,exp_id=None,data_title=d0.data_title)
+    return d, errors
+
+def add_coordinate(data_object, new_coordinates, options=None, exp_id=None):
+    """
+    Adds spatial coordinates to a data object read by apdcam_get_data. The coordinates are
+    looked up for each channel using the ADC Channel coordinate, they have the same shape and
+    dimensions. Existing coordinates with the same names are replaced.
+
+    Parameters
+    ----------
+    data_object : flap.DataObject
+        The data object.
+    new_coordinates : string or list of strings
+        The coordinate names: 'Device x', 'Device y' [mm] or a coordinate defined in the geometry file.
+    options : dict, optional
+        'Geometry file': string
+            The geometry file of the camera, see apdcam_geometry.py for the format.
+        'Datapath', 'Camera type', 'Camera version':
+            Determine the camera as in apdcam_get_data.
+    exp_id : not used
+
+    Returns
+    -------
+    flap.DataObject
+        The data object with the new coordinates.
 
-def add_coordinate(data_object, new_coordinates, options=None):
-    raise NotImplementedError("Coordinate conversions not implemented yet.")
+    """
+    data_source = data_object.data_source
+    if (data_source is None):
+        data_source = 'APDCAM'
+    _options = flap.config.merge_options(copy.deepcopy(_default_options),options,data_source=data_source)
+    if (type(new_coordinates) is not list):
+        new_coordinates = [new_coordinates]
+    if (_options['Geometry file'] is None):
+        raise ValueError("The 'Geometry file' option is needed for spatial coordinates.")
+    meta = apdcam_shot_metadata(_options['Datapath'])
+    coord_tables = apdcam_coordinate_tables(_apdcam_camera_tables(meta,_options),_options['Geometry file'])
+    for name in new_coordinates:
+        if (name not in coord_tables.values):
+            raise ValueError("Coordinate '{:s}' is not defined in {:s}".format(name,_options['Geometry file']))
+    try:
+        c_adc = data_object.get_coordinate_object('ADC Channel')
+    except Exception:
+        raise ValueError("The data object has no ADC Channel coordinate.")
+    adc = np.asarray(c_adc.values,dtype=int)
+    c_mode = flap.CoordinateMode(equidistant=False)
+    for name in new_coordinates:
+        values = coord_tables.values[name][adc]
+        if (values.ndim == 0):
+            shape = [1]
+        else:
+            shape = values.shape
+        data_object.coordinates = [c for c in data_object.coordinates if (c.unit.name != name)]
+        data_object.add_coordinate_object(flap.Coordinate(name=name,
+                                                          unit=coord_tables.units[name],
+                                                          mode=c_mode,
+                                                          shape=shape,
+                                                          values=values,
+                                                          dimension_list=copy.copy(c_adc.dimension_list)
+                                                          )
+                                          )
+    return data_object
 
 def register(data_source=None):
     if (data_source is None):